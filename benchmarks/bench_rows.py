@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+Micro-Benchmark: Umwandlung der db.query-Ergebnisse in Zeilen
+
+Vergleicht die frühere Umwandlung in select/query (Namenssuche pro Zelle)
+mit make_rows (Spaltennamen einmal pro Ergebnis; dict(zip(...))) und mit den
+kompakten Row-Objekten; ausgegeben werden die Zeit pro Ergebnis und die
+Größe einer Zeile (sys.getsizeof, ohne die Werte).
+
+Aufruf:
+    python benchmarks/bench_rows.py [ROWS [COLUMNS]]
+"""
+# Python compatibility:
+from __future__ import absolute_import, print_function
+
+from six.moves import range
+
+# Standard library:
+import sys
+from timeit import repeat
+
+# visaplan:
+from visaplan.plone.sqlwrapper.rows import make_rows
+
+
+def legacy_rows(queryResult):
+    """
+    Die frühere Umwandlung aus Adapter.select und Adapter.query
+    """
+    result = []
+    if not queryResult[1]:
+        return result
+    for row in queryResult[1]:
+        res = {}
+        for i in range(len(row)):
+            value = row[i]
+            name = queryResult[0][i]['name']
+            res[name] = value
+        result.append(res)
+    return result
+
+
+def make_result(rows, columns):
+    description = [{'name': 'column_%d' % i, 'type': 's'}
+                   for i in range(columns)]
+    data = [tuple(range(r, r + columns)) for r in range(rows)]
+    return description, data
+
+
+def main(rows=50000, columns=12, number=3):
+    sqlres = make_result(rows, columns)
+    candidates = [('legacy', legacy_rows),
+                  ('dict', make_rows),
+                  ('compact', lambda res: make_rows(res, compact=True)),
+                  ]
+    print('%d rows, %d columns (best of 3, %d runs each)'
+          % (rows, columns, number))
+    baseline = None
+    for label, func in candidates:
+        best = min(repeat(lambda: func(sqlres), number=number, repeat=3)
+                   ) / number
+        if baseline is None:
+            baseline = best
+        size = sys.getsizeof(func(sqlres)[0])
+        print('%-8s %8.1f ms  %5.2fx  %5d bytes/row'
+              % (label, best * 1000, baseline / best, size))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
+
+# vim: ts=8 sts=4 sw=4 si et
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+Benchmark-Suite: Erzeugung der Statements und Umwandlung der Ergebnisse
+
+Gemessen wird der Aufwand pro Aufruf, den jeder Seitenaufruf bezahlt:
+die Hilfsfunktionen des utils-Moduls (check_name, replace_names,
+make_where_mask, make_grouping_wrapper, make_returning_clause,
+generate_dicts) sowie select und query des Adapters, mit einer Verbindung,
+die ein vorbereitetes Ergebnis zurückgibt (also ohne Datenbank; gemessen
+werden Statement-Erzeugung und Umwandlung der Zeilen in Dictionarys).
+
+Die Ergebnisse (Mikrosekunden pro Aufruf, jeweils das beste von <repeat>
+Durchläufen) können als JSON gespeichert und mit einem früheren Lauf
+verglichen werden; bei --compare ist der Exit-Code 1, wenn ein Fall um mehr
+als --tolerance langsamer geworden ist.
+
+Aufruf:
+    python benchmarks/bench_statements.py [--json FILE] [--compare FILE]
+                                          [--rows N] [--columns N]
+                                          [--tolerance 0.2] [--only NAME]
+"""
+# Python compatibility:
+from __future__ import absolute_import, print_function
+
+from six.moves import range
+
+# Standard library:
+import json
+import platform
+import sys
+import time
+from argparse import ArgumentParser
+from timeit import repeat
+
+# visaplan:
+from visaplan.plone.sqlwrapper.adapter import Adapter
+from visaplan.plone.sqlwrapper.placeholders import render
+from visaplan.plone.sqlwrapper.utils import (
+    check_name,
+    generate_dicts,
+    make_grouping_wrapper,
+    make_returning_clause,
+    make_where_mask,
+    replace_names,
+    )
+
+TABLE = 'unitracc_tan'
+
+
+class CannedConnection(object):
+    """
+    Verbindung mit dem query-Protokoll der Zope-Datenbankadapter, die
+    immer dasselbe Ergebnis zurückgibt
+    """
+
+    db_name = 'benchmark'
+
+    def __init__(self, result):
+        self.result = result
+        self.queries = 0
+
+    def query(self, query_string, max_rows=None, query_data=None):
+        self.queries += 1
+        return self.result
+
+
+def make_result(rows, columns):
+    """
+    Ein Ergebnis wie von db.query: Spaltenbeschreibungen und Zeilen
+    (gemischte Werte, wie bei einer typischen Tabelle)
+    """
+    description = [{'name': 'column_%d' % i, 'type': 's', 'width': None,
+                    'null': None, 'precision': None, 'scale': None}
+                   for i in range(columns)]
+    data = []
+    for r in range(rows):
+        row = []
+        for i in range(columns):
+            if i % 3 == 0:
+                row.append(r + i)
+            elif i % 3 == 1:
+                row.append(u'value %d/%d' % (r, i))
+            else:
+                row.append(None)
+        data.append(tuple(row))
+    return description, data
+
+
+def make_cases(rows, columns):
+    """
+    Gib eine Liste von (Name, Funktion, Anzahl) zurück
+    """
+    fields = ['column_%d' % i for i in range(columns)]
+    query_data = dict([(name, i) for i, name in enumerate(fields[:5])])
+    query_data['column_5'] = [1, 2, 3]
+    single = make_result(1, columns)
+    many = make_result(rows, columns)
+    returned = make_result(rows, 1)
+    small = Adapter.from_connection(CannedConnection(single))
+    large = Adapter.from_connection(CannedConnection(many))
+    query = ('SELECT %s FROM %%(table)s WHERE column_0 = %%%%(column_0)s;'
+             % ', '.join(fields))
+    names = {'table': TABLE}
+    where_query = 'SELECT * FROM %s %s;' % (TABLE,
+                                            make_where_mask(query_data))
+    grouping = ['column_0', ('column_1', None, 'label'),
+                ('column_2', 'MAX'), ('column_3', 'COUNT')]
+    return [
+        ('check_name', lambda: check_name('schema.' + TABLE), 100000),
+        ('replace_names', lambda: replace_names(query, **names), 20000),
+        ('make_where_mask', lambda: make_where_mask(query_data, fields),
+         20000),
+        ('make_grouping_wrapper',
+         lambda: make_grouping_wrapper(TABLE, {'column_0': 1}, grouping),
+         20000),
+        ('make_returning_clause', lambda: make_returning_clause(fields[:4]),
+         100000),
+        ('render_numeric',
+         lambda: render(where_query, query_data, 'numeric'), 100000),
+        ('generate_dicts', lambda: list(generate_dicts(returned, 'id')), 20),
+        ('select_one_row',
+         lambda: small.select(TABLE, fields, query_data={'column_0': 1}),
+         10000),
+        ('select_rows',
+         lambda: large.select(TABLE, fields, query_data={'column_0': 1}),
+         10),
+        ('select_rows_compact',
+         lambda: large.select(TABLE, fields, query_data={'column_0': 1},
+                              compact=True),
+         10),
+        ('query_rows',
+         lambda: large.query(query, names, {'column_0': 1}),
+         10),
+        ]
+
+
+def run(rows=1000, columns=12, number_factor=1.0, repeats=5, only=None):
+    """
+    Führe die Fälle aus; gib ein Dictionary zurück (für JSON)
+    """
+    results = {}
+    for name, func, number in make_cases(rows, columns):
+        if only and name not in only:
+            continue
+        number = max(1, int(number * number_factor))
+        best = min(repeat(func, number=number, repeat=repeats)) / number
+        results[name] = {'us_per_call': round(best * 1e6, 3),
+                         'number': number,
+                         }
+    return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'rows': rows,
+            'columns': columns,
+            'repeat': repeats,
+            'results': results,
+            }
+
+
+def compare(old, new, tolerance):
+    """
+    Vergleiche zwei Läufe; gib die Liste der Fälle zurück, die um mehr als
+    <tolerance> (Anteil) langsamer geworden sind
+    """
+    regressions = []
+    for name, res in sorted(new['results'].items()):
+        before = old['results'].get(name)
+        if before is None:
+            print('%-24s %12.3f us  (new)' % (name, res['us_per_call']))
+            continue
+        ratio = res['us_per_call'] / before['us_per_call']
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-24s %12.3f us  %12.3f us  %5.2fx%s'
+              % (name, before['us_per_call'], res['us_per_call'], ratio,
+                 flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000,
+                        help='rows per result (default: %(default)s)')
+    parser.add_argument('--columns', type=int, default=12,
+                        help='columns per row (default: %(default)s)')
+    parser.add_argument('--number-factor', type=float, default=1.0,
+                        help='scale the number of calls per case')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs per case; the best is reported')
+    parser.add_argument('--only', action='append',
+                        help='run this case only (repeatable)')
+    parser.add_argument('--json', metavar='FILE',
+                        help='write the results to FILE (- for stdout)')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare with the results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown for --compare'
+                             ' (default: %(default)s)')
+    args = parser.parse_args(argv)
+    data = run(args.rows, args.columns, args.number_factor, args.repeat,
+               args.only)
+    if args.json == '-':
+        print(json.dumps(data, indent=2, sort_keys=True))
+    else:
+        if args.json:
+            with open(args.json, 'w') as fo:
+                json.dump(data, fo, indent=2, sort_keys=True)
+        if not args.compare:
+            print('%(implementation)s %(python)s; %(rows)d rows,'
+                  ' %(columns)d columns' % data)
+            for name, res in sorted(data['results'].items()):
+                print('%-24s %12.3f us' % (name, res['us_per_call']))
+    if args.compare:
+        with open(args.compare) as fi:
+            old = json.load(fi)
+        if args.json == '-':
+            # stdout gehört den JSON-Daten:
+            sys.stdout = sys.stderr
+        if compare(old, data, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim: ts=8 sts=4 sw=4 si et
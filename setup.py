@@ -6,6 +6,7 @@ from __future__ import print_function
 from setuptools import find_packages
 from setuptools import setup
 from os.path import isfile
+import sys
 
 package_name = 'visaplan.plone.sqlwrapper'
 
@@ -75,11 +76,18 @@ long_description = '\n\n'.join([
 # see as well --> src/visaplan/PACKAGE/configure.zcml:
 exclude_subpackages = (
         )
+if sys.version_info < (3, 7):
+    # async/await syntax; would break byte-compilation:
+    exclude_subpackages += ('aio',)
 exclude_packages = []
+exclude_package_data = {}
 for subp in exclude_subpackages:
     exclude_packages.extend([package_name + '.' + subp,
                              package_name + '.' + subp + '.*',
                              ])
+    # not as package data either (include_package_data):
+    exclude_package_data.setdefault(package_name, []).append(
+            subp + '/*')
 packages = find_packages(
             'src',
             exclude=exclude_packages)
@@ -146,10 +154,6 @@ setup_kwargs = dict(
         "Programming Language :: Python",
         "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.3",
-        "Programming Language :: Python :: 3.4",
-        "Programming Language :: Python :: 3.5",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Intended Audience :: Developers",
         "Natural Language :: German",
@@ -168,6 +172,9 @@ setup_kwargs = dict(
         ],
     package_dir={'': 'src'},
     include_package_data=True,
+    exclude_package_data=exclude_package_data,
+    python_requires='>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*, !=3.4.*,'
+                    ' !=3.5.*, !=3.6.*',
     zip_safe=False,
     install_requires=[
         'setuptools',
@@ -175,6 +182,9 @@ setup_kwargs = dict(
         # -*- Extra requirements: -*-
         'visaplan.plone.base',  # adapter base class
         'visaplan.plone.tools',  # logging
+        'transaction',  # after-commit hooks, read_pool threads
+        'zope.annotation',  # per-request state
+        'zope.globalrequest',  # per-request state
         # ... further requirements removed
     ],
     entry_points="""
@@ -1,3 +1,16 @@
 # -*- coding: utf-8 -*-
-# Local imports:
-from .adapter import Adapter as SQLWrapper
+"""
+visaplan.plone.sqlwrapper
+
+Der Adapter (SQLWrapper) braucht Zope und Plone; die übrigen Module
+(u. a. statements, placeholders, standin und das Unterpaket aio) kommen
+ohne aus.  Ohne Zope wird der Adapter hier daher nicht importiert.
+"""
+try:
+    # Zope:
+    import App.config
+except ImportError:
+    pass
+else:
+    # Local imports:
+    from .adapter import Adapter as SQLWrapper
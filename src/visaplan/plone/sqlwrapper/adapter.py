@@ -5,14 +5,13 @@ Adapter sqlwrapper: Schnittstelle zur SQL-Datenbank
 # Python compatibility:
 from __future__ import absolute_import
 
-from six.moves import range
+# Standard library:
+from itertools import chain, count
 
 # Zope:
-from App.config import getConfiguration
-from Products.CMFCore.utils import getToolByName
-
-# 3rd party:
-from exceptions import NotImplementedError
+import transaction
+from zope.annotation.interfaces import IAnnotations
+from zope.globalrequest import getRequest
 
 # visaplan:
 from visaplan.plone.base import Base
@@ -23,16 +22,61 @@ from visaplan.plone.tools.log import getLogSupport
 logger, debug_active, DEBUG = getLogSupport(fn=__file__,
                                             defaultFromDevMode=False)
 # Local imports:
+from . import instrument, qfactory
+from .caching import (
+    data_shape,
+    freeze_data,
+    result_cache,
+    statement_cache,
+    )
+from .catalog import DEFAULT_SCHEMA, column_catalog, qualified_name
+from .connection import database_name, get_connection, zope_environment
+from .copyload import (
+    CopyReader,
+    DictRows,
+    iter_copy_lines,
+    make_copy_statement,
+    )
+from .explain import explain_statement
+from .fanout import READ_METHODS, is_read_only, read_pool
 from .interfaces import ISQLWrapper
+from .placeholders import render as render_placeholders
+from .prepared import configured_threshold
+from .prepared import registry as prepared_registry
+from .replicas import (
+    ReplicaRouter,
+    pin_primary,
+    primary_pinned,
+    replica_router,
+    )
+from .rows import column_names, make_rows, row_factory
+from .statements import (
+    check_update_keys,
+    delete_statement,
+    insert_statement,
+    select_statement,
+    update_statement,
+    )
 from .utils import (
     check_name,
     generate_dicts,
+    is_sequence,
+    iter_chunks,
+    keyset_placeholder,
+    make_conflict_clause,
+    make_multirow_values,
     make_returning_clause,
     make_transaction_cmd,
-    make_where_mask,
+    make_unnest_condition,
+    merge_statements,
+    normalize_sql_snippet,
+    order_specs,
     replace_names,
     )
 
+# für die Namen serverseitiger Cursor (iterselect, iterquery):
+_cursor_numbers = count(1)
+
 
 class Adapter(Base):
     """Klasse für Standard-SQL-Befehle."""
@@ -43,12 +87,14 @@ class Adapter(Base):
 
         **args -- Spezifikation für den SQL-Befehl 'BEGIN TRANSACTION' (optional).
         """
-        conf = getConfiguration()
-        env = conf.environment
-        portal = getToolByName(context, 'portal_url').getPortalObject()
+        db_name = None
         try:
-            db_name = env['DATABASE']
-            self.db = getattr(portal, db_name)._v_database_connection
+            db_name = database_name()
+            if not instrument.configured():
+                instrument.configure(zope_environment())
+            self.db = get_connection(context, db_name)
+            router = replica_router()
+            self.prepare_threshold = configured_threshold()
         except KeyError as e:
             logger.error('!!! Keine Datenbank konfiguriert! (%(e)r)', locals())
             raise
@@ -56,8 +102,146 @@ class Adapter(Base):
             logger.error('!!! Datenbank-Adapter %(db_name)r nicht gefunden! (%(e)r)', locals())
             raise
         else:
-            self._transaction_level = 0
-            self._begin_transaction_tup = args
+            self._setup(db_name, args, context, router)
+
+    @classmethod
+    def from_connection(cls, db, *args):
+        """
+        Erzeuge einen Adapter für die übergebene Verbindung (mit der Methode
+        query(query_string, max_rows, query_data)), ohne Plone-Site und
+        Zope-Konfiguration - z. B. für Tests und Benchmarks:
+
+        >>> from .standin import SQLiteConnection
+        >>> sql = Adapter.from_connection(SQLiteConnection())
+        >>> sql.query('CREATE TABLE tan (id integer, status text);')
+        []
+        >>> list(sql.insert('tan', {'id': 1, 'status': 'new'}, returning='id'))
+        [{'id': 1}]
+
+        Für die prozeßweiten Caches (Tabellenspalten, Ergebnisse) wird das
+        Attribut db_name der Verbindung verwendet, sofern vorhanden.
+        """
+        self = cls.__new__(cls)
+        self.db = db
+        db_name = getattr(db, 'db_name', None)
+        if db_name is None:
+            db_name = 'connection-%x' % id(db)
+        self._setup(db_name, args)
+        return self
+
+    def _setup(self, db_name, args, context=None, router=None):
+        self._db_name = db_name
+        self._transaction_level = 0
+        self._begin_transaction_tup = self._default_transaction_tup = args
+        self._pending = []
+        self._transaction_begun = False
+        self._written = set()
+        # Replikate (siehe das replicas-Modul):
+        self._context = context
+        self.replica_router = router
+        self._replica_dbs = {}
+        self._pinned = False
+        self._tx_replica = None
+
+    def _copy(self, args, context):
+        """
+        Gib einen neuen Adapter für dieselbe Verbindung zurück, mit eigenem
+        Zustand (Transaktion, vorgemerkte Statements, Bindung an die
+        primäre Datenbank); die bereits ermittelten Verbindungen der
+        Replikate werden mitbenutzt.
+        """
+        clone = self.__class__.__new__(self.__class__)
+        clone.db = self.db
+        clone._setup(self._db_name, args, context, self.replica_router)
+        clone._replica_dbs = self._replica_dbs
+        clone.prepare_threshold = self.prepare_threshold
+        return clone
+
+    # ab so vielen Ausführungen werden SELECT-Statements als Prepared
+    # Statements ausgeführt (0: nie; SQL_PREPARE_THRESHOLD in zope.conf):
+    prepare_threshold = 0
+
+    def add_replica(self, name, db, policy=None):
+        """
+        Verwende die Verbindung <db> als Replikat <name> (für Lesezugriffe;
+        z. B. für Adapter aus from_connection).  Ansonsten werden die
+        Replikate konfiguriert (DATABASE_REPLICAS, siehe das
+        replicas-Modul).
+
+        Scheitert eine Abfrage auf dem Replikat, wird sie auf der primären
+        Datenbank wiederholt, und das Replikat wird vorübergehend gemieden:
+
+        >>> from .standin import SQLiteConnection
+        >>> db = SQLiteConnection()
+        >>> sql = Adapter.from_connection(db)
+        >>> sql.query('CREATE TABLE tan (id integer PRIMARY KEY,'
+        ...           ' status text);')
+        []
+        >>> class Down(object):
+        ...     def query(self, *args):
+        ...         raise IOError('replica down')
+        >>> sql.add_replica('r1', Down())
+        >>> sql.select('tan')
+        []
+        >>> sql.replica_router.stats()['down']
+        ['r1']
+        """
+        router = self.replica_router
+        names = []
+        if router is not None:
+            names = router.names
+            if policy is None:
+                policy = router.policy
+        self._replica_dbs[name] = db
+        self.replica_router = ReplicaRouter(names + [name],
+                                            policy or 'round-robin')
+
+    def _route(self):
+        """
+        Gib (Name, Verbindung) des für einen Lesezugriff zu verwendenden
+        Replikats zurück, oder None (primäre Datenbank)
+        """
+        router = self.replica_router
+        if (router is None
+            or self._transaction_level
+            or self._pinned
+            or primary_pinned()
+            ):
+            return None
+        name = router.choose()
+        if name is None:
+            return None
+        db = self._replica_db(name)
+        if db is None:
+            return None
+        return name, db
+
+    def _replica_db(self, name):
+        """
+        Gib die Verbindung des Replikats <name> zurück, oder None.
+        Ohne Kontext (in den Threads von read_pool, siehe _bound_call) wird
+        nur verwendet, was bereits ermittelt wurde: die persistenten
+        Objekte gehören zur ZODB-Verbindung des aufrufenden Threads.
+        """
+        db = self._replica_dbs.get(name)
+        if db is None and self._context is not None:
+            try:
+                db = get_connection(self._context, name)
+            except AttributeError as e:
+                logger.error('Replica %(name)r not found! (%(e)r)', locals())
+                self.replica_router.mark_down(name)
+                return None
+            self._replica_dbs[name] = db
+        return db
+
+    def _pin_primary(self):
+        """
+        Nach Schreibzugriffen: die folgenden Lesezugriffe (im selben
+        Request bzw. mit diesem Adapter) laufen über die primäre Datenbank
+        """
+        if self.replica_router is not None:
+            self._pinned = True
+            pin_primary()
 
     def __enter__(self):
         """
@@ -69,18 +253,100 @@ class Adapter(Base):
               sql.insert(...)
               ...
 
+        Schreibende Statements, deren Ergebnis nicht benötigt wird
+        (insert, update, delete ohne returning), werden im
+        Transaktionskontext nur vorgemerkt und zusammen mit dem nächsten
+        Statement, dessen Ergebnis benötigt wird, bzw. beim Verlassen des
+        Kontexts in einer einzigen Anfrage abgesetzt:
+
+          BEGIN TRANSACTION ...; stmt; stmt; ... COMMIT;
+
+        >>> from .standin import SQLiteConnection
+        >>> db = SQLiteConnection()
+        >>> sql = Adapter.from_connection(db)
+        >>> sql.query('CREATE TABLE tan (id integer PRIMARY KEY,'
+        ...           ' status text);')
+        []
+        >>> queries = db.queries
+        >>> with sql:
+        ...     sql.insert('tan', {'id': 1, 'status': 'new'})
+        ...     sql.insert('tan', {'id': 2, 'status': 'new'})
+        ...     sql.update('tan', {'status': 'used'}, query_data={'id': 1})
+        >>> db.queries - queries
+        1
+        >>> print(', '.join(['%(id)s %(status)s' % row
+        ...                  for row in sql.select('tan', order_by='id')]))
+        1 used, 2 new
         """
         new_transaction = self._transaction_level == 0
+        if new_transaction:
+            self._pending = []
+            self._transaction_begun = False
+            self._written = set()
+            if (self.replica_router is not None
+                and 'READ ONLY' in [normalize_sql_snippet(arg)
+                                    for arg in self._begin_transaction_tup]
+                ):
+                # die ganze Transaktion über dasselbe Replikat:
+                self._tx_replica = self._route()
         self._transaction_level += 1
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         """
         Verlasse den Transaktionskontext; wenn keine Fehler aufgetreten sind,
-        sichere die Änderungen.
+        sichere die Änderungen (COMMIT, zusammen mit den noch vorgemerkten
+        Statements), ansonsten verwirf sie (ROLLBACK).
         """
         assert self._transaction_level >= 1
         self._transaction_level -= 1
+        if self._transaction_level:
+            return
+        pending, self._pending = self._pending, []
+        begun, self._transaction_begun = self._transaction_begun, False
+        written, self._written = self._written, set()
+        begin = self._begin_statement()
+        # die mit __call__ angegebenen Details gelten nur für diesen Kontext:
+        self._begin_transaction_tup = self._default_transaction_tup
+        try:
+            self._end_transaction(exc_type is None, pending, begun, begin)
+        finally:
+            self._tx_replica = None
+            # erst nach COMMIT bzw. ROLLBACK; inzwischen von anderen
+            # Threads gespeicherte Ergebnisse sind ggf. veraltet:
+            if written:
+                self.result_cache.invalidate(*written)
+
+    def _end_transaction(self, success, pending, begun, begin):
+        """
+        Für __exit__: Sende ROLLBACK bzw. ggf. das BEGIN, die vorgemerkten
+        Statements und das COMMIT
+        """
+        if not success:
+            if begun:
+                try:
+                    self._send('ROLLBACK;')
+                except Exception as e:
+                    logger.error('ROLLBACK failed (%(e)r)', locals())
+            return
+        if not (pending or begun):
+            return
+        if self._single_statements():
+            if not begun:
+                self._send(begin)
+            for item in pending:
+                self._send(item[0], None, item[1])
+            self._send('COMMIT;')
+            return
+        items = []
+        if not begun:
+            items.append((begin, None))
+        items.extend(pending)
+        items.append(('COMMIT;', None))
+        query, query_data = merge_statements(items)
+        DEBUG('__exit__:\n   query=%r\n   query_data=%r',
+              query, query_data)
+        self._send(query, None, query_data)
 
     def __call__(self, *args):
         """
@@ -91,13 +357,329 @@ class Adapter(Base):
         self._begin_transaction_tup = args
         return self
 
-    def _execute(self, query, query_data={}, commit=None):
+    # prozeßweiter Cache für die generierten Statements;
+    # siehe statement_cache.stats() und .resize(maxsize):
+    statement_cache = statement_cache
+
+    # prozeßweiter Cache für Abfrageergebnisse (select und query mit
+    # cache=True); siehe result_cache.stats(), .resize(max_bytes), .ttl:
+    result_cache = result_cache
+
+    def _read(self, query, query_data, maxrows, cache, tables,
+              replica=False, prepare=False):
+        """
+        Für select und query: Führe die Abfrage aus, ggf. über den
+        Ergebnis-Cache (cache: True oder eine Verfallszeit in Sekunden).
+        Im Transaktionskontext wird der Cache für Tabellen, in die bereits
+        geschrieben wurde, nicht verwendet.
+        Mit <replica> kann die Abfrage über ein Replikat laufen, mit
+        <prepare> als Prepared Statement (siehe _fetch).
+        """
+        if not cache:
+            return self._fetch(query, query_data, maxrows, replica, prepare)
+        db_name = self._db_name
+        tables = [(db_name, qualified_name(table)) for table in tables]
+        if self._written.intersection(tables):
+            return self._fetch(query, query_data, maxrows, replica, prepare)
+        try:
+            key = (db_name, query, freeze_data(query_data), maxrows)
+        except TypeError:
+            return self._fetch(query, query_data, maxrows, replica, prepare)
+        res = self.result_cache.get(key)
+        if res is not None:
+            DEBUG('result cache hit: %r', key)
+            return res
+        token = self.result_cache.token(tables)
+        res = self._fetch(query, query_data, maxrows, replica, prepare)
+        ttl = None
+        if cache is not True:
+            ttl = cache
+        self.result_cache.put(key, res, tables, ttl, token)
+        return res
+
+    def _fetch(self, query, query_data, maxrows, replica=False,
+               prepare=False):
+        """
+        Führe die (lesende) Abfrage aus, mit <replica> ggf. über ein
+        Replikat; scheitert sie dort, wird sie auf der primären Datenbank
+        wiederholt (und das Replikat ggf. vorübergehend gemieden).
+        Mit <prepare> wird sie (außerhalb von Transaktionen) ggf. als
+        Prepared Statement ausgeführt.
+        """
+        route = replica and self._route() or None
+        if route is None:
+            if prepare and not self._transaction_level:
+                return self._send(query, maxrows, query_data, None, True)
+            return self._execute(query, query_data, maxrows)
+        name, db = route
+        router = self.replica_router
+        try:
+            with router.using(name):
+                return self._send(query, maxrows, query_data, db, prepare)
+        except Exception as e:
+            res = self._execute(query, query_data, maxrows)
+            # ... erfolgreich; das Problem lag also beim Replikat:
+            logger.error('Replica %(name)r failed (%(e)r)', locals())
+            router.mark_down(name)
+            return res
+
+    def invalidate_results(self, *tables):
+        """
+        Verwirf die gespeicherten Abfrageergebnisse für die angegebenen
+        Tabellen; das geschieht automatisch für alle schreibenden Methoden
+        (insert, update, delete usw.), aber nicht für query.
+        Im Transaktionskontext wird es nach dem COMMIT bzw. ROLLBACK
+        wiederholt.
+
+        >>> from .standin import SQLiteConnection
+        >>> db = SQLiteConnection()
+        >>> sql = Adapter.from_connection(db)
+        >>> sql.query('CREATE TABLE tan (id integer PRIMARY KEY,'
+        ...           ' status text);')
+        []
+        >>> queries = db.queries
+        >>> sql.select('tan', cache=True)
+        []
+        >>> sql.select('tan', cache=True)
+        []
+        >>> db.queries - queries
+        1
+        >>> sql.insert('tan', {'id': 1, 'status': 'new'})
+        >>> [row['id'] for row in sql.select('tan', cache=True)]
+        [1]
+        >>> db.queries - queries
+        3
+        """
+        self._pin_primary()
+        db_name = self._db_name
+        tables = [(db_name, qualified_name(table)) for table in tables]
+        if self._transaction_level:
+            self._written.update(tables)
+        self.result_cache.invalidate(*tables)
+
+    def _written_outside(self, table, commit):
+        """
+        Nach einer schreibenden Anweisung außerhalb eines
+        Transaktionskontexts: verwirf die gespeicherten Ergebnisse erneut,
+        denn zwischen dem ersten Verwerfen (invalidate_results) und dem
+        COMMIT können andere Threads noch die alten Zeilen gespeichert haben.
+        Ohne COMMIT (commit=False) geschieht das nach dem Abschluß der
+        Zope-Transaktion.  (Im Transaktionskontext sorgt __exit__ dafür.)
+        """
+        if self._transaction_level:
+            return
+        tables = [(self._db_name, qualified_name(table))]
+        cache = self.result_cache
+        cache.invalidate(*tables)
+        if not commit:
+            def invalidate(success):
+                cache.invalidate(*tables)
+            transaction.get().addAfterCommitHook(invalidate)
+
+    def _single_statements(self):
+        """
+        Nimmt die Verbindung nur ein Statement pro Aufruf an?  Das gilt für
+        die mit einem anderen Platzhalter-Stil als pyformat (DB-API-Treiber
+        wie sqlite3, asyncpg, psycopg 3; siehe das placeholders-Modul):
+        für diese wird kein COMMIT angehängt, und im Transaktionskontext
+        werden BEGIN, die vorgemerkten Statements und COMMIT einzeln
+        gesendet.
+
+        >>> from .standin import SQLiteConnection
+        >>> class Driver(SQLiteConnection):
+        ...     def query(self, query_string, max_rows=None, query_data=None):
+        ...         print(query_string)
+        ...         return SQLiteConnection.query(self, query_string,
+        ...                                       max_rows, query_data)
+        >>> sql = Adapter.from_connection(Driver(paramstyle='qmark'))
+        >>> sql._single_statements()
+        True
+        >>> sql.query('CREATE TABLE tan (id integer, status text);')
+        CREATE TABLE tan (id integer, status text);
+        []
+        >>> sql.insert('tan', {'id': 1, 'status': 'new'})
+        INSERT INTO tan (id, status) VALUES (?, ?);
+        COMMIT;
+        >>> res = sql.update('tan', {'status': 'used'}, query_data={'id': 1})
+        UPDATE tan SET status=? WHERE id = ?;
+        COMMIT;
+        >>> with sql:
+        ...     sql.insert('tan', {'id': 2, 'status': 'new'})
+        ...     sql.delete('tan', query_data={'status': 'used'})
+        BEGIN TRANSACTION ISOLATION LEVEL READ COMMITTED;
+        INSERT INTO tan (id, status) VALUES (?, ?);
+        DELETE FROM tan WHERE status = ?;
+        COMMIT;
+        >>> [row['id'] for row in sql.select('tan')]
+        SELECT * FROM tan;
+        [2]
+        """
+        db = self.db
+        if self._tx_replica is not None:
+            db = self._tx_replica[1]
+        return getattr(db, 'paramstyle', 'pyformat') != 'pyformat'
+
+    def _split_commit(self, commit):
+        """
+        Für die schreibenden Methoden: gib ein 2-Tupel zurück - soll das
+        COMMIT an das (letzte) Statement gehängt bzw. danach einzeln
+        gesendet werden?
+        """
+        if commit and self._single_statements():
+            return False, True
+        return commit, False
+
+    def _execute(self, query, query_data=None, maxrows=None,
+                 defer=False, commit=False):
         """
         Führe das übergebene SQL-Statement aus.
         Wenn in einer Transaktion, wird kein COMMIT ausgeführt,
         da dieses bei Verlassen des Transaktionskontexts automatisch geschieht.
+
+        defer -- das Ergebnis wird nicht benötigt; im Transaktionskontext
+                 wird das Statement daher nur vorgemerkt
+                 (siehe __enter__)
+        commit -- das Statement enthält ein COMMIT (beendet also ggf. die
+                  im Transaktionskontext begonnene Transaktion)
+        """
+        if self._transaction_level:
+            if defer:
+                self._pending.append((query, query_data))
+                return None
+            query, query_data = self._transaction_batch(query, query_data)
+            if commit:
+                self._transaction_begun = False
+        return self._send(query, maxrows, query_data)
+
+    def _send(self, query, maxrows=None, query_data=None, db=None,
+              prepare=False):
+        """
+        Alle Zugriffe auf self.db.query laufen hierüber; sind Sinks für die
+        Zeitmessung registriert (siehe das instrument-Modul), werden sie
+        über jedes Statement informiert.
+
+        db -- die Verbindung eines Replikats; in einer Transaktion mit
+              "read only" ggf. das dafür gewählte Replikat
+        prepare -- ein (einzelnes, lesendes) Statement, das ab
+                   prepare_threshold Ausführungen als Prepared Statement
+                   ausgeführt wird (siehe das prepared-Modul)
+
+        Hat die Verbindung ein Attribut paramstyle (siehe das
+        placeholders-Modul), werden die %(name)s-Platzhalter entsprechend
+        übersetzt.
+
+        Fehlt der Datenbanksitzung ein Prepared Statement (ohne Wissen des
+        Adapters erneuert), wird der Fehler weitergegeben; danach wird neu
+        vorbereitet:
+
+        >>> class Session(object):
+        ...     lost = False
+        ...     def __init__(self):
+        ...         self.queries = []
+        ...     def query(self, query_string, max_rows=None, query_data=None):
+        ...         self.queries.append(query_string)
+        ...         if self.lost:
+        ...             self.lost = False
+        ...             raise Exception('prepared statement "sqlwrapper_p1"'
+        ...                             ' does not exist')
+        ...         return [{'name': 'x'}], [(1,)]
+        >>> db = Session()
+        >>> sql = Adapter.from_connection(db)
+        >>> sql.prepare_threshold = 1
+        >>> sql._send('SELECT 1 AS x;', prepare=True)[1]
+        [(1,)]
+        >>> db.queries[-1].split()[0]
+        'PREPARE'
+        >>> db.lost = True
+        >>> sql._send('SELECT 1 AS x;', prepare=True)
+        Traceback (most recent call last):
+          ...
+        Exception: prepared statement "sqlwrapper_p1" does not exist
+        >>> db.queries[-1].split()[0]
+        'EXECUTE'
+        >>> sql._send('SELECT 1 AS x;', prepare=True)[1]
+        [(1,)]
+        >>> db.queries[-1].split()[0]
+        'PREPARE'
+        """
+        if db is None:
+            if self._tx_replica is not None:
+                db = self._tx_replica[1]
+            else:
+                db = self.db
+        style = getattr(db, 'paramstyle', 'pyformat')
+        if style != 'pyformat':
+            sql, params = render_placeholders(query, query_data, style)
+            if instrument.sinks:
+                return instrument.timed_query(db, sql, maxrows, params,
+                                              query, query_data)
+            return db.query(sql, maxrows, params)
+        if prepare and self.prepare_threshold:
+            reg = prepared_registry(db, self.prepare_threshold)
+            statement = reg is not None and reg.statement(query) or None
+            if statement is not None:
+                try:
+                    if instrument.sinks:
+                        return instrument.timed_query(db, statement, maxrows,
+                                                      query_data, query)
+                    return db.query(statement, maxrows, query_data)
+                except Exception as e:
+                    # die Transaktion ist abgebrochen; keine Wiederholung:
+                    if reg.failed(query, e):
+                        logger.warning('prepared statement lost (%(e)s)',
+                                       locals())
+                    raise
+        if instrument.sinks:
+            return instrument.timed_query(db, query, maxrows, query_data)
+        return db.query(query, maxrows, query_data)
+
+    def _begin_statement(self):
+        return make_transaction_cmd('BEGIN', *self._begin_transaction_tup)
+
+    def _transaction_batch(self, query, query_data):
+        """
+        Im Transaktionskontext: Stelle dem Statement ggf. das BEGIN und die
+        vorgemerkten Statements voran; gib ein 2-Tupel (sql, query_data)
+        zurück.
+        """
+        if self._single_statements():
+            if not self._transaction_begun:
+                self._send(self._begin_statement())
+                self._transaction_begun = True
+            pending, self._pending = self._pending, []
+            for item in pending:
+                self._send(item[0], None, item[1])
+            return query, query_data
+        items = []
+        if not self._transaction_begun:
+            items.append((self._begin_statement(), None))
+            self._transaction_begun = True
+        pending, self._pending = self._pending, []
+        if (pending
+            and query_data is not None
+            and not isinstance(query_data, dict)
+            ):
+            # positionale Parameter: hier kann nichts zusammengefaßt werden
+            items.extend(pending)
+            sql, data = merge_statements(items)
+            self._send(sql, None, data)
+            return query, query_data
+        if not (items or pending):
+            return query, query_data
+        items.extend(pending)
+        if query is not None:
+            items.append((query, query_data))
+        return merge_statements(items)
+
+    def _flush(self):
         """
-        raise NotImplemented
+        Sende im Transaktionskontext das BEGIN und alle vorgemerkten
+        Statements, z. B. vor Zugriffen, die an self.db.query vorbei gehen
+        """
+        if self._transaction_level:
+            query, query_data = self._transaction_batch(None, None)
+            if query:
+                self._send(query, None, query_data)
 
     def transaction_mode(self, *args):
         """
@@ -122,74 +704,297 @@ class Adapter(Base):
         commit -- soll dem SQL-Befehl ein COMMIT; angehängt werden?
         transform -- ignoriert; nicht mehr verwenden
         """
-        keys = list(dict_of_values.keys())
-        rows = ', '.join(keys)
-        values = ', '.join([key.join(('%(', ')s'))
-                            for key in keys
-                            ])
-        query_l = [replace_names('INSERT INTO %(table)s',
-                                 table=table),
-                   '(%s)' % rows,
-                   'VALUES (%s)' % values,
-                   ]
-        if returning:
-            query_l.append(make_returning_clause(returning))
+        self.invalidate_results(table)
         if commit is None:
             commit = not self._transaction_level
-        statements = [' '.join(query_l)]
-        if commit:
-            statements.append('COMMIT')
-        statements.append('')
-        query = ';'.join(statements)
+        commit, commit_after = self._split_commit(commit)
+        query = insert_statement(table, dict_of_values, returning, commit)
         DEBUG('insert:\n   query=%r\n   query_data=%r', query, dict_of_values)
-        res = self.db.query(query, query_data=dict_of_values)
+        res = self._execute(query, dict_of_values,
+                            defer=not (returning or commit),
+                            commit=commit)
+        if commit_after:
+            self._execute('COMMIT;', commit=True)
+        self._written_outside(table, commit or commit_after)
         if returning:
             return generate_dicts(res, names=returning)
         # --------------------------------------------- ] ... insert ]
 
-    def insert_many(self, table, seq_of_dicts,
-                    returning=None, commit=None):
+    # Anzahl der Zeilen pro INSERT-Anweisung (insert_many):
+    INSERT_CHUNKSIZE = 1000
+
+    def insert_many(self, table, seq_of_dicts,  # [ insert_many ... [
+                    returning=None, commit=None,
+                    defaults=None, chunksize=None):
         """
-        Speichere die Werte aus dem Dictionary in die Tabelle.
-        Keys aus dem Dictionary müssen mit den Tabellenfeldern
+        Speichere die Werte aus den Dictionarys in die Tabelle.
+        Keys aus den Dictionarys müssen mit den Tabellenfeldern
         übereinstimmen.
-        Es werden nur Werte für eine Zeile akzeptiert.
+        Es werden mehrzeilige INSERT-Anweisungen abgesetzt
+        (INSERT INTO ... VALUES (...), (...), ...), jeweils mit bis zu
+        <chunksize> Zeilen; es ist also pro Block nur ein Roundtrip zur
+        Datenbank nötig.
 
         table -- Name der Tabelle
         seq_of_dicts -- [dict {Feldname: Wert}]. Die Schlüssel des
                         ersten Elements bzw. des defaults-Dictionarys
                         bestimmen die Feldnamen; weitere Feldnamen in
-                        weiteren Elementen erzeugen Warnungen
-        returning -- z. B. 'id'; PostgreSQL 9.1+
-        commit -- soll dem SQL-Befehl ein COMMIT; angehängt werden?
+                        weiteren Elementen erzeugen Warnungen.
+                        Ein beliebiges iterierbares Objekt (z. B. ein
+                        Generator) ist ausreichend.
+        returning -- z. B. 'id'; PostgreSQL 9.1+.  Wenn angegeben, wird
+                     eine Liste von Dictionarys für alle Blöcke
+                     zurückgegeben.
+        commit -- soll dem (letzten) SQL-Befehl ein COMMIT; angehängt
+                  werden?
+        defaults -- Vorgabewerte für in einzelnen Zeilen fehlende Werte;
+                    fehlt ein Wert auch hier, wird DEFAULT verwendet
+        chunksize -- max. Anzahl der Zeilen pro Anweisung
+                     (Vorgabe: INSERT_CHUNKSIZE)
+
+        >>> from .standin import SQLiteConnection
+        >>> db = SQLiteConnection()
+        >>> sql = Adapter.from_connection(db)
+        >>> sql.query('CREATE TABLE tan (id integer PRIMARY KEY,'
+        ...           ' status text);')
+        []
+        >>> queries = db.queries
+        >>> sql.insert_many('tan', ({'id': i, 'status': 'new'}
+        ...                         for i in range(1, 6)), chunksize=2)
+        >>> db.queries - queries
+        3
+        >>> sql.insert_many('tan', [{'id': 6}, {'id': 7, 'status': 'used'}],
+        ...                 returning='id',
+        ...                 defaults={'id': None, 'status': 'new'})
+        [{'id': 6}, {'id': 7}]
+        >>> print(', '.join(['%(id)s %(status)s' % row
+        ...                  for row in sql.select('tan', order_by='id')]))
+        1 new, 2 new, 3 new, 4 new, 5 new, 6 new, 7 used
         """
-        raise NotImplemented
-        keys = list(dict_of_values.keys())
-        rows = ', '.join(keys)
-        values = ', '.join([key.join(('%(', ')s'))
-                            for key in keys
-                            ])
-        query_l = [replace_names('INSERT INTO %(table)s',
-                                 table=table),
-                   '(%s)' % rows,
-                   'VALUES (%s)' % values,
-                   ]
+        rows = iter(seq_of_dicts)
+        if defaults:
+            keys = sorted(defaults.keys())
+        else:
+            try:
+                first = next(rows)
+            except StopIteration:
+                if returning:
+                    return []
+                return
+            keys = sorted(first.keys())
+            rows = chain([first], rows)
+        if not keys:
+            raise ValueError('insert_many: no field names given!')
+        if chunksize is None:
+            chunksize = self.INSERT_CHUNKSIZE
+        head = ' '.join((replace_names('INSERT INTO %(table)s',
+                                       table=table),
+                         '(%s)' % ', '.join(map(check_name, keys)),
+                         'VALUES ',
+                         ))
         if returning:
-            query_l.append(make_returning_clause(returning))
-        if (commit is None
-            and (0 and 'transaction_level: GKZ-Problem, Rev. 13395')
-            ):
+            tail = ' ' + make_returning_clause(returning) + ';'
+        else:
+            tail = ';'
+        return self._multirow_insert('insert_many', table, keys,
+                                     iter_chunks(rows, chunksize),
+                                     head, tail, returning, commit,
+                                     defaults)
+        # ---------------------------------------- ] ... insert_many ]
+
+    def _multirow_insert(self, caller, table, keys, chunks,
+                         head, tail, returning, commit, defaults=None):
+        """
+        Für insert_many und upsert: Setze für jeden Block von Zeilen eine
+        mehrzeilige INSERT-Anweisung ab (<head> VALUES ... <tail>);
+        das COMMIT wird ggf. an die letzte Anweisung gehängt.
+        """
+        self.invalidate_results(table)
+        if commit is None:
             commit = not self._transaction_level
-        statements = [' '.join(query_l)]
-        if commit:
-            statements.append('COMMIT')
-        statements.append('')
-        query = ';'.join(statements)
-        DEBUG('insert:\n   query=%r\n   query_data=%r', query, dict_of_values)
-        res = self.db.query(query, query_data=dict_of_values)
+        commit, commit_after = self._split_commit(commit)
+        keyset = frozenset(keys)
+        unknown = set()
+        result = []
+        chunks = iter(chunks)
+        chunk = next(chunks, None)
+        while chunk:
+            for row in chunk:
+                if not keyset.issuperset(row):
+                    unknown.update(set(row).difference(keyset))
+            # Vorausschau, um das COMMIT an den letzten Block zu hängen:
+            next_chunk = next(chunks, None)
+            values, query_data = make_multirow_values(keys, chunk, defaults)
+            query = ''.join((head, values, tail))
+            if commit and not next_chunk:
+                query += 'COMMIT;'
+            DEBUG('%s:\n   query=%r\n   query_data=%r',
+                  caller, query, query_data)
+            res = self._execute(query, query_data,
+                                defer=not (returning or commit),
+                                commit=commit and not next_chunk)
+            if returning:
+                result.extend(generate_dicts(res, names=returning))
+            chunk = next_chunk
+        if commit_after:
+            self._execute('COMMIT;', commit=True)
+        self._written_outside(table, commit or commit_after)
+        if unknown:
+            logger.warning('%(caller)s(%(table)r): ignored unknown keys'
+                           ' %(unknown)s', locals())
         if returning:
-            return generate_dicts(res, names=returning)
-        return res
+            return result
+
+    def upsert(self, table, rows,  # ------------------- [ upsert ... [
+               conflict_cols, update_cols=None, returning=None,
+               commit=None, chunksize=None):
+        """
+        Füge die Zeilen ein bzw. aktualisiere sie, wenn es bereits Zeilen
+        mit denselben Werten in den Konfliktfeldern gibt
+        (INSERT ... ON CONFLICT ... DO UPDATE; PostgreSQL 9.5+).
+        Es werden mehrzeilige Anweisungen abgesetzt, jeweils mit bis zu
+        <chunksize> Zeilen; kommt ein Schlüssel mehrfach vor, wird die
+        Anweisung geteilt (die spätere Zeile gewinnt).
+
+        table -- Name der Tabelle
+        rows -- [dict {Feldname: Wert}] (oder ein einzelnes Dictionary);
+                die Schlüssel des ersten Elements bestimmen die Feldnamen.
+                In einzelnen Zeilen fehlende Werte werden zu DEFAULT -
+                auch beim Aktualisieren!
+        conflict_cols -- die Felder eines eindeutigen Index bzw.
+                         Constraints, z. B. 'tan' oder ['group_id', 'user_id']
+        update_cols -- die im Konfliktfall zu aktualisierenden Felder
+                       (Vorgabe: alle außer den Konfliktfeldern;
+                       eine leere Sequenz bewirkt DO NOTHING)
+        returning -- z. B. 'id'; wenn angegeben, wird eine Liste von
+                     Dictionarys für alle Blöcke zurückgegeben
+                     (mit DO NOTHING nur für die eingefügten Zeilen)
+        commit -- soll dem (letzten) SQL-Befehl ein COMMIT; angehängt
+                  werden?
+        chunksize -- max. Anzahl der Zeilen pro Anweisung
+                     (Vorgabe: INSERT_CHUNKSIZE)
+
+        >>> from .standin import SQLiteConnection
+        >>> db = SQLiteConnection()
+        >>> sql = Adapter.from_connection(db)
+        >>> sql.query('CREATE TABLE tan (id integer PRIMARY KEY,'
+        ...           ' status text);')
+        []
+        >>> sql.upsert('tan', [{'id': 1, 'status': 'new'},
+        ...                    {'id': 2, 'status': 'new'}], 'id')
+        >>> sql.upsert('tan', [{'id': 2, 'status': 'used'},
+        ...                    {'id': 3, 'status': 'new'},
+        ...                    {'id': 3, 'status': 'void'}], 'id',
+        ...            returning='id')
+        [{'id': 2}, {'id': 3}, {'id': 3}]
+        >>> print(', '.join(['%(id)s %(status)s' % row
+        ...                  for row in sql.select('tan', order_by='id')]))
+        1 new, 2 used, 3 void
+        """
+        if isinstance(rows, dict):
+            rows = [rows]
+        rows = iter(rows)
+        try:
+            first = next(rows)
+        except StopIteration:
+            if returning:
+                return []
+            return
+        keys = sorted(first.keys())
+        if not is_sequence(conflict_cols):
+            conflict_cols = [conflict_cols]
+        missing = set(conflict_cols).difference(keys)
+        if update_cols is None:
+            update_cols = [key for key in keys
+                           if key not in conflict_cols]
+        else:
+            missing.update(set(update_cols).difference(keys))
+        if missing:
+            raise ValueError('upsert(%r): no values for %s'
+                             % (table, sorted(missing)))
+        if chunksize is None:
+            chunksize = self.INSERT_CHUNKSIZE
+        head = ' '.join((replace_names('INSERT INTO %(table)s',
+                                       table=table),
+                         '(%s)' % ', '.join(map(check_name, keys)),
+                         'VALUES ',
+                         ))
+        tail = [' ', make_conflict_clause(conflict_cols, update_cols)]
+        if returning:
+            tail.extend((' ', make_returning_clause(returning)))
+        tail.append(';')
+        return self._multirow_insert('upsert', table, keys,
+                                     iter_chunks(chain([first], rows),
+                                                 chunksize, conflict_cols),
+                                     head, ''.join(tail), returning, commit)
+        # --------------------------------------------- ] ... upsert ]
+
+    def bulk_load(self, table, rows,  # -------------- [ bulk_load ... [
+                  columns=None, format='text', commit=None,
+                  encoding='utf-8'):
+        """
+        Massenimport mit COPY ... FROM STDIN (PostgreSQL).
+        Die Zeilen werden selbst ins Text- bzw. CSV-Format übersetzt und
+        stückweise an den Datenbanktreiber übergeben; sie liegen also nie
+        vollständig im Speicher.
+
+        Kann die Datenbankverbindung kein COPY (kein Cursor mit einer
+        copy_expert-Methode verfügbar), wird auf insert_many
+        zurückgegriffen.
+
+        table -- Name der Tabelle
+        rows -- iterierbares Objekt von Dictionarys oder Sequenzen
+        columns -- die Feldnamen; für Sequenzen erforderlich, ansonsten
+                   ggf. aus den Schlüsseln der ersten Zeile ermittelt.
+                   In einer Zeile fehlende Werte werden zu NULL.
+        format -- 'text' oder 'csv'
+        commit -- soll anschließend ein COMMIT abgesetzt werden?
+        encoding -- die Kodierung der Datenbankverbindung
+
+        Gibt die Anzahl der übertragenen Zeilen zurück.
+        """
+        rows = iter(rows)
+        if columns is None:
+            try:
+                first = next(rows)
+            except StopIteration:
+                return 0
+            if not isinstance(first, dict):
+                raise ValueError('bulk_load(%(table)r): columns argument'
+                                 ' required for non-dict rows'
+                                 % locals())
+            columns = sorted(first.keys())
+            rows = chain([first], rows)
+        columns = list(columns)
+        statement = make_copy_statement(table, columns, format)
+        if commit is None:
+            commit = not self._transaction_level
+
+        getcursor = getattr(self.db, 'getcursor', None)
+        cursor = getcursor is not None and getcursor() or None
+        if cursor is None or not hasattr(cursor, 'copy_expert'):
+            DEBUG('bulk_load(%r): no COPY support; using insert_many',
+                  table)
+            dicts = DictRows(rows, columns)
+            self.insert_many(table, dicts,
+                             commit=commit,
+                             defaults=dict.fromkeys(columns))
+            return dicts.count
+
+        self.invalidate_results(table)
+        self._flush()
+        # Teilnahme an der Zope-Transaktion, wie bei self.db.query:
+        register = getattr(self.db, '_register', None)
+        if register is not None:
+            register()
+        reader = CopyReader(iter_copy_lines(rows, columns, format, encoding))
+        DEBUG('bulk_load:\n   statement=%r', statement)
+        cursor.copy_expert(statement, reader)
+        if commit:
+            self._execute('COMMIT;', commit=True)
+        self._written_outside(table, commit)
+        return reader.count
+        # ------------------------------------------ ] ... bulk_load ]
 
     def update(self, table, dict_of_values,  # -------- [ update ... [
                where=None, query_data={},
@@ -227,67 +1032,179 @@ class Adapter(Base):
         <commit> ist nicht getestet; <returning> wird daher am besten
         mit dem Kontext-Manager-Protokoll verwendet!
         """
-        keys = list(dict_of_values.keys())
-        qset = ', '.join([''.join((key, '=%(', key, ')s'))
-                          for key in keys
-                          ])
-        query_l = [replace_names('UPDATE %(table)s SET',
-                                 table=table),
-                   qset,
-                   ]
         if query_data:
-            query_keys = set(query_data.keys())
-            value_keys = set(keys)
-            keys_of_both = value_keys.intersection(query_keys)
-            if keys_of_both:
-                # Löschen aus Set während Iteration nicht erlaubt;
-                # also iteration über "Kopie":
-                for key in sorted(keys_of_both):
-                    u_val = dict_of_values[key]
-                    q_val = query_data[key]
-                    if u_val == q_val:
-                        del dict_of_values[key]
-                        keys_of_both.remove(key)
-                    else:
-                        logger.error('update: key %(key)r is both'
-                                     ' in query data (%(q_val)r)'
-                                     ' and update data (%(u_val)r)!',
-                                     locals())
-            if not dict_of_values:
-                raise ValueError('Empty update data!')
-            if keys_of_both:
-                logger.error('update: value_keys = %(value_keys)s,'
-                             ' query_keys = %(query_keys)s,'
-                             ' intersection = %(keys_of_both)s'
-                             , locals())
-                raise ValueError('intersection of value keys and '
-                                 'query keys (%(keys_of_both)s: '
-                                 'currently unsupported!'
-                                 % locals())
-        if query_data and not where:
-            where = make_where_mask(query_data)
-        if where:
-            query_l.append(where)
-
-        if returning:
-            query_l.append(make_returning_clause(returning))
+            check_update_keys(dict_of_values, query_data)
+        self.invalidate_results(table)
         if commit is None:
             commit = not self._transaction_level
-        queries = [' '.join(query_l)+';']
-        if commit:
-            queries.append('COMMIT;')
-        query = ''.join(queries)
+        commit, commit_after = self._split_commit(commit)
+        query = update_statement(table, dict_of_values, where, query_data,
+                                 returning, commit)
         # nicht alle "Query-Daten" dienen der Filterung (siehe oben, keys_of_both)
         if fork:
             query_data = dict(query_data)  # wg. Wiederverwendung!
         query_data.update(dict_of_values)
         DEBUG('update:\n   query=%r\n   query_data=%r', query, query_data)
-        res = self.db.query(query, query_data=query_data)
+        res = self._execute(query, query_data,
+                            defer=not (returning or commit),
+                            commit=commit)
+        if commit_after:
+            self._execute('COMMIT;', commit=True)
+        self._written_outside(table, commit or commit_after)
         if returning:
             return generate_dicts(res, names=returning)
         return res
         # --------------------------------------------- ] ... update ]
 
+    def update_many(self, table, rows,  # ---------- [ update_many ... [
+                    key_cols, returning=None, commit=None,
+                    chunksize=None):
+        """
+        Aktualisiere viele Zeilen, mit einer Anweisung je Block von bis zu
+        <chunksize> Zeilen:
+
+          UPDATE <table> AS t SET feld = v.feld, ...
+            FROM (VALUES (...), (...), ...) AS v(schluessel, feld, ...)
+           WHERE t.schluessel = v.schluessel;
+
+        table -- Name der Tabelle
+        rows -- ein iterierbares Objekt, dessen Elemente entweder
+                Dictionarys sind (mit den Schlüsselfeldern und den neuen
+                Werten) oder 2-Tupel (dict_of_values, query_data) wie für
+                die update-Methode (mit denselben Prüfungen).
+                Alle Zeilen müssen dieselben Felder aktualisieren (die des
+                ersten Elements).
+        key_cols -- die Schlüsselfelder, z. B. 'id' oder ['tan', 'status']
+                    (NULL-Werte finden keine Zeile)
+        returning -- z. B. 'id' oder '*'; wenn angegeben, wird eine Liste
+                     von Dictionarys für alle Blöcke zurückgegeben
+                     (die Werte *nach Änderung*)
+        commit -- soll dem (letzten) SQL-Befehl ein COMMIT; angehängt
+                  werden?
+        chunksize -- max. Anzahl der Zeilen pro Anweisung
+                     (Vorgabe: INSERT_CHUNKSIZE)
+
+        Die Typen der Spalten werden dem Spaltenkatalog entnommen
+        (siehe getColumns), da sie sich aus der VALUES-Liste allein nicht
+        ergeben.
+
+        >>> from .standin import SQLiteConnection
+        >>> db = SQLiteConnection()
+        >>> sql = Adapter.from_connection(db)
+        >>> sql.query('CREATE TABLE tan (id integer PRIMARY KEY,'
+        ...           ' status text);')
+        []
+        >>> sql.insert_many('tan', [{'id': i, 'status': 'new'}
+        ...                         for i in (1, 2, 3)])
+        >>> sql.update_many('tan', [{'id': 1, 'status': 'used'},
+        ...                         {'id': 3, 'status': 'void'}], 'id',
+        ...                 returning='id')
+        [{'id': 1}, {'id': 3}]
+        >>> print(', '.join(['%(id)s %(status)s' % row
+        ...                  for row in sql.select('tan', order_by='id')]))
+        1 used, 2 new, 3 void
+        """
+        if not is_sequence(key_cols):
+            key_cols = [key_cols]
+        key_cols = list(map(check_name, key_cols))
+        if chunksize is None:
+            chunksize = self.INSERT_CHUNKSIZE
+        rows = iter(self._update_rows(rows, key_cols))
+        try:
+            first = next(rows)
+        except StopIteration:
+            if returning:
+                return []
+            return
+        value_cols = sorted(set(first).difference(key_cols))
+        if not value_cols:
+            raise ValueError('Empty update data!')
+        columns = key_cols + value_cols
+        colset = frozenset(columns)
+        casts = self.column_catalog.column_casts(self._catalog_query,
+                                                 self._db_name, table)
+        unknown = colset.difference(casts)
+        if unknown:
+            raise ValueError('update_many(%r): unknown columns %s'
+                             % (table, sorted(unknown)))
+        head = ' '.join((replace_names('UPDATE %(table)s AS t SET',
+                                       table=table),
+                         ', '.join(['%s = v.%s' % (col, col)
+                                    for col in map(check_name, value_cols)
+                                    ]),
+                         'FROM (VALUES ',
+                         ))
+        tail = [') AS v(%s) WHERE ' % ', '.join(columns),
+                ' AND '.join(['t.%s = v.%s' % (col, col)
+                              for col in key_cols
+                              ]),
+                ]
+        if returning == '*':
+            tail.append(' RETURNING t.*')
+        elif returning:
+            names = returning
+            if not is_sequence(names):
+                names = [names]
+            tail.append(' ' + make_returning_clause(['t.' + name
+                                                     for name in names
+                                                     ]))
+        tail.append(';')
+        tail = ''.join(tail)
+        self.invalidate_results(table)
+        if commit is None:
+            commit = not self._transaction_level
+        commit, commit_after = self._split_commit(commit)
+        result = []
+        chunks = iter_chunks(chain([first], rows), chunksize, key_cols)
+        chunk = next(chunks, None)
+        while chunk:
+            for row in chunk:
+                if colset.symmetric_difference(row):
+                    raise ValueError('update_many(%r): expected columns %s,'
+                                     ' got %s' % (table, sorted(colset),
+                                                  sorted(row)))
+            # Vorausschau, um das COMMIT an den letzten Block zu hängen:
+            next_chunk = next(chunks, None)
+            values, query_data = make_multirow_values(columns, chunk,
+                                                      casts=casts)
+            query = ''.join((head, values, tail))
+            if commit and not next_chunk:
+                query += 'COMMIT;'
+            DEBUG('update_many:\n   query=%r\n   query_data=%r',
+                  query, query_data)
+            res = self._execute(query, query_data,
+                                defer=not (returning or commit),
+                                commit=commit and not next_chunk)
+            if returning:
+                result.extend(generate_dicts(res, names=returning))
+            chunk = next_chunk
+        if commit_after:
+            self._execute('COMMIT;', commit=True)
+        self._written_outside(table, commit or commit_after)
+        if returning:
+            return result
+        # ---------------------------------------- ] ... update_many ]
+
+    @staticmethod
+    def _update_rows(rows, key_cols):
+        """
+        Für update_many: Erzeuge aus den übergebenen Zeilen Dictionarys,
+        welche die Schlüssel- und die neuen Werte enthalten
+        """
+        for row in rows:
+            if isinstance(row, dict):
+                yield row
+                continue
+            dict_of_values, query_data = row
+            if set(key_cols).symmetric_difference(query_data):
+                raise ValueError('update_many: expected key columns %s,'
+                                 ' got %r' % (key_cols, query_data))
+            dict_of_values = dict(dict_of_values)
+            check_update_keys(dict_of_values, query_data, 'update_many')
+            merged = dict(query_data)
+            merged.update(dict_of_values)
+            yield merged
+
     def delete(self, table,  # ------------------------ [ delete ... [
                where=None, query_data=None,
                returning=None,
@@ -314,31 +1231,209 @@ class Adapter(Base):
         Achtung: ohne WHERE-Kriterium (als <where> und/oder <query_data>
                  wird die Tabelle vollständig geleert!
         """
-        query_l = [replace_names('DELETE FROM %(table)s',
-                                 table=table),
-                   ]
-        if query_data and not where:
-            where = make_where_mask(query_data)
-        if where:
-            query_l.append(where)
-        if returning:
-            query_l.append(make_returning_clause(returning))
+        self.invalidate_results(table)
         if commit is None:
             commit = not self._transaction_level
-        queries = [' '.join(query_l)+';']
-        if commit:
-            queries.append('COMMIT;')
-        query = ''.join(queries)
+        commit, commit_after = self._split_commit(commit)
+        query = delete_statement(table, where, query_data, returning,
+                                 commit)
         DEBUG('delete:\n   query=%r\n   query_data=%r', query, query_data)
-        res = self.db.query(query, query_data=query_data)
+        res = self._execute(query, query_data,
+                            defer=not (returning or commit),
+                            commit=commit)
+        if commit_after:
+            self._execute('COMMIT;', commit=True)
+        self._written_outside(table, commit or commit_after)
         if returning:
             return generate_dicts(res, names=returning)
         return res
         # --------------------------------------------- ] ... delete ]
 
+    # Anzahl der Schlüssel pro Anweisung (delete_many, select_by_keys):
+    KEYS_CHUNKSIZE = 10000
+
+    def _key_chunks(self, keys, key_cols, chunksize):
+        """
+        Für delete_many und select_by_keys: Gib ein 2-Tupel (key_cols,
+        chunks) zurück; die Blöcke sind Listen von Schlüssel-Tupeln.
+
+        keys -- ein iterierbares Objekt von Dictionarys (ohne <key_cols>
+                bestimmen die Schlüssel des ersten Elements die
+                Schlüsselfelder), von Tupeln oder, bei nur einem
+                Schlüsselfeld, von einfachen Werten
+        """
+        keys = iter(keys)
+        try:
+            first = next(keys)
+        except StopIteration:
+            return key_cols, iter([])
+        if key_cols is None:
+            if not isinstance(first, dict):
+                raise ValueError('key_cols are needed unless the keys'
+                                 ' are given as dicts')
+            key_cols = sorted(first.keys())
+        elif not is_sequence(key_cols):
+            key_cols = [key_cols]
+        key_cols = list(map(check_name, key_cols))
+        single = not key_cols[1:]
+
+        def key_tuple(key):
+            if isinstance(key, dict):
+                return tuple([key[col] for col in key_cols])
+            if single and not is_sequence(key):
+                return (key,)
+            key = tuple(key)
+            if len(key) != len(key_cols):
+                raise ValueError('Key %r doesn\'t match key columns %s'
+                                 % (key, key_cols))
+            return key
+
+        if chunksize is None:
+            chunksize = self.KEYS_CHUNKSIZE
+        return key_cols, iter_chunks((key_tuple(key)
+                                      for key in chain([first], keys)),
+                                     chunksize)
+
+    def _keys_criterion(self, table, key_cols, chunk):
+        """
+        Gib ein 2-Tupel (where, query_data) für einen Block von
+        Schlüssel-Tupeln zurück:
+        für ein Schlüsselfeld feld = ANY(%(feld)s) (via make_where_mask),
+        für zusammengesetzte Schlüssel ein unnest-Kriterium mit einem Array
+        je Feld (mit den Typen aus dem Spaltenkatalog)
+        """
+        query_data = dict([(col, [key[i] for key in chunk])
+                           for i, col in enumerate(key_cols)
+                           ])
+        if not key_cols[1:]:
+            return None, query_data
+        casts = self.column_catalog.column_casts(self._catalog_query,
+                                                 self._db_name, table)
+        return ('WHERE ' + make_unnest_condition(key_cols, casts),
+                query_data)
+
+    def delete_many(self, table, keys,  # ---------- [ delete_many ... [
+                    key_cols=None, returning=None, commit=None,
+                    chunksize=None):
+        """
+        Lösche die Zeilen mit den angegebenen Schlüsseln, mit einer
+        Anweisung je Block von bis zu <chunksize> Schlüsseln
+        (Vorgabe: KEYS_CHUNKSIZE); die Schlüsselwerte werden als Arrays
+        übergeben.
+
+        table -- Name der Tabelle
+        keys -- Dictionarys {Feldname: Wert}, Tupel (in der Reihenfolge
+                von <key_cols>) oder, für ein einzelnes Schlüsselfeld,
+                einfache Werte
+        key_cols -- die Schlüsselfelder, z. B. 'id' oder
+                    ['group_id', 'user_id']; optional, wenn die Schlüssel
+                    als Dictionarys angegeben werden
+        returning -- z. B. 'id'; wenn angegeben, wird eine Liste von
+                     Dictionarys für alle Blöcke zurückgegeben
+        commit -- soll dem (letzten) SQL-Befehl ein COMMIT; angehängt
+                  werden?
+
+        >>> from .standin import SQLiteConnection
+        >>> db = SQLiteConnection()
+        >>> sql = Adapter.from_connection(db)
+        >>> sql.query('CREATE TABLE tan (id integer PRIMARY KEY,'
+        ...           ' status text);')
+        []
+        >>> sql.insert_many('tan', [{'id': i, 'status': 'new'}
+        ...                         for i in range(1, 6)])
+        >>> queries = db.queries
+        >>> sql.delete_many('tan', [2, 3, 5], 'id', returning='id',
+        ...                 chunksize=2)
+        [{'id': 2}, {'id': 3}, {'id': 5}]
+        >>> db.queries - queries
+        2
+        >>> [row['id'] for row in sql.select('tan', order_by='id')]
+        [1, 4]
+        """
+        key_cols, chunks = self._key_chunks(keys, key_cols, chunksize)
+        if commit is None:
+            commit = not self._transaction_level
+        result = []
+        chunk = next(chunks, None)
+        while chunk:
+            # Vorausschau, um das COMMIT an den letzten Block zu hängen:
+            next_chunk = next(chunks, None)
+            where, query_data = self._keys_criterion(table, key_cols, chunk)
+            res = self.delete(table, where, query_data, returning,
+                              commit=commit and not next_chunk)
+            if returning:
+                result.extend(res)
+            chunk = next_chunk
+        if returning:
+            return result
+        # ---------------------------------------- ] ... delete_many ]
+
+    def select_by_keys(self, table,  # ----------- [ select_by_keys ... [
+                       key_cols, keys, fields=None,
+                       compact=False, chunksize=None):
+        """
+        Hole die Zeilen mit den angegebenen Schlüsseln, in der Reihenfolge
+        der Schlüssel (für mehrfach angegebene Schlüssel werden die Zeilen
+        mehrfach geliefert, für nicht gefundene keine).
+        Es wird eine Abfrage je Block von bis zu <chunksize> Schlüsseln
+        abgesetzt (Vorgabe: KEYS_CHUNKSIZE); die Schlüsselwerte werden als
+        Arrays übergeben.
+
+        table -- Name der Tabelle oder Sicht
+        key_cols -- die Schlüsselfelder, z. B. 'id' oder
+                    ['group_id', 'user_id']
+        keys -- Dictionarys {Feldname: Wert}, Tupel (in der Reihenfolge
+                von <key_cols>) oder, für ein einzelnes Schlüsselfeld,
+                einfache Werte; sie müssen mit den von der Datenbank
+                gelieferten Werten vergleichbar sein (z. B. int, nicht
+                str, für integer-Felder)
+        fields -- Namen der Felder (Vorgabe: '*'); fehlende Schlüsselfelder
+                  werden ergänzt
+        compact -- wenn True, werden kompakte Row-Objekte zurückgegeben
+
+        >>> from .standin import SQLiteConnection
+        >>> db = SQLiteConnection()
+        >>> sql = Adapter.from_connection(db)
+        >>> sql.query('CREATE TABLE tan (id integer PRIMARY KEY,'
+        ...           ' status text);')
+        []
+        >>> sql.insert_many('tan', [{'id': i, 'status': 'new'}
+        ...                         for i in range(1, 6)])
+        >>> sql.select_by_keys('tan', 'id', [4, 2, 42, 4], fields=['id'],
+        ...                    chunksize=2)
+        [{'id': 4}, {'id': 2}, {'id': 4}]
+        """
+        key_cols, chunks = self._key_chunks(keys, key_cols, chunksize)
+        if fields is not None and fields != '*':
+            if not is_sequence(fields):
+                fields = [fields]
+            fields = list(fields)
+            fields.extend([col for col in key_cols
+                           if col not in fields])
+        result = []
+        for chunk in chunks:
+            where, query_data = self._keys_criterion(table, key_cols, chunk)
+            query = self._select_statement(table, fields, where, query_data)
+            DEBUG('select_by_keys:\n   query=%r\n   query_data=%r',
+                  query, query_data)
+            rows = make_rows(self._fetch(query, query_data, None, True,
+                                         True),
+                             compact)
+            found = {}
+            for row in rows:
+                found.setdefault(tuple([row[col] for col in key_cols]),
+                                 []).append(row)
+            for key in chunk:
+                result.extend(found.get(key, ()))
+        return result
+        # ------------------------------------- ] ... select_by_keys ]
+
     def select(self, table,  # ------------------------ [ select ... [
                fields=None, where=None,
-               query_data=None, maxrows=None):
+               query_data=None, maxrows=None,
+               compact=False,
+               order_by=None, limit=None, offset=None,
+               cache=False):
         """
         Hole Werte aus einer einzelnen Tabelle oder Sicht der SQL-Datenbank.
 
@@ -348,86 +1443,396 @@ class Adapter(Base):
                  für die Werte (Python-Dictionary-Syntax);
                  ggf. aus <query_data> generiert
         query_data -- ein Dictionary mit den Abfragedaten
-        maxrows - weitergereicht an self.db.query
-        """
-
-        if where is None and query_data:
-            where = make_where_mask(query_data, fields)
-        if fields is None:
-            fields = '*'
-        elif fields == '*':
-            pass
-        elif fields:
-            liz = []
-            for field in fields:
-                check_name(field)
-                liz.append(field)
-            fields = ', '.join(liz)
-        else:
-            fields = '*'
-        query_l = ['SELECT',
-                   fields,
-                   replace_names('FROM %(table)s', table=table),
-                   ]
-        if where:
-            query_l.append(where)
-        query = ' '.join(query_l) + ';'
+        maxrows - weitergereicht an self.db.query; nur noch als
+                  Sicherheitsnetz gedacht (die Datenbank ermittelt
+                  trotzdem das vollständige Ergebnis); besser <limit>
+                  verwenden
+        compact -- wenn True, werden statt Dictionarys kompakte Row-Objekte
+                   zurückgegeben (Tupel mit Zugriff per Name; siehe das
+                   rows-Modul)
+        order_by -- Sortierung (siehe utils.make_order_by; die Feldnamen
+                    werden mit check_name geprüft)
+        limit -- max. Anzahl der Zeilen (LIMIT, von der Datenbank
+                 berücksichtigt)
+        offset -- Anzahl der zu überspringenden Zeilen (OFFSET)
+        cache -- True oder eine Verfallszeit in Sekunden: das Ergebnis
+                 wird im prozeßweiten Ergebnis-Cache gespeichert bzw.
+                 von dort geholt (für kleine, selten geänderte Tabellen).
+                 Schreibzugriffe über den Adapter invalidieren die
+                 Einträge der Tabelle (nur in diesem Prozeß!)
+        """
+        query = self._select_statement(table, fields, where, query_data,
+                                       order_by, limit, offset)
         DEBUG('select:\n   query=%r\n   maxrows=%r\n   query_data=%r',
               query, maxrows, query_data)
 
-        queryResult = self.db.query(query, maxrows, query_data)
-        result = []
-        if not queryResult[1]:
-            return []
-        for row in queryResult[1]:
-            res = {}
-            for i in range(len(row)):
-                value = row[i]
-                name = queryResult[0][i]['name']
-                res[name] = value
-            result.append(res)
-        return result
+        queryResult = self._read(query, query_data, maxrows,
+                                 cache, [table], True, True)
+        return make_rows(queryResult, compact)
         # --------------------------------------------- ] ... select ]
 
+    def _select_statement(self, table, fields, where, query_data,
+                          order_by=None, limit=None, offset=None):
+        """
+        Gib das (ggf. gecachte) SELECT-Statement zurück
+        (siehe statements.select_statement)
+        """
+        return select_statement(table, fields, where, query_data,
+                                order_by, limit, offset)
+
+    # Vorgabe für die Seitengröße (select_page):
+    PAGE_SIZE = 50
+
+    def select_page(self, table, order_by,  # ------- [ select_page ... [
+                    after=None, limit=None,
+                    fields=None, where=None, query_data=None,
+                    compact=False):
+        """
+        Hole eine "Seite" von Zeilen, mit Keyset-Paginierung:
+        statt mit OFFSET wird mit einem Vergleich der Sortierfelder
+        ((a, b) > (%(a_after)s, %(b_after)s)) an die vorige Seite
+        angeknüpft; die Datenbank kann hierfür einen Index verwenden, und
+        die Kosten pro Seite bleiben unabhängig von der Seitennummer
+        konstant.
+
+        table -- Name der Tabelle oder Sicht
+        order_by -- die Sortierfelder (siehe utils.make_order_by);
+                    sie sollten zusammen eindeutig sein (z. B. durch
+                    Anhängen des Primärschlüssels).  Alle Felder müssen
+                    in derselben Richtung sortiert werden.
+        after -- das von der vorigen Seite zurückgegebene Tupel
+                 (None für die erste Seite)
+        limit -- die Seitengröße (Vorgabe: PAGE_SIZE)
+        fields, where, query_data, compact -- siehe select;
+                 fehlende Sortierfelder werden an <fields> angehängt
+
+        Gibt ein 2-Tupel (rows, next_after) zurück; next_after ist None,
+        wenn es keine weiteren Zeilen gibt.
+
+        >>> from .standin import SQLiteConnection
+        >>> db = SQLiteConnection()
+        >>> sql = Adapter.from_connection(db)
+        >>> sql.query('CREATE TABLE tan (id integer PRIMARY KEY,'
+        ...           ' status text);')
+        []
+        >>> sql.insert_many('tan', [{'id': i, 'status': 'new'}
+        ...                         for i in range(1, 6)])
+        >>> rows, after = sql.select_page('tan', 'id', limit=2)
+        >>> [row['id'] for row in rows], after
+        ([1, 2], (2,))
+        >>> rows, after = sql.select_page('tan', 'id', after=after, limit=2)
+        >>> [row['id'] for row in rows], after
+        ([3, 4], (4,))
+        >>> rows, after = sql.select_page('tan', 'id', after=after, limit=2)
+        >>> [row['id'] for row in rows], after
+        ([5], None)
+        >>> sql.select_page('tan', '')
+        Traceback (most recent call last):
+          ...
+        ValueError: select_page: an order is required ('')
+        """
+        if limit is None:
+            limit = self.PAGE_SIZE
+        specs = tuple(order_specs(order_by))
+        if not specs:
+            raise ValueError('select_page: an order is required'
+                             ' (%(order_by)r)' % locals())
+        names = [spec[0] for spec in specs]
+        directions = set([spec[1] for spec in specs])
+        if len(directions) > 1:
+            raise ValueError('select_page: mixed sort directions are '
+                             'not supported (%(order_by)r)'
+                             % locals())
+        descending = 'DESC' in directions
+        if fields is not None and fields != '*':
+            fields = list(fields)
+            fields.extend([name for name in names
+                           if name not in fields])
+            fields = tuple(fields)
+        data = dict(query_data or {})
+        if after is not None:
+            if not is_sequence(after):
+                after = (after,)
+            if len(after) != len(names):
+                raise ValueError('select_page: %(after)r doesn\'t match'
+                                 ' %(names)s' % locals())
+            for name, value in zip(names, after):
+                key = keyset_placeholder(name)
+                if key in data:
+                    raise ValueError('select_page: key %(key)r is reserved'
+                                     ' for the keyset value' % locals())
+                data[key] = value
+        query = statement_cache.get(('select_page', table, fields,
+                                     where,
+                                     where is None and data_shape(query_data)
+                                     or None,
+                                     specs, after is not None, limit),
+                                    qfactory.select,
+                                    table, fields, where, query_data,
+                                    specs, limit + 1,
+                                    after is not None and names or None,
+                                    descending)
+        DEBUG('select_page:\n   query=%r\n   query_data=%r',
+              query, data)
+        queryResult = self._fetch(query, data, None, True, True)
+        rows = make_rows(queryResult, compact)
+        if len(rows) <= limit:
+            return rows, None
+        del rows[limit:]
+        last = rows[-1]
+        return rows, tuple([last[name.split('.')[-1]] for name in names])
+        # ------------------------------------------ ] ... select_page ]
+
+    # Anzahl der Zeilen pro FETCH (iterselect, iterquery):
+    FETCH_CHUNKSIZE = 1000
+
+    def iterselect(self, table,  # ---------------- [ iterselect ... [
+                   fields=None, where=None,
+                   query_data=None, chunk_size=None,
+                   compact=False):
+        """
+        Wie select, aber als Generator: die Zeilen werden blockweise über
+        einen serverseitigen Cursor (DECLARE ... CURSOR / FETCH) geholt,
+        so daß der Speicherbedarf auch bei sehr großen Ergebnissen
+        konstant bleibt.
+
+        table, fields, where, query_data, compact -- siehe select
+        chunk_size -- Anzahl der Zeilen pro FETCH
+                      (Vorgabe: FETCH_CHUNKSIZE)
+
+        Der Cursor existiert nur innerhalb der laufenden Transaktion;
+        während der Iteration darf also kein COMMIT abgesetzt werden
+        (am besten im Transaktionskontext verwenden: "with ... as sql:").
+        """
+        query = self._select_statement(table, fields, where, query_data)
+        return self._iterate(query, query_data, chunk_size, compact)
+        # ----------------------------------------- ] ... iterselect ]
+
+    def iterquery(self, query,  # ------------------ [ iterquery ... [
+                  names={}, query_data=None, chunk_size=None,
+                  compact=False):
+        """
+        Wie query, aber als Generator (siehe iterselect).
+        Die Abfrage muß aus einem einzelnen SELECT-Statement bestehen.
+        """
+        q = replace_names(query, **names)
+        return self._iterate(q, query_data, chunk_size, compact)
+        # ------------------------------------------ ] ... iterquery ]
+
+    def _iterate(self, query, query_data, chunk_size, compact):
+        """
+        Generator für iterselect und iterquery:
+        Lies das Ergebnis blockweise über einen serverseitigen Cursor.
+        """
+        if chunk_size is None:
+            chunk_size = self.FETCH_CHUNKSIZE
+        cursor = 'sqlwrapper_cursor_%d' % next(_cursor_numbers)
+        query = query.strip()
+        if query.endswith(';'):
+            query = query[:-1]
+        declare = 'DECLARE %s NO SCROLL CURSOR FOR %s;' % (cursor, query)
+        fetch = 'FETCH FORWARD %d FROM %s;' % (chunk_size, cursor)
+        DEBUG('_iterate:\n   query=%r\n   query_data=%r',
+              declare, query_data)
+        self._execute(declare, query_data)
+        make = None
+        try:
+            while True:
+                queryResult = self._execute(fetch)
+                raw = queryResult[1]
+                if not raw:
+                    break
+                if make is None:
+                    make = row_factory(column_names(queryResult[0]),
+                                       compact)
+                for row in raw:
+                    yield make(row)
+                if len(raw) < chunk_size:
+                    break
+        except GeneratorExit:
+            # vorzeitig abgebrochen:
+            self._execute('CLOSE %s;' % cursor)
+            raise
+        # (nach Datenbankfehlern ist die Transaktion ohnehin abgebrochen)
+        self._execute('CLOSE %s;' % cursor)
+
     def query(self, query,  # -------------------------- [ query ... [
-              names={}, query_data=None, maxrows=None):
+              names={}, query_data=None, maxrows=None,
+              compact=False, cache=False, tables=(),
+              read_only=False):
         """
         query - Eine Datenbankabfrage mit Platzhaltern für Namen und Daten
         query_data - für Daten
         names - die Namen, z. B. von Tabellen (ein dict)
+        compact -- wenn True, werden statt Dictionarys kompakte Row-Objekte
+                   zurückgegeben (siehe select)
+        cache -- True oder eine Verfallszeit in Sekunden (siehe select)
+        tables -- die von der Abfrage gelesenen Tabellen, deren Änderung
+                  das gespeicherte Ergebnis invalidieren soll; ohne diese
+                  Angabe verfällt es nur nach Ablauf der Zeit.
+                  Schreibende Abfragen invalidieren nichts; ggf.
+                  invalidate_results verwenden!
+        read_only -- die Abfrage liest nur und kann daher über ein
+                     Replikat laufen (siehe das replicas-Modul).
+                     Ansonsten laufen nach schreibenden Abfragen alle
+                     weiteren Zugriffe des Requests über die primäre
+                     Datenbank.
         """
         q = replace_names(query, **names)
         DEBUG('query:\n   query=%r\n   maxrows=%r\n   query_data=%r',
               q, maxrows, query_data)
-        queryResult = self.db.query(q, maxrows, query_data)
-        result = []
-        if not queryResult[1]:
-            return result
-        for row in queryResult[1]:
-            res = {}
-            for i in range(len(row)):
-                value = row[i]
-                name = queryResult[0][i]['name']
-                res[name] = value
-            result.append(res)
-        return result
+        if (not read_only
+            and self.replica_router is not None
+            and not is_read_only(q)
+            ):
+            self._pin_primary()
+        queryResult = self._read(q, query_data, maxrows, cache, tables,
+                                 read_only)
+        return make_rows(queryResult, compact)
         # ---------------------------------------------- ] ... query ]
 
+    def explain(self, query, query_data=None, analyze=False):
+        """
+        Ermittle den Ausführungsplan des Statements, z. B. zur Kontrolle
+        der mit make_where_mask generierten WHERE-Kriterien
+        (siehe explain.explain_statement; mit <analyze> wird das Statement
+        ausgeführt, aber in einem Savepoint, der zurückgerollt wird).
+        Gib ein Dictionary mit den Schlüsseln plan, seq_scans, total_cost
+        und execution_time zurück.
+        """
+        self._flush()
+        return explain_statement(self.db, query, query_data, analyze)
+
+    # Threads für gather (siehe das fanout-Modul):
+    read_pool = read_pool
+
+    def gather(self, calls):
+        """
+        Führe voneinander unabhängige Lesezugriffe gleichzeitig aus
+        (über die Threads von read_pool, mit je eigener Verbindung);
+        gib die Ergebnisse in derselben Reihenfolge zurück:
+
+          users, tans = sql.gather([
+              ('select', ('users',), {'query_data': {'active': True}}),
+              ('query', ('SELECT * FROM tan WHERE status = %(status)s;',),
+               {'query_data': {'status': 'new'}}),
+              ])
+
+        calls -- eine Sequenz von Tupeln (Methode, args) oder
+                 (Methode, args, kwargs); erlaubt sind die Methoden
+                 select, query, select_by_keys und select_page, und
+                 query nur mit einem einzelnen lesenden Statement.
+
+        Innerhalb einer Transaktion ("with ... as sql:") ist gather nicht
+        erlaubt: die anderen Threads sähen deren Änderungen nicht.
+
+        >>> from .standin import SQLiteConnection
+        >>> db = SQLiteConnection()
+        >>> sql = Adapter.from_connection(db)
+        >>> sql.query('CREATE TABLE tan (id integer PRIMARY KEY,'
+        ...           ' status text);')
+        []
+        >>> sql.insert_many('tan', [{'id': i, 'status': 'new'}
+        ...                         for i in range(1, 4)])
+        >>> sql.gather([
+        ...     ('select', ('tan', ['id']), {'query_data': {'id': 2}}),
+        ...     ('query', ('SELECT count(*) AS n FROM tan;',)),
+        ...     ])
+        [[{'id': 2}], [{'n': 3}]]
+        >>> with sql:
+        ...     sql.gather([('select', ('tan',))])
+        Traceback (most recent call last):
+          ...
+        ValueError: gather: not allowed within a transaction
+        """
+        if self._transaction_level:
+            raise ValueError('gather: not allowed within a transaction')
+        funcs = []
+        for call in calls:
+            name, args = call[:2]
+            kwargs = call[2] if len(call) > 2 else {}
+            if name not in READ_METHODS:
+                raise ValueError('gather: %(name)r is not a reading method'
+                                 % locals())
+            if name == 'query':
+                query = args[0] if args else kwargs['query']
+                names = args[1] if len(args) > 1 else kwargs.get('names', {})
+                if not is_read_only(replace_names(query, **names)):
+                    raise ValueError('gather: not a read-only query: %r'
+                                     % (query,))
+            funcs.append(self._bound_call(name, args, kwargs))
+        # die Verbindungen der Replikate hier ermitteln, nicht im Pool:
+        router = self.replica_router
+        if router is not None and not (self._pinned or primary_pinned()):
+            for name in router.names:
+                self._replica_db(name)
+        return self.read_pool.run(funcs)
+
+    def _bound_call(self, name, args, kwargs):
+        """
+        Für gather: die Methode einer Kopie des Adapters (eigener Zustand
+        für jeden Thread) als Funktion ohne Argumente
+        """
+        # ohne Kontext: die Threads des Pools ermitteln keine Verbindungen
+        # (siehe _replica_db):
+        clone = self._copy(self._default_transaction_tup, None)
+        # in den Threads des Pools gibt es keinen Request:
+        clone._pinned = self._pinned or primary_pinned()
+        method = getattr(clone, name)
+        return lambda: method(*args, **kwargs)
+
+    # prozeßweiter Cache für die Spaltenbeschreibungen (siehe getColumns);
+    # mit Verfallszeit (column_catalog.ttl, in Sekunden):
+    column_catalog = column_catalog
+
+    def _catalog_query(self, query, query_data):
+        return self._execute(query, query_data)
+
     def getFields(self, table):
         """
             Holt alle Spaltennamen aus angegebener Tabelle
+            (ein Tupel, in der Reihenfolge der Tabellendefinition)
         """
-        raise NotImplementedError
+        return self.column_catalog.column_names(self._catalog_query,
+                                                self._db_name, table)
 
     def getColumns(self, table):
         """
-            Holt alle Spalten mit Beschreibung aus der angegebenen Tabelle
+            Holt alle Spalten mit Beschreibung aus der angegebenen Tabelle:
+            eine Liste von Dictionarys mit den Schlüsseln
+            name, type, udt_name, nullable, default, position.
+
+            Beim ersten Zugriff werden die Spalten aller Tabellen des
+            Schemas mit einer einzigen Abfrage gelesen und zwischengespeichert;
+            nach Änderungen der Tabellenstruktur: invalidate_catalog()
         """
-        raise NotImplementedError
+        return [dict(col)
+                for col in self.column_catalog.columns(self._catalog_query,
+                                                       self._db_name, table)
+                ]
 
     def _getFieldtype_(self, field):
-        """ gibt den Feldtypen des Feldes zurück """
-        raise NotImplementedError
+        """ gibt den Feldtypen des Feldes zurück
+
+        field -- 'tabelle.feld' oder 'schema.tabelle.feld'
+        """
+        table, column = check_name(field).rsplit('.', 1)
+        return self.column_catalog.column_type(self._catalog_query,
+                                               self._db_name, table, column)
+
+    def warm_catalog(self, schema=DEFAULT_SCHEMA):
+        """
+        Lade die Spalten aller Tabellen des Schemas in den Cache
+        (eine Abfrage), z. B. beim Start der Instanz
+        """
+        self.column_catalog.warm(self._catalog_query, self._db_name, schema)
+
+    def invalidate_catalog(self, schema=None):
+        """
+        Verwirf die gespeicherten Spaltenbeschreibungen dieser Datenbank
+        (oder nur die des angegebenen Schemas)
+        """
+        self.column_catalog.invalidate(self._db_name, schema)
 
     @staticmethod
     def replace_names(sql, **kwargs):
@@ -453,3 +1858,28 @@ class Adapter(Base):
         werden.
         """
         return replace_names(sql, **kwargs)
+
+
+ANNOTATION_KEY = 'visaplan.plone.sqlwrapper.adapter'
+
+
+def request_adapter(context, *args):
+    """
+    Adapter-Factory (siehe configure.zcml): jeder getAdapter-Aufruf erhält
+    einen neuen Adapter (mit eigenem Transaktionszustand und den eigenen
+    Argumenten für BEGIN TRANSACTION); innerhalb eines Requests wird aber
+    die Ermittlung der Verbindung (Konfiguration, Datenbankadapter,
+    Replikate) nur einmal durchgeführt.  Ohne Request (z. B. in Skripten)
+    wird jeweils alles neu ermittelt.
+    """
+    request = getRequest()
+    if request is None:
+        return Adapter(context, *args)
+    try:
+        annotations = IAnnotations(request)
+    except TypeError:
+        return Adapter(context, *args)
+    prototype = annotations.get(ANNOTATION_KEY)
+    if prototype is None:
+        prototype = annotations[ANNOTATION_KEY] = Adapter(context)
+    return prototype._copy(args, context)
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+visaplan.plone.sqlwrapper.aio: asyncio-Unterstützung (nur Python 3.7+),
+ohne Zope-Abhängigkeiten
+"""
+# Local imports:
+from .asyncsql import AsyncSQLWrapper, FakeAsyncDriver, ThreadedDriver
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+asyncsql-Modul des Adapters sqlwrapper: die ISQLWrapper-API für asyncio
+(nur Python 3.7+; das Unterpaket aio wird für ältere Versionen nicht
+installiert, siehe setup.py)
+
+AsyncSQLWrapper bietet insert, update, delete, select und query als
+Coroutinen sowie iterselect und iterquery für "async for"; die Statements
+werden mit denselben Funktionen erzeugt wie vom (Zope-) Adapter (Modul
+statements, mit dem gemeinsamen statement_cache).
+
+Die Datenbank wird über einen austauschbaren Treiber angesprochen; der
+Treiber hat eine Coroutine query(query_string, max_rows, query_data) mit
+demselben Protokoll wie die Verbindung eines Zope-Datenbankadapters
+(Rückgabewert: (Spaltenbeschreibungen, Zeilen); pyformat-Platzhalter;
+es ist stets eine Transaktion offen, die mit COMMIT endet).  Hat der
+Treiber ein Attribut paramstyle, werden die Platzhalter in diesen Stil
+übersetzt (siehe das placeholders-Modul).  Enthalten sind:
+
+  FakeAsyncDriver -- für Tests: protokolliert die Statements und gibt
+                     vorbereitete Ergebnisse zurück
+  ThreadedDriver -- für synchrone Verbindungen (z. B.
+                    standin.SQLiteConnection), im Executor ausgeführt
+
+Verwendung:
+
+  sql = AsyncSQLWrapper(driver)
+  rows = await sql.select('tan', query_data={'status': 'new'})
+  async with sql:
+      await sql.update('tan', {'status': 'used'}, query_data={'tan': 42})
+  async for row in sql.iterselect('tan'):
+      ...
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+__all__ = [# Klassen:
+           'AsyncSQLWrapper',
+           'FakeAsyncDriver',
+           'ThreadedDriver',
+           ]
+
+# Standard library:
+import asyncio
+import sys
+from itertools import count
+from time import time
+
+# Local imports:
+from .. import instrument
+from ..placeholders import render
+from ..rows import column_names, make_rows, row_factory
+from ..statements import (
+    check_update_keys,
+    delete_statement,
+    insert_statement,
+    select_statement,
+    update_statement,
+    )
+from ..utils import generate_dicts, make_transaction_cmd, replace_names
+
+_cursor_numbers = count(1)
+
+
+class FakeAsyncDriver(object):
+    """
+    Treiber für Tests: protokolliert die Aufrufe (calls) und gibt die
+    vorbereiteten Ergebnisse der Reihe nach zurück (danach ((), [])).
+
+    delay -- Wartezeit pro Statement (Sekunden)
+    paramstyle -- der Platzhalter-Stil (siehe das placeholders-Modul)
+
+    >>> driver = FakeAsyncDriver([([{'name': 'tan'}], [(1,), (2,)])])
+    >>> sql = AsyncSQLWrapper(driver)
+    >>> asyncio.run(sql.select('tan', ['tan'], query_data={'status': 'new'}))
+    [{'tan': 1}, {'tan': 2}]
+    >>> driver.calls
+    [('SELECT tan FROM tan WHERE status = %(status)s;', None, {'status': 'new'})]
+
+    Ein Treiber wie asyncpg erwartet numerierte Platzhalter:
+
+    >>> driver = FakeAsyncDriver(paramstyle='numeric')
+    >>> sql = AsyncSQLWrapper(driver)
+    >>> asyncio.run(sql.update('tan', {'status': 'used'},
+    ...                        query_data={'tan': 42}))
+    ((), [])
+    >>> driver.calls                            # doctest: +NORMALIZE_WHITESPACE
+    [('UPDATE tan SET status=$1 WHERE tan = $2;', None, ['used', 42]),
+     ('COMMIT;', None, None)]
+    """
+
+    def __init__(self, results=None, delay=0, paramstyle='pyformat'):
+        self.results = list(results or [])
+        self.delay = delay
+        self.paramstyle = paramstyle
+        self.calls = []
+
+    async def query(self, query_string, max_rows=None, query_data=None):
+        self.calls.append((query_string, max_rows, query_data))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.results:
+            return self.results.pop(0)
+        return ((), [])
+
+
+class ThreadedDriver(object):
+    """
+    Treiber für eine synchrone Verbindung (mit der Methode query);
+    die Statements werden im Executor der Event-Loop ausgeführt.
+    Der Platzhalter-Stil (paramstyle) ist der der Verbindung.
+
+    >>> from ..standin import SQLiteConnection
+    >>> sql = AsyncSQLWrapper(ThreadedDriver(SQLiteConnection()))
+    >>> async def demo():
+    ...     await sql.query('CREATE TABLE tan (tan integer, status text);')
+    ...     await sql.insert('tan', {'tan': 1, 'status': 'new'})
+    ...     async with sql:
+    ...         await sql.insert('tan', {'tan': 2, 'status': 'new'})
+    ...         await sql.update('tan', {'status': 'used'},
+    ...                          query_data={'tan': 1})
+    ...     return [row['tan'] async for row in sql.iterselect(
+    ...                 'tan', query_data={'status': 'new'}, chunk_size=1)]
+    >>> asyncio.run(demo())
+    [2]
+
+    Dasselbe mit einer Verbindung, die nur einzelne Statements mit
+    ?-Platzhaltern annimmt:
+
+    >>> sql = AsyncSQLWrapper(ThreadedDriver(SQLiteConnection(
+    ...                                         paramstyle='qmark')))
+    >>> asyncio.run(demo())
+    [2]
+    """
+
+    def __init__(self, db, executor=None):
+        self.db = db
+        self.executor = executor
+        self.paramstyle = getattr(db, 'paramstyle', 'pyformat')
+
+    async def query(self, query_string, max_rows=None, query_data=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.db.query,
+                                          query_string, max_rows, query_data)
+
+
+class AsyncSQLWrapper(object):
+    """
+    Die ISQLWrapper-API für asyncio.
+
+    Im Transaktionskontext ("async with sql:") wird zu Beginn ein BEGIN
+    gesendet und am Ende COMMIT bzw. (nach Exceptions) ROLLBACK; die
+    schreibenden Methoden hängen dort kein COMMIT an.  Der Adapter hat
+    einen Transaktionszustand und ist daher pro Task zu verwenden.
+    """
+
+    # Anzahl der Zeilen pro FETCH (iterselect, iterquery):
+    FETCH_CHUNKSIZE = 1000
+
+    def __init__(self, driver, *args):
+        """
+        driver -- der Treiber (mit einer Coroutine query)
+        args -- Spezifikation für 'BEGIN TRANSACTION' (optional)
+        """
+        self.driver = driver
+        self._paramstyle = getattr(driver, 'paramstyle', 'pyformat')
+        self._begin_transaction_tup = args
+        self._transaction_level = 0
+
+    async def __aenter__(self):
+        if not self._transaction_level:
+            await self._send(make_transaction_cmd(
+                    'BEGIN', *self._begin_transaction_tup))
+        self._transaction_level += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        assert self._transaction_level >= 1
+        self._transaction_level -= 1
+        if not self._transaction_level:
+            await self._send(exc_type is None and 'COMMIT;' or 'ROLLBACK;')
+
+    async def _send(self, query, maxrows=None, query_data=None):
+        """
+        Alle Zugriffe auf self.driver.query laufen hierüber
+        (ggf. mit Zeitmessung für die Sinks des instrument-Moduls);
+        die Platzhalter werden ggf. in den Stil des Treibers übersetzt.
+        """
+        sql, params = query, query_data
+        if self._paramstyle != 'pyformat':
+            sql, params = render(query, query_data, self._paramstyle)
+        targets = instrument.sinks and instrument.active_sinks()
+        if not targets:
+            return await self.driver.query(sql, maxrows, params)
+        error = None
+        rows = 0
+        start = time()
+        try:
+            res = await self.driver.query(sql, maxrows, params)
+            if res:
+                rows = len(res[1])
+            return res
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            event = instrument.QueryEvent(query, time() - start, rows, None,
+                                          error, query_data, self.driver,
+                                          sys._getframe())
+            instrument.dispatch(event, targets)
+            event.release()
+
+    def _split_commit(self, commit):
+        """
+        Gib ein 2-Tupel zurück: soll das COMMIT an das Statement gehängt
+        bzw. danach einzeln gesendet werden?  Treiber mit einem anderen
+        Platzhalter-Stil als pyformat (DB-API, asyncpg) nehmen nur ein
+        Statement pro Aufruf an.
+        """
+        if commit is None:
+            commit = not self._transaction_level
+        if commit and self._paramstyle != 'pyformat':
+            return False, True
+        return commit, False
+
+    async def insert(self, table, dict_of_values,
+                     returning=None, commit=None):
+        """
+        Speichere die Werte aus dem Dictionary in die Tabelle
+        (siehe Adapter.insert); mit <returning> wird eine Liste von
+        Dictionarys zurückgegeben.
+        """
+        commit, commit_after = self._split_commit(commit)
+        query = insert_statement(table, dict_of_values, returning, commit)
+        res = await self._send(query, None, dict_of_values)
+        if commit_after:
+            await self._send('COMMIT;')
+        if returning:
+            return list(generate_dicts(res, names=returning))
+
+    async def update(self, table, dict_of_values,
+                     where=None, query_data=None,
+                     returning=None, commit=None):
+        """
+        Ändere die Werte (siehe Adapter.update); <query_data> wird nicht
+        verändert.
+        """
+        query_data = dict(query_data or {})
+        if query_data:
+            check_update_keys(dict_of_values, query_data)
+        commit, commit_after = self._split_commit(commit)
+        query = update_statement(table, dict_of_values, where, query_data,
+                                 returning, commit)
+        query_data.update(dict_of_values)
+        res = await self._send(query, None, query_data)
+        if commit_after:
+            await self._send('COMMIT;')
+        if returning:
+            return list(generate_dicts(res, names=returning))
+        return res
+
+    async def delete(self, table, where=None, query_data=None,
+                     returning=None, commit=None):
+        """
+        Lösche Zeilen (siehe Adapter.delete)
+        """
+        commit, commit_after = self._split_commit(commit)
+        query = delete_statement(table, where, query_data, returning,
+                                 commit)
+        res = await self._send(query, None, query_data)
+        if commit_after:
+            await self._send('COMMIT;')
+        if returning:
+            return list(generate_dicts(res, names=returning))
+        return res
+
+    async def select(self, table, fields=None, where=None,
+                     query_data=None, maxrows=None, compact=False,
+                     order_by=None, limit=None, offset=None):
+        """
+        Hole Werte aus einer Tabelle oder Sicht (siehe Adapter.select)
+        """
+        query = select_statement(table, fields, where, query_data,
+                                 order_by, limit, offset)
+        res = await self._send(query, maxrows, query_data)
+        return make_rows(res, compact)
+
+    async def query(self, query, names=None, query_data=None, maxrows=None,
+                    compact=False):
+        """
+        Führe eine Abfrage aus (siehe Adapter.query)
+        """
+        q = replace_names(query, **(names or {}))
+        res = await self._send(q, maxrows, query_data)
+        return make_rows(res, compact)
+
+    def iterselect(self, table, fields=None, where=None, query_data=None,
+                   chunk_size=None, compact=False):
+        """
+        Wie select, aber für "async for": die Zeilen werden blockweise über
+        einen serverseitigen Cursor geholt (außerhalb eines
+        Transaktionskontexts in einer eigenen Transaktion).
+        """
+        query = select_statement(table, fields, where, query_data)
+        return self._iterate(query, query_data, chunk_size, compact)
+
+    def iterquery(self, query, names=None, query_data=None,
+                  chunk_size=None, compact=False):
+        """
+        Wie query, aber für "async for" (siehe iterselect)
+        """
+        q = replace_names(query, **(names or {}))
+        return self._iterate(q, query_data, chunk_size, compact)
+
+    async def _iterate(self, query, query_data, chunk_size, compact):
+        if chunk_size is None:
+            chunk_size = self.FETCH_CHUNKSIZE
+        cursor = 'sqlwrapper_cursor_%d' % next(_cursor_numbers)
+        query = query.strip()
+        if query.endswith(';'):
+            query = query[:-1]
+        async with self:
+            await self._send('DECLARE %s NO SCROLL CURSOR FOR %s;'
+                             % (cursor, query), None, query_data)
+            fetch = 'FETCH FORWARD %d FROM %s;' % (chunk_size, cursor)
+            make = None
+            try:
+                while True:
+                    res = await self._send(fetch)
+                    raw = res[1]
+                    if not raw:
+                        break
+                    if make is None:
+                        make = row_factory(column_names(res[0]), compact)
+                    for row in raw:
+                        yield make(row)
+                    if len(raw) < chunk_size:
+                        break
+            finally:
+                await self._send('CLOSE %s;' % cursor)
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod()
+
+# vim: ts=8 sts=4 sw=4 si et
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+browser-Modul des Adapters sqlwrapper: Views
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+# Zope:
+from Products.Five.browser import BrowserView
+
+# Local imports:
+from .metrics import to_json, to_prometheus
+
+
+class SQLMetricsView(BrowserView):
+    """
+    @@sqlwrapper-metrics: die SQL-Aggregate dieses Prozesses
+    im Textformat von Prometheus, oder mit ?format=json als JSON
+    """
+
+    def __call__(self):
+        response = self.request.response
+        response.setHeader('Cache-Control', 'no-cache')
+        if self.request.form.get('format') == 'json':
+            response.setHeader('Content-Type',
+                               'application/json; charset=utf-8')
+            return to_json()
+        response.setHeader('Content-Type',
+                           'text/plain; version=0.0.4; charset=utf-8')
+        return to_prometheus()
+
+# vim: ts=8 sts=4 sw=4 si et
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+caching-Modul des Adapters sqlwrapper: prozeßweite Caches
+
+- LRUCache: einfacher, threadsicherer LRU-Cache mit Zählern,
+  z. B. für die generierten SQL-Statements (statement_cache)
+- ResultCache: Cache für Abfrageergebnisse (result_cache), mit
+  Speicherbudget, Verfallszeit und Invalidierung pro Tabelle
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+__all__ = [# Funktionen:
+           'freeze_names',
+           'data_shape',
+           'freeze_data',
+           'estimate_size',
+           # Klassen:
+           'LRUCache',
+           'ResultCache',
+           # Daten:
+           'statement_cache',
+           'result_cache',
+           ]
+
+# Standard library:
+from collections import OrderedDict
+from sys import getsizeof
+from threading import Lock
+from time import time
+
+# Local imports:
+from .utils import is_sequence
+
+STATEMENT_CACHE_SIZE = 512
+RESULT_CACHE_BYTES = 16 * 1024 * 1024
+RESULT_CACHE_TTL = 60  # Sekunden
+
+
+def freeze_names(names):
+    """
+    Für Cache-Schlüssel: Gib eine hashbare Entsprechung einer Namensangabe
+    (z. B. fields oder returning) zurück.
+
+    >>> freeze_names(['id', 'status'])
+    ('id', 'status')
+    >>> freeze_names('*')
+    '*'
+    >>> freeze_names(None)
+    """
+    if names is None or not is_sequence(names):
+        return names
+    return tuple(names)
+
+
+def data_shape(query_data):
+    """
+    Für Cache-Schlüssel: die "Form" der Query-Daten, die das von
+    make_where_mask generierte WHERE-Kriterium bestimmt
+    (die Schlüssel, und ob es sich jeweils um Sequenzen handelt).
+
+    >>> data_shape({'status': ['new', 'reserved'], 'id': 42})
+    (('id', False), ('status', True))
+    >>> data_shape(None)
+    """
+    if not query_data:
+        return None
+    return tuple([(key, is_sequence(query_data[key]))
+                  for key in sorted(query_data.keys())
+                  ])
+
+
+def freeze_data(query_data):
+    """
+    Für Cache-Schlüssel: Gib eine hashbare Entsprechung der Query-Daten
+    zurück; Listen und Tupel bleiben unterscheidbar, da der
+    Datenbanktreiber sie verschieden umsetzt (ARRAY[...] bzw. (...)):
+
+    >>> freeze_data({'status': ['new', 'used'], 'id': 42})
+    ...                                         # doctest: +ELLIPSIS
+    (('id', 42), ('status', (<... 'list'>, ('new', 'used'))))
+    >>> freeze_data(None)
+
+    Für nicht hashbare Werte gibt es einen TypeError.
+    """
+    if isinstance(query_data, dict):
+        return tuple(sorted([(key, freeze_data(val))
+                             for key, val in query_data.items()
+                             ]))
+    if isinstance(query_data, (list, tuple)):
+        return (query_data.__class__, tuple(map(freeze_data, query_data)))
+    if isinstance(query_data, set):
+        return frozenset(query_data)
+    hash(query_data)
+    return query_data
+
+
+def estimate_size(obj):
+    """
+    Schätze den Speicherbedarf eines Ergebnisses (in Bytes), einschließlich
+    der enthaltenen Sequenzen, Dictionarys und Werte; mehrfach
+    referenzierte Objekte werden mehrfach gezählt.
+
+    >>> estimate_size([(1, 'a')]) > estimate_size([])
+    True
+    """
+    size = getsizeof(obj)
+    if isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += estimate_size(item)
+    elif isinstance(obj, dict):
+        for key, val in obj.items():
+            size += estimate_size(key) + estimate_size(val)
+    return size
+
+
+class LRUCache(object):
+    """
+    Ein einfacher LRU-Cache ("least recently used"), threadsicher und mit
+    Zählern für Treffer, Fehlschläge und Verdrängungen.
+
+    >>> cache = LRUCache(2)
+    >>> cache.get('a', str.upper, 'a')
+    'A'
+    >>> cache.get('a', str.upper, 'xyz')
+    'A'
+    >>> cache.get('b', str.upper, 'b')
+    'B'
+    >>> cache.get('c', str.upper, 'c')
+    'C'
+    >>> sorted(cache.stats().items())
+    [('evictions', 1), ('hits', 1), ('maxsize', 2), ('misses', 3), ('size', 2)]
+    >>> 'a' in cache
+    False
+
+    Mit maxsize=0 wird nichts gespeichert:
+
+    >>> cache.resize(0)
+    >>> cache.get('b', str.upper, 'b')
+    'B'
+    >>> len(cache)
+    0
+    """
+
+    def __init__(self, maxsize=STATEMENT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, factory, *args, **kwargs):
+        """
+        Gib den Wert für <key> zurück; wenn nicht vorhanden, erzeuge ihn
+        durch Aufruf von factory(*args, **kwargs) und speichere ihn.
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data[key] = value
+                return value
+        value = factory(*args, **kwargs)
+        if self.maxsize > 0:
+            with self._lock:
+                self._data[key] = value
+                self._shrink()
+        return value
+
+    def _shrink(self):
+        data = self._data
+        while len(data) > self.maxsize:
+            data.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, maxsize):
+        """
+        Ändere die maximale Anzahl der Einträge
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            self._shrink()
+
+    def clear(self):
+        """
+        Leere den Cache (die Zähler bleiben erhalten)
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        Gib die Zähler und die aktuelle Größe als Dictionary zurück
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self._data),
+                    'maxsize': self.maxsize,
+                    }
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResultCache(object):
+    """
+    Cache für Abfrageergebnisse: LRU-Verdrängung bei Überschreitung des
+    Speicherbudgets (max_bytes, geschätzt), Verfallszeit (ttl, Sekunden)
+    und Invalidierung aller Einträge, die eine bestimmte Tabelle gelesen
+    haben.
+
+    >>> cache = ResultCache(max_bytes=10000)
+    >>> cache.put('a', ([], [(1,)]), ['tan'])
+    True
+    >>> cache.get('a')
+    ([], [(1,)])
+    >>> cache.invalidate('tan')
+    >>> cache.get('a')
+    >>> sorted(cache.stats().items())          # doctest: +NORMALIZE_WHITESPACE
+    [('bytes', 0), ('evictions', 0), ('expirations', 0), ('hits', 1),
+     ('invalidations', 1), ('max_bytes', 10000), ('misses', 1),
+     ('size', 0), ('ttl', 60)]
+
+    Damit ein Ergebnis, das vor einer Invalidierung gelesen wurde, nicht
+    nachträglich gespeichert wird, kann vor der Abfrage ein "token"
+    ermittelt und an put übergeben werden:
+
+    >>> token = cache.token(['tan'])
+    >>> cache.invalidate('tan')
+    >>> cache.put('a', ([], [(2,)]), ['tan'], token=token)
+    False
+
+    Abgelaufene Einträge werden beim Zugriff verworfen:
+
+    >>> cache.put('b', ([], []), ttl=-1)
+    True
+    >>> cache.get('b')
+    >>> cache.expirations
+    1
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES, ttl=RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (Verfallszeitpunkt, Größe, Tabellen, Wert):
+        self._data = OrderedDict()
+        # Tabelle -> set(keys):
+        self._tables = {}
+        # Tabelle -> Anzahl der Invalidierungen:
+        self._generations = {}
+        self._lock = Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        Gib den gespeicherten Wert zurück, oder None
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time():
+                self._forget(key, entry)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data[key] = entry
+            self.hits += 1
+            return entry[3]
+
+    def token(self, tables):
+        """
+        Gib den aktuellen Invalidierungsstand der Tabellen zurück
+        (für put)
+        """
+        get = self._generations.get
+        return tuple([get(table, 0) for table in tables])
+
+    def put(self, key, value, tables=(), ttl=None, token=None):
+        """
+        Speichere den Wert; gib True zurück, wenn das geschehen ist.
+
+        tables -- die gelesenen Tabellen (für invalidate)
+        ttl -- abweichende Verfallszeit in Sekunden
+        token -- der Invalidierungsstand vor der Abfrage (siehe token)
+        """
+        tables = tuple(tables)
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return False
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            if token is not None and token != self.token(tables):
+                return False
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._forget(key, old)
+            self._data[key] = (time() + ttl, size, tables, value)
+            for table in tables:
+                self._tables.setdefault(table, set()).add(key)
+            self.bytes += size
+            self._shrink()
+        return True
+
+    def _forget(self, key, entry):
+        """
+        Entferne die Verwaltungsdaten eines (bereits aus _data entfernten)
+        Eintrags
+        """
+        self.bytes -= entry[1]
+        for table in entry[2]:
+            keys = self._tables.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tables[table]
+
+    def _shrink(self):
+        data = self._data
+        while self.bytes > self.max_bytes and data:
+            key, entry = data.popitem(last=False)
+            self._forget(key, entry)
+            self.evictions += 1
+
+    def invalidate(self, *tables):
+        """
+        Verwirf alle Einträge, welche die angegebenen Tabellen gelesen haben
+        """
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+                for key in self._tables.pop(table, ()):
+                    entry = self._data.pop(key, None)
+                    if entry is not None:
+                        self._forget(key, entry)
+                        self.invalidations += 1
+
+    def resize(self, max_bytes):
+        """
+        Ändere das Speicherbudget
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._shrink()
+
+    def clear(self):
+        """
+        Leere den Cache (die Zähler bleiben erhalten)
+        """
+        with self._lock:
+            self._data.clear()
+            self._tables.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """
+        Gib die Zähler und die aktuelle Größe als Dictionary zurück
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations,
+                    'invalidations': self.invalidations,
+                    'size': len(self._data),
+                    'bytes': self.bytes,
+                    'max_bytes': self.max_bytes,
+                    'ttl': self.ttl,
+                    }
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+# die generierten SQL-Statements, prozeßweit:
+statement_cache = LRUCache(STATEMENT_CACHE_SIZE)
+# die Abfrageergebnisse (nur auf Anforderung; siehe Adapter.select):
+result_cache = ResultCache(RESULT_CACHE_BYTES, RESULT_CACHE_TTL)
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod()
+
+# vim: ts=8 sts=4 sw=4 si et
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+catalog-Modul des Adapters sqlwrapper: Spaltenkatalog (Schema-Introspektion)
+
+Die Spalten werden aus information_schema.columns gelesen, und zwar immer
+für alle Tabellen (und Sichten) eines Schemas mit einer einzigen Abfrage;
+das Ergebnis wird prozeßweit zwischengespeichert (mit Verfallszeit und
+expliziter Invalidierung).
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+__all__ = [# Funktionen:
+           'split_table_name',
+           'qualified_name',
+           # Klassen:
+           'ColumnCatalog',
+           # Daten:
+           'column_catalog',
+           ]
+
+# Standard library:
+from threading import Lock
+from time import time
+
+# Local imports:
+from .utils import check_name
+
+CATALOG_TTL = 600  # Sekunden
+DEFAULT_SCHEMA = 'public'
+
+COLUMNS_QUERY = ('SELECT table_name, column_name, data_type, udt_name,'
+                 ' is_nullable, column_default, ordinal_position'
+                 ' FROM information_schema.columns'
+                 ' WHERE table_schema = %(schema)s'
+                 ' ORDER BY table_name, ordinal_position;')
+
+
+def split_table_name(table):
+    """
+    Zerlege einen (ggf. schema-qualifizierten) Tabellennamen:
+
+    >>> split_table_name('tan.tan_history')
+    ('tan', 'tan_history')
+    >>> split_table_name('users')
+    ('public', 'users')
+    >>> split_table_name('a.b.c')
+    Traceback (most recent call last):
+      ...
+    ValueError: Too many segments in 'a.b.c'
+    """
+    segments = check_name(table).split('.')
+    if segments[2:]:
+        raise ValueError('Too many segments in %(table)r' % locals())
+    if segments[1:]:
+        return tuple(segments)
+    return DEFAULT_SCHEMA, segments[0]
+
+
+def qualified_name(table):
+    """
+    Gib den schema-qualifizierten Tabellennamen zurück
+    (z. B. für die Invalidierung des Ergebnis-Caches):
+
+    >>> qualified_name('users')
+    'public.users'
+    >>> qualified_name('tan.tan')
+    'tan.tan'
+    """
+    return '.'.join(split_table_name(table))
+
+
+def _column_info(row):
+    """
+    Erzeuge die Spaltenbeschreibung aus einer Zeile von COLUMNS_QUERY
+    """
+    (table_name, column_name, data_type, udt_name,
+     is_nullable, column_default, ordinal_position) = row
+    return {'name': column_name,
+            'type': data_type,
+            'udt_name': udt_name,
+            'nullable': is_nullable == 'YES',
+            'default': column_default,
+            'position': ordinal_position,
+            }
+
+
+class ColumnCatalog(object):
+    """
+    Prozeßweiter Cache für die Spaltenbeschreibungen.
+
+    Die Methoden erwarten eine Funktion <query>, die ein SQL-Statement mit
+    Daten ausführt und das Ergebnis im Format von db.query zurückgibt
+    (2-Tupel aus Spaltenbeschreibungen und Zeilen), sowie einen Schlüssel
+    für die Datenbank (z. B. den Namen des Datenbankadapters).
+
+    >>> def query(sql, query_data):
+    ...     print('query(%(schema)r)' % query_data)
+    ...     return ([], [('tan', 'tan', 'integer', 'int4', 'NO', None, 1),
+    ...                  ('tan', 'status', 'text', 'text', 'YES', None, 2)])
+    >>> catalog = ColumnCatalog()
+    >>> [col['name'] for col in catalog.columns(query, 'db', 'tan')]
+    query('public')
+    ['tan', 'status']
+
+    Für weitere Tabellen desselben Schemas ist keine Abfrage nötig:
+
+    >>> catalog.column_type(query, 'db', 'tan', 'status')
+    'text'
+    >>> sorted(catalog.column_casts(query, 'db', 'tan').items())
+    [('status', 'text'), ('tan', 'int4')]
+    >>> catalog.invalidate()
+    >>> catalog.column_names(query, 'db', 'tan')
+    query('public')
+    ('tan', 'status')
+    >>> catalog.loads
+    2
+    """
+
+    def __init__(self, ttl=CATALOG_TTL):
+        self.ttl = ttl
+        self._schemas = {}
+        self._lock = Lock()
+        self.loads = 0
+
+    def warm(self, query, db_key, schema=DEFAULT_SCHEMA):
+        """
+        Lade die Spalten aller Tabellen des Schemas (eine Abfrage)
+        und gib ein Dictionary {Tabellenname: [Spaltenbeschreibungen]}
+        zurück
+        """
+        res = query(COLUMNS_QUERY, {'schema': schema})
+        tables = {}
+        for row in res[1]:
+            tables.setdefault(row[0], []).append(_column_info(row))
+        with self._lock:
+            self._schemas[(db_key, schema)] = (time(), tables)
+            self.loads += 1
+        return tables
+
+    def tables(self, query, db_key, schema=DEFAULT_SCHEMA):
+        """
+        Gib das Dictionary aller Tabellen des Schemas zurück
+        (ggf. aus dem Cache)
+        """
+        entry = self._schemas.get((db_key, schema))
+        if entry is not None:
+            stamp, tables = entry
+            if time() - stamp < self.ttl:
+                return tables
+        return self.warm(query, db_key, schema)
+
+    def columns(self, query, db_key, table):
+        """
+        Gib die Spaltenbeschreibungen der Tabelle zurück; für unbekannte
+        Tabellen wird das Schema einmal neu geladen, bevor es einen
+        ValueError gibt.
+        """
+        schema, name = split_table_name(table)
+        try:
+            return self.tables(query, db_key, schema)[name]
+        except KeyError:
+            try:
+                return self.warm(query, db_key, schema)[name]
+            except KeyError:
+                raise ValueError('Unknown table: %(table)r' % locals())
+
+    def column_names(self, query, db_key, table):
+        """
+        Gib die Spaltennamen der Tabelle als Tupel zurück
+        """
+        return tuple([col['name']
+                      for col in self.columns(query, db_key, table)
+                      ])
+
+    def column_type(self, query, db_key, table, column):
+        """
+        Gib den Datentyp der Spalte zurück (data_type aus
+        information_schema.columns)
+        """
+        for col in self.columns(query, db_key, table):
+            if col['name'] == column:
+                return col['type']
+        raise ValueError('Unknown column %(column)r of table %(table)r'
+                         % locals())
+
+    def column_casts(self, query, db_key, table):
+        """
+        Gib ein Dictionary {Spaltenname: Typname} zurück, z. B. für
+        explizite Typumwandlungen (<wert>::<typ>); die Typnamen sind die
+        internen Namen aus information_schema.columns.udt_name, wobei
+        Array-Typen ('_int4') als 'int4[]' angegeben werden.
+        """
+        res = {}
+        for col in self.columns(query, db_key, table):
+            udt_name = col['udt_name']
+            if udt_name.startswith('_'):
+                udt_name = udt_name[1:] + '[]'
+            res[col['name']] = udt_name
+        return res
+
+    def invalidate(self, db_key=None, schema=None):
+        """
+        Verwirf die gespeicherten Spalten (alle, oder die für die
+        angegebene Datenbank bzw. das angegebene Schema)
+        """
+        with self._lock:
+            if db_key is None and schema is None:
+                self._schemas.clear()
+                return
+            for key in list(self._schemas.keys()):
+                if ((db_key is None or key[0] == db_key)
+                    and (schema is None or key[1] == schema)
+                    ):
+                    del self._schemas[key]
+
+
+column_catalog = ColumnCatalog()
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod()
+
+# vim: ts=8 sts=4 sw=4 si et
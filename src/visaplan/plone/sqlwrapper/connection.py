@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+connection-Modul des Adapters sqlwrapper: Ermittlung der Datenbankverbindung
+
+Der Name des Zope-Datenbankadapters (DA) wird einmal aus der Konfiguration
+gelesen; die Verbindung (<DA>._v_database_connection) wird pro Thread und
+Portal zwischengespeichert (und nur für dieselbe ZODB-Verbindung des
+Portals wiederverwendet).  Verbindet sich der DA neu (oder wird er aus
+der ZODB neu geladen), wird das erkannt, und die Verbindung wird neu
+ermittelt; invalidate_connections() verwirft alle gespeicherten
+Verbindungen.
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+__all__ = [# Funktionen:
+           'database_name',
+           'get_connection',
+           'invalidate_connections',
+           'zope_environment',
+           ]
+
+# Standard library:
+from threading import local
+
+# Zope:
+from App.config import getConfiguration
+from Products.CMFCore.utils import getToolByName
+from zope.component.hooks import getSite
+
+# 3rd party:
+from Acquisition import aq_base
+
+_config = {}
+_local = local()
+# wird von invalidate_connections erhöht (wirkt auf alle Threads):
+_generation = [0]
+
+
+def database_name(key='DATABASE'):
+    """
+    Gib den Namen des Datenbankadapters aus der Zope-Konfiguration zurück
+    (<environment> in zope.conf); die Konfiguration wird nur einmal
+    gelesen.  Ist der Name nicht konfiguriert, gibt es einen KeyError.
+    """
+    try:
+        return _config[key]
+    except KeyError:
+        _config[key] = val = zope_environment()[key]
+        return val
+
+
+def zope_environment():
+    """
+    Gib die Variablen aus dem <environment>-Abschnitt der
+    Zope-Konfiguration zurück (ein Dictionary)
+    """
+    return getConfiguration().environment
+
+
+def get_connection(context, db_name):
+    """
+    Gib die Verbindung des Datenbankadapters <db_name> zurück
+    (<DA>._v_database_connection).
+
+    Wenn möglich, wird die im aktuellen Thread für das aktuelle Portal
+    bereits ermittelte Verbindung verwendet; sie ist gültig, solange das
+    Portal über dieselbe ZODB-Verbindung geladen ist (ein Thread kann in
+    späteren Requests eine andere erhalten; das DA-Objekt der alten darf
+    dann nicht mehr verwendet werden) und der DA dieselbe Verbindung hat
+    (ein Neuverbinden ersetzt sie, und beim Invalidieren des DA-Objekts
+    verschwindet das _v_-Attribut).
+    """
+    key = None
+    site = getSite()
+    if site is not None:
+        jar = getattr(aq_base(site), '_p_jar', None)
+        key = (site.getPhysicalPath(), db_name)
+        cache = _cache()
+        entry = cache.get(key)
+        if entry is not None:
+            cached_jar, da, db = entry
+            if (cached_jar is jar
+                and da.__dict__.get('_v_database_connection') is db
+                ):
+                return db
+    portal = getToolByName(context, 'portal_url').getPortalObject()
+    da = aq_base(getattr(portal, db_name))
+    db = da._v_database_connection
+    if key is not None:
+        cache[key] = (jar, da, db)
+    return db
+
+
+def _cache():
+    """
+    Der Cache des aktuellen Threads (ggf. nach Invalidierung neu)
+    """
+    generation = _generation[0]
+    if getattr(_local, 'generation', None) != generation:
+        _local.connections = {}
+        _local.generation = generation
+    return _local.connections
+
+
+def invalidate_connections():
+    """
+    Verwirf die gespeicherten Verbindungen (in allen Threads) und die
+    gelesene Konfiguration
+    """
+    _config.clear()
+    _generation[0] += 1
+
+
+# vim: ts=8 sts=4 sw=4 si et
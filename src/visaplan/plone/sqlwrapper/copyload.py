@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+copyload-Modul des Adapters sqlwrapper: Massenimport mit COPY ... FROM STDIN
+
+Die Zeilen werden hier selbst in das Text- bzw. CSV-Format des
+PostgreSQL-COPY-Befehls übersetzt und zeilenweise kodiert; ein dateiartiges
+Objekt (CopyReader) liefert sie dem Datenbanktreiber stückweise aus, so daß
+die Daten nie vollständig im Speicher liegen.
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+from six import binary_type, text_type
+
+__all__ = [# Funktionen:
+           'copy_text_value',
+           'copy_csv_value',
+           'iter_copy_lines',
+           'make_copy_statement',
+           # Klassen:
+           'CopyReader',
+           'DictRows',
+           ]
+
+# Standard library:
+from datetime import date, datetime, time
+
+# Local imports:
+from .utils import check_name
+
+COPY_FORMATS = ('text', 'csv')
+TEXT_NULL = u'\\N'
+TEXT_ESCAPES = [(u'\\', u'\\\\'),  # zuerst!
+                (u'\t', u'\\t'),
+                (u'\n', u'\\n'),
+                (u'\r', u'\\r'),
+                ]
+CSV_SPECIALS = frozenset(u',"\n\r')
+
+
+def _text(value):
+    """
+    Wandle einen Python-Wert in einen (Unicode-) String um,
+    wie PostgreSQL ihn für die Eingabe erwartet.
+
+    >>> print(_text(True))
+    t
+    >>> print(_text(date(2020, 8, 17)))
+    2020-08-17
+    >>> print(_text(0.1))
+    0.1
+    >>> isinstance(_text(42), text_type)
+    True
+    """
+    if isinstance(value, text_type):
+        return value
+    if isinstance(value, binary_type):
+        return value.decode('utf-8')
+    if value is True:
+        return u't'
+    if value is False:
+        return u'f'
+    if isinstance(value, float):
+        return text_type(repr(value))
+    if isinstance(value, (datetime, date, time)):
+        return text_type(value.isoformat())
+    return text_type(value)
+
+
+def copy_text_value(value):
+    r"""
+    Formatiere einen Wert für das Textformat des COPY-Befehls
+    (Spalten durch Tabulatoren getrennt, NULL als \N):
+
+    >>> print(copy_text_value(None))
+    \N
+    >>> print(copy_text_value(u'eins\tzwei\nC:\\temp'))
+    eins\tzwei\nC:\\temp
+    >>> print(copy_text_value(42))
+    42
+    """
+    if value is None:
+        return TEXT_NULL
+    value = _text(value)
+    for char, replacement in TEXT_ESCAPES:
+        if char in value:
+            value = value.replace(char, replacement)
+    return value
+
+
+def copy_csv_value(value):
+    """
+    Formatiere einen Wert für das CSV-Format des COPY-Befehls;
+    NULL ist ein leerer, nicht gequoteter Wert:
+
+    >>> copy_csv_value(None) == u''
+    True
+    >>> print(copy_csv_value(u''))
+    ""
+    >>> print(copy_csv_value(u'Sagt "Hallo", und geht'))
+    "Sagt ""Hallo"", und geht"
+    >>> print(copy_csv_value(u'\\.'))
+    "\\."
+    >>> print(copy_csv_value(3))
+    3
+    """
+    if value is None:
+        return u''
+    value = _text(value)
+    if (not value
+        or value == u'\\.'
+        or not CSV_SPECIALS.isdisjoint(value)
+        ):
+        return value.replace(u'"', u'""').join(u'""')
+    return value
+
+
+def iter_copy_lines(rows, columns=None, format='text', encoding='utf-8'):
+    r"""
+    Erzeuge die (kodierten) Zeilen für COPY ... FROM STDIN.
+
+    rows -- eine Sequenz von Dictionarys oder von Sequenzen
+    columns -- die Feldnamen; für Dictionarys erforderlich
+               (fehlende Werte werden zu NULL)
+    format -- 'text' oder 'csv'
+
+    >>> rows = [{'eins': 1, 'zwei': u'a\tb'}, {'eins': 2}]
+    >>> (list(iter_copy_lines(rows, ['eins', 'zwei']))
+    ...  == [b'1\ta\\tb\n', b'2\t\\N\n'])
+    True
+    >>> (list(iter_copy_lines([(1, u'x,y')], format='csv'))
+    ...  == [b'1,"x,y"\n'])
+    True
+    """
+    if format == 'text':
+        fmt, sep = copy_text_value, u'\t'
+    elif format == 'csv':
+        fmt, sep = copy_csv_value, u','
+    else:
+        raise ValueError('Unsupported COPY format: %(format)r' % locals())
+    for row in rows:
+        if isinstance(row, dict):
+            get = row.get
+            values = [fmt(get(col)) for col in columns]
+        else:
+            values = [fmt(val) for val in row]
+        yield (sep.join(values) + u'\n').encode(encoding)
+
+
+def make_copy_statement(table, columns, format='text'):
+    """
+    Erzeuge den COPY-Befehl; Tabellen- und Feldnamen werden mit
+    check_name geprüft:
+
+    >>> make_copy_statement('tan.tan', ['eins', 'zwei'])
+    'COPY tan.tan (eins, zwei) FROM STDIN'
+    >>> make_copy_statement('tan', ['eins'], 'csv')
+    'COPY tan (eins) FROM STDIN WITH (FORMAT csv)'
+    >>> make_copy_statement('tan', ['eins; DROP TABLE tan'])
+    ...                                         # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+      ...
+    ValueError: Invalid chars in 'eins; DROP TABLE tan': ...
+    """
+    if format not in COPY_FORMATS:
+        raise ValueError('Unsupported COPY format: %(format)r' % locals())
+    res = ['COPY', check_name(table),
+           '(%s)' % ', '.join(map(check_name, columns)),
+           'FROM STDIN',
+           ]
+    if format != 'text':
+        res.append('WITH (FORMAT %s)' % format)
+    return ' '.join(res)
+
+
+class CopyReader(object):
+    """
+    Dateiartiges Objekt für cursor.copy_expert: liefert die Zeilen aus
+    einem iterierbaren Objekt stückweise aus, ohne alles auf einmal im
+    Speicher zu halten.
+
+    >>> reader = CopyReader(iter([b'eins\\n', b'zwei\\n', b'drei\\n']))
+    >>> reader.read(6) == b'eins\\nz'
+    True
+    >>> reader.readline() == b'wei\\n'
+    True
+    >>> reader.read() == b'drei\\n'
+    True
+    >>> reader.read(10) == b''
+    True
+    >>> reader.count
+    3
+    """
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = b''
+        self.count = 0
+
+    def _next_line(self):
+        for line in self._lines:
+            self.count += 1
+            return line
+        return b''
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = self._next_line()
+            if not line:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = b''.join(chunks)
+        if size < 0:
+            self._buffer = b''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    def readline(self, size=-1):
+        if self._buffer:
+            pos = self._buffer.find(b'\n')
+            if pos >= 0:
+                line, self._buffer = (self._buffer[:pos+1],
+                                      self._buffer[pos+1:])
+                return line
+            line = self._buffer + self._next_line()
+            self._buffer = b''
+            return line
+        return self._next_line()
+
+
+class DictRows(object):
+    """
+    Iterator für die Rückfallebene (insert_many): liefert die Zeilen als
+    Dictionarys und zählt sie.
+
+    >>> rows = DictRows([(1, 2), {'eins': 3}], ['eins', 'zwei'])
+    >>> [sorted(row.items()) for row in rows]
+    [[('eins', 1), ('zwei', 2)], [('eins', 3)]]
+    >>> rows.count
+    2
+    """
+
+    def __init__(self, rows, columns):
+        self._rows = iter(rows)
+        self._columns = columns
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self._rows)
+        self.count += 1
+        if isinstance(row, dict):
+            return row
+        return dict(zip(self._columns, row))
+
+    next = __next__  # Python 2
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod()
+
+# vim: ts=8 sts=4 sw=4 si et
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+explain-Modul des Adapters sqlwrapper: Ausführungspläne langsamer Statements
+
+PlanCollector ist ein Sink für das instrument-Modul: Überschreitet ein
+Statement die Schwelle, wird (einmal pro Fingerabdruck und Zeitraum) sein
+Ausführungsplan mit EXPLAIN (FORMAT JSON) ermittelt - auf Wunsch mit
+ANALYZE; das geschieht innerhalb eines Savepoints, der anschließend
+zurückgerollt wird, so daß auch schreibende Statements nichts ändern.
+Der Plan wird im Hintergrund ermittelt (ein eigener Thread, also auch eine
+eigene Verbindung des Datenbankadapters), damit der ohnehin langsame
+Request nicht noch länger dauert.  Statements mit COMMIT oder ROLLBACK
+werden nicht untersucht.
+Die Pläne werden bei den Aggregaten des metrics-Moduls gespeichert;
+sequentielle Scans (z. B. wegen fehlender Indexe für die mit
+make_where_mask generierten WHERE-Kriterien) werden protokolliert.
+
+Konfiguration in zope.conf (<environment>):
+
+  SQL_EXPLAIN_THRESHOLD  Schwelle in Sekunden
+  SQL_EXPLAIN_ANALYZE    on: EXPLAIN ANALYZE verwenden
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+from six import string_types as six_string_types
+
+__all__ = [# Funktionen:
+           'explainable',
+           'explain_statement',
+           'seq_scans',
+           # Klassen:
+           'PlanCollector',
+           # Daten:
+           'plan_pool',
+           ]
+
+# Standard library:
+import json
+import logging
+import re
+from threading import Lock
+from time import time
+
+# Local imports:
+from .fanout import ReadPool
+from .metrics import query_metrics
+from .placeholders import render
+
+SAVEPOINT = 'sqlwrapper_explain'
+RECAPTURE_AFTER = 3600  # Sekunden
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+_END_RE = re.compile(r'\b(?:COMMIT|ROLLBACK)\b', re.IGNORECASE)
+
+logger = logging.getLogger('sqlwrapper.explain')
+
+
+def explainable(sql):
+    """
+    Gib das Statement ohne abschließendes Semikolon zurück, wenn es mit
+    EXPLAIN untersucht werden kann, ansonsten None:
+
+    >>> explainable('SELECT * FROM tan WHERE id = %(id)s;')
+    'SELECT * FROM tan WHERE id = %(id)s'
+    >>> explainable('BEGIN TRANSACTION; UPDATE tan SET x=1; COMMIT;')
+    >>> explainable('FETCH FORWARD 1000 FROM sqlwrapper_cursor_1;')
+
+    Nach einem (angehängten) COMMIT gäbe es keine Transaktion mehr für den
+    Savepoint:
+
+    >>> explainable('UPDATE tan SET x=1 WHERE id = %(id)s;COMMIT;')
+    """
+    sql = sql.strip().rstrip(';').rstrip()
+    if ';' in sql or _END_RE.search(sql):
+        return None
+    if sql.split(None, 1)[0].upper() not in EXPLAINABLE:
+        return None
+    return sql
+
+
+def _walk(node):
+    yield node
+    for child in node.get('Plans', ()):
+        for sub in _walk(child):
+            yield sub
+
+
+def seq_scans(plan):
+    """
+    Gib die Tabellen zurück, die laut Plan sequentiell gelesen werden:
+
+    >>> seq_scans([{'Plan': {'Node Type': 'Hash Join', 'Plans': [
+    ...     {'Node Type': 'Seq Scan', 'Relation Name': 'tan'},
+    ...     {'Node Type': 'Index Scan', 'Relation Name': 'users'}]}}])
+    ['tan']
+    """
+    return [node.get('Relation Name')
+            for node in _walk(plan[0]['Plan'])
+            if node.get('Node Type') == 'Seq Scan'
+            ]
+
+
+def explain_statement(db, sql, query_data=None, analyze=False):
+    """
+    Ermittle den Plan des Statements (über die Verbindung <db>, mit
+    db.query) innerhalb eines Savepoints, der anschließend zurückgerollt
+    wird; gib ein Dictionary zurück:
+
+    plan -- der Plan (aus JSON)
+    seq_scans -- die sequentiell gelesenen Tabellen
+    total_cost -- die geschätzten Kosten
+    execution_time -- mit <analyze>: die Ausführungszeit (ms)
+    """
+    explained = explainable(sql)
+    if explained is None:
+        raise ValueError('Not explainable: %(sql)r' % locals())
+    options = analyze and 'ANALYZE, FORMAT JSON' or 'FORMAT JSON'
+    # <sql> hat %(name)s-Platzhalter; ggf. für den Treiber übersetzen:
+    query, params = render('EXPLAIN (%s) %s;' % (options, explained),
+                           query_data,
+                           getattr(db, 'paramstyle', 'pyformat'))
+    db.query('SAVEPOINT %s;' % SAVEPOINT)
+    try:
+        res = db.query(query, None, params)
+    finally:
+        db.query('ROLLBACK TO SAVEPOINT %s;' % SAVEPOINT)
+    plan = res[1][0][0]
+    if isinstance(plan, six_string_types):
+        plan = json.loads(plan)
+    return {'plan': plan,
+            'seq_scans': seq_scans(plan),
+            'total_cost': plan[0]['Plan'].get('Total Cost'),
+            'execution_time': plan[0].get('Execution Time'),
+            'analyze': bool(analyze),
+            }
+
+
+# der Thread für die Ermittlung der Pläne:
+plan_pool = ReadPool(1)
+
+
+class PlanCollector(object):
+    """
+    Sink: Ermittle für Statements ab der Schwelle (in Sekunden) den Plan,
+    einmal pro Fingerabdruck und <recapture_after> Sekunden; die Pläne
+    werden bei den Aggregaten (Vorgabe: metrics.query_metrics)
+    gespeichert.
+
+    pool -- für die Ermittlung im Hintergrund (Vorgabe: plan_pool);
+            mit pool=False geschieht sie sofort (z. B. für Tests)
+    """
+
+    def __init__(self, threshold, analyze=False, metrics=None,
+                 recapture_after=RECAPTURE_AFTER, pool=None):
+        self.threshold = threshold
+        self.analyze = analyze
+        if metrics is None:
+            metrics = query_metrics
+        self.metrics = metrics
+        self.recapture_after = recapture_after
+        if pool is None:
+            pool = plan_pool
+        self.pool = pool
+        # Fingerabdruck -> Zeitpunkt:
+        self._captured = {}
+        self._lock = Lock()
+
+    def __call__(self, event):
+        if (event.duration < self.threshold
+            or event.error is not None
+            or event.db is None
+            ):
+            return
+        if explainable(event.sql) is None:
+            return
+        now = time()
+        with self._lock:
+            captured = self._captured.get(event.fingerprint)
+            if captured is not None and now - captured < self.recapture_after:
+                return
+            self._captured[event.fingerprint] = now
+        # das QueryEvent gilt nur während der Übergabe an die Sinks:
+        query_data = event.query_data
+        if isinstance(query_data, dict):
+            query_data = dict(query_data)
+        args = (event.db, event.sql, query_data, event.fingerprint,
+                event.duration, event.caller, now)
+        if self.pool:
+            self.pool.submit(lambda: self.capture(*args))
+        else:
+            self.capture(*args)
+
+    def capture(self, db, sql, query_data, fingerprint, duration, caller,
+                now):
+        """
+        Ermittle den Plan und speichere ihn bei den Aggregaten
+        """
+        try:
+            info = explain_statement(db, sql, query_data, self.analyze)
+        except Exception as e:
+            logger.error('EXPLAIN failed for %r (%r)', fingerprint, e)
+            return
+        info['duration'] = duration
+        info['captured'] = now
+        self.metrics.set_plan(fingerprint, info)
+        if info['seq_scans']:
+            logger.warning('Seq Scan on %s (%.3f s, from %s): %s',
+                           ', '.join(info['seq_scans']), duration,
+                           caller, fingerprint)
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod()
+
+# vim: ts=8 sts=4 sw=4 si et
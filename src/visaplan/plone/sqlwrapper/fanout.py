@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+fanout-Modul des Adapters sqlwrapper: unabhängige Lesezugriffe parallel
+
+ReadPool ist ein begrenzter Pool von Threads für Adapter.gather:
+voneinander unabhängige Abfragen (select, query ...) laufen gleichzeitig,
+jeweils über die Verbindung des ausführenden Threads (ZPsycopgDA verwendet
+für jeden Thread eine eigene Verbindung), so daß die Wartezeit der
+langsamsten Abfrage entspricht und nicht der Summe.
+
+Nach jeder Aufgabe wird die Transaktion des Threads abgebrochen; dabei gibt
+der Datenbankadapter seine Transaktion frei (es wurde ja nur gelesen).
+
+Größe des Pools: SQL_GATHER_WORKERS in zope.conf (<environment>),
+Vorgabe DEFAULT_WORKERS; oder read_pool.resize(n).
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+from six import reraise
+from six.moves.queue import Queue
+
+__all__ = [# Funktionen:
+           'is_read_only',
+           # Klassen:
+           'ReadPool',
+           # Daten:
+           'read_pool',
+           ]
+
+# Standard library:
+import logging
+import re
+import sys
+from itertools import count
+from threading import Event, Lock, Thread, local
+
+# Zope:
+import transaction
+
+# Local imports:
+from .connection import zope_environment
+
+DEFAULT_WORKERS = 4
+# Methoden des Adapters, die gather ausführt:
+READ_METHODS = ('select', 'query', 'select_by_keys', 'select_page')
+
+_READ_KEYWORDS = ('SELECT', 'WITH', 'VALUES', 'TABLE')
+_WRITE_RE = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|COPY'
+                       r'|CREATE|DROP|ALTER|GRANT|LOCK|INTO)\b'
+                       r'|\bFOR\s+(UPDATE|SHARE|NO KEY UPDATE|KEY SHARE)\b',
+                       re.IGNORECASE)
+
+logger = logging.getLogger('sqlwrapper.fanout')
+_thread_numbers = count(1)
+
+
+def is_read_only(sql):
+    """
+    Handelt es sich um ein einzelnes, nur lesendes Statement?
+
+    >>> is_read_only('SELECT * FROM tan WHERE status = %(status)s;')
+    True
+    >>> is_read_only('SELECT * FROM tan FOR UPDATE;')
+    False
+    >>> is_read_only('WITH x AS (DELETE FROM tan RETURNING *) SELECT * FROM x')
+    False
+    >>> is_read_only('SELECT 1; DELETE FROM tan;')
+    False
+
+    Es wird konservativ geprüft; ggf. stört auch ein Spaltenname wie
+    "update":
+
+    >>> is_read_only('SELECT update FROM log')
+    False
+    """
+    sql = sql.strip().rstrip(';').rstrip()
+    if not sql or ';' in sql:
+        return False
+    if sql.split(None, 1)[0].upper() not in _READ_KEYWORDS:
+        return False
+    return _WRITE_RE.search(sql) is None
+
+
+class _Task(object):
+    __slots__ = ('func', 'done', 'result', 'exc_info', 'detached')
+
+    def __init__(self, func, detached=False):
+        self.func = func
+        self.done = Event()
+        self.result = None
+        self.exc_info = None
+        # niemand wartet auf das Ergebnis (ReadPool.submit):
+        self.detached = detached
+
+    def run(self):
+        try:
+            self.result = self.func()
+        except Exception:
+            if self.detached:
+                logger.exception('background task %r failed', self.func)
+            else:
+                self.exc_info = sys.exc_info()
+        finally:
+            self.done.set()
+
+
+class ReadPool(object):
+    """
+    Begrenzter Pool von Threads für Lesezugriffe.
+    Die Threads werden bei Bedarf gestartet (höchstens <size>).
+
+    >>> pool = ReadPool(2)
+    >>> pool.run([lambda: 1, lambda: 2, lambda: 3])
+    [1, 2, 3]
+    >>> pool.run([lambda: 1, lambda: 1 // 0])
+    Traceback (most recent call last):
+      ...
+    ZeroDivisionError: integer division or modulo by zero
+    """
+
+    def __init__(self, size=None):
+        self._size = size
+        self._queue = Queue()
+        self._threads = []
+        self._lock = Lock()
+        self._local = local()
+
+    @property
+    def size(self):
+        if self._size is None:
+            try:
+                size = zope_environment().get('SQL_GATHER_WORKERS')
+            except Exception:
+                size = None
+            self._size = size and int(size) or DEFAULT_WORKERS
+        return self._size
+
+    def resize(self, size):
+        """
+        Ändere die Höchstzahl der Threads; überzählige Threads
+        beenden sich nach ihrer nächsten Aufgabe
+        """
+        with self._lock:
+            self._size = size
+            for i in range(len(self._threads) - size):
+                self._queue.put(None)
+
+    def _start_threads(self, wanted):
+        with self._lock:
+            self._threads = [thread for thread in self._threads
+                             if thread.is_alive()]
+            for i in range(min(wanted, self.size) - len(self._threads)):
+                thread = Thread(target=self._work,
+                                name='sqlwrapper-gather-%d'
+                                     % next(_thread_numbers))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        self._local.worker = True
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            try:
+                task.run()
+            finally:
+                # die vom Datenbankadapter begonnene Transaktion freigeben:
+                try:
+                    transaction.abort()
+                except Exception as e:
+                    logger.error('abort failed after gather task (%r)', e)
+
+    def submit(self, func):
+        """
+        Führe die Funktion (ohne Argumente) im Hintergrund aus, ohne auf
+        das Ergebnis zu warten (Exceptions werden protokolliert);
+        z. B. für die Ermittlung von Ausführungsplänen (explain-Modul)
+
+        >>> pool = ReadPool(1)
+        >>> task = pool.submit(lambda: 42)
+        >>> task.done.wait(5), task.result
+        (True, 42)
+        """
+        task = _Task(func, True)
+        self._start_threads(1)
+        self._queue.put(task)
+        return task
+
+    def run(self, funcs):
+        """
+        Führe die Funktionen (ohne Argumente) gleichzeitig aus und gib ihre
+        Ergebnisse in derselben Reihenfolge zurück; ist eine davon
+        gescheitert, wird (nachdem alle fertig sind) die Exception der
+        ersten gescheiterten geworfen.
+
+        Die erste Funktion wird im aufrufenden Thread ausgeführt; in den
+        Threads des Pools (verschachtelte Aufrufe) wird alles der Reihe
+        nach ausgeführt, um Verklemmungen zu vermeiden.
+        """
+        tasks = [_Task(func) for func in funcs]
+        if not tasks:
+            return []
+        if getattr(self._local, 'worker', False) or self.size < 1:
+            for task in tasks:
+                task.run()
+        else:
+            self._start_threads(len(tasks) - 1)
+            for task in tasks[1:]:
+                self._queue.put(task)
+            tasks[0].run()
+            for task in tasks[1:]:
+                task.done.wait()
+        for task in tasks:
+            if task.exc_info is not None:
+                reraise(*task.exc_info)
+        return [task.result for task in tasks]
+
+
+# der Pool dieses Prozesses:
+read_pool = ReadPool()
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod(optionflags=doctest.IGNORE_EXCEPTION_DETAIL)
+
+# vim: ts=8 sts=4 sw=4 si et
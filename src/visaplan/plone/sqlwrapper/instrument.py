@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+instrument-Modul des Adapters sqlwrapper: Zeitmessung für SQL-Statements
+
+Alle Aufrufe von db.query durch den Adapter laufen über timed_query; sind
+"Sinks" registriert (add_sink), wird für jedes Statement ein QueryEvent
+erzeugt (Dauer, Zeilenzahl, Fingerabdruck, Tabelle, Aufrufer) und an alle
+Sinks übergeben.  Ohne Sinks entsteht kein Aufwand, ebensowenig wenn alle
+Sinks das Statement ablehnen (Methode active, siehe active_sinks).
+
+Mitgelieferte Sinks:
+
+- SlowQueryLogger: protokolliert Statements oberhalb einer Schwelle
+- QueryStats: einfache Aggregate pro Fingerabdruck, im Speicher
+- jede andere Funktion, die ein QueryEvent als Argument akzeptiert
+
+In der Zope-Konfiguration (<environment> in zope.conf) kann
+SQL_SLOW_QUERY_THRESHOLD (in Sekunden) angegeben werden;
+dann wird beim ersten Zugriff ein SlowQueryLogger registriert.
+Mit SQL_METRICS=on werden die Aggregate des metrics-Moduls gesammelt;
+zu SQL_PROFILE_SAMPLE_RATE siehe das profiler-Modul,
+zu SQL_EXPLAIN_THRESHOLD das explain-Modul.
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+__all__ = [# Funktionen:
+           'fingerprint',
+           'statement_table',
+           'caller_info',
+           'frame_caller',
+           'add_sink',
+           'remove_sink',
+           'active_sinks',
+           'timed_query',
+           'dispatch',
+           'configure',
+           'configured',
+           # Klassen:
+           'QueryEvent',
+           'SlowQueryLogger',
+           'QueryStats',
+           # Daten:
+           'sinks',
+           ]
+
+# Standard library:
+import logging
+import re
+import sys
+from os.path import dirname
+from threading import Lock
+from time import time
+
+# Local imports:
+from .caching import LRUCache
+
+FINGERPRINT_CACHE_SIZE = 1024
+# längere Statements (z. B. mehrzeilige VALUES-Listen) werden im Cache der
+# Fingerabdrücke nur über ihren Hashwert referenziert:
+FINGERPRINT_KEY_LENGTH = 500
+SLOW_QUERY_THRESHOLD = 1.0  # Sekunden
+
+# die registrierten Sinks (prozeßweit; siehe add_sink):
+sinks = []
+_configured = []
+
+_PACKAGE_DIR = dirname(__file__)
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'(?<![\w%)])-?\d+(?:\.\d+)?\b')
+# von merge_statements (s<n>_) und make_multirow_values (_<n>, _d)
+# erzeugte Varianten der Platzhalter:
+_PLACEHOLDER_RE = re.compile(r'%\((?:s\d+_)?([^)]+?)(?:_\d+|_d)?\)s')
+_REPEATED_TUPLE_RE = re.compile(r'(\((?:[^()]|%\([^)]*\)s)*\))(?:, \1)+')
+# die Namen der serverseitigen Cursor (Adapter._iterate):
+_CURSOR_RE = re.compile(r'\bsqlwrapper_cursor_\d+')
+_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN|COPY)\s+'
+                       r'(?!\()([A-Za-z_][\w.]*)',
+                       re.IGNORECASE)
+
+
+def _fingerprint(sql):
+    sql = _WHITESPACE_RE.sub(' ', sql.strip())
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _PLACEHOLDER_RE.sub(r'%(\1)s', sql)
+    sql = _CURSOR_RE.sub('sqlwrapper_cursor_?', sql)
+    return _REPEATED_TUPLE_RE.sub(r'\1, ...', sql)
+
+
+_fingerprints = LRUCache(FINGERPRINT_CACHE_SIZE)
+
+
+def fingerprint(sql):
+    """
+    Gib den "Fingerabdruck" eines SQL-Statements zurück: Statements, die
+    sich nur in den Werten unterscheiden, erhalten denselben Fingerabdruck.
+    Literale werden durch ? ersetzt, die Nummern in generierten
+    Platzhalternamen entfernt und wiederholte VALUES-Tupel zusammengefaßt:
+
+    >>> fingerprint("SELECT * FROM tan WHERE tan = 42  AND status = 'new';")
+    'SELECT * FROM tan WHERE tan = ? AND status = ?;'
+    >>> fingerprint('INSERT INTO tan (status, tan) VALUES'
+    ...             ' (%(status_0)s, %(tan_0)s), (%(status_1)s, %(tan_1)s);')
+    'INSERT INTO tan (status, tan) VALUES (%(status)s, %(tan)s), ...;'
+    >>> fingerprint('FETCH FORWARD 1000 FROM sqlwrapper_cursor_7;')
+    'FETCH FORWARD ? FROM sqlwrapper_cursor_?;'
+
+    Der Speicherbedarf des Caches bleibt auch für sehr lange Statements
+    begrenzt:
+
+    >>> long_sql = ('INSERT INTO tan (tan) VALUES '
+    ...             + ', '.join(['(%%(tan_%d)s)' % i for i in range(1000)])
+    ...             + ';')
+    >>> fingerprint(long_sql)
+    'INSERT INTO tan (tan) VALUES (%(tan)s), ...;'
+    >>> long_sql in _fingerprints
+    False
+    """
+    if len(sql) > FINGERPRINT_KEY_LENGTH:
+        return _fingerprints.get((len(sql), hash(sql)), _fingerprint, sql)
+    return _fingerprints.get(sql, _fingerprint, sql)
+
+
+def statement_table(sql):
+    """
+    Gib den Namen der (ersten) betroffenen Tabelle zurück, oder None:
+
+    >>> statement_table('SELECT id FROM tan.tan WHERE status = %(status)s;')
+    'tan.tan'
+    >>> statement_table('UPDATE users SET name=%(name)s;')
+    'users'
+    >>> statement_table('SELECT * FROM (SELECT 1) AS x;')
+    >>> statement_table('COMMIT;')
+    """
+    mo = _TABLE_RE.search(sql)
+    if mo:
+        return mo.group(1)
+    return None
+
+
+def caller_info(depth=2):
+    """
+    Gib den ersten Aufrufer außerhalb dieses Pakets zurück
+    ('modul:funktion:zeile'), oder None
+    """
+    try:
+        frame = sys._getframe(depth)
+    except ValueError:
+        return None
+    return frame_caller(frame)
+
+
+def frame_caller(frame):
+    """
+    Gib ausgehend von <frame> den ersten Aufrufer außerhalb dieses Pakets
+    zurück (siehe caller_info)
+    """
+    while frame is not None:
+        code = frame.f_code
+        if dirname(code.co_filename) != _PACKAGE_DIR:
+            return '%s:%s:%d' % (frame.f_globals.get('__name__'),
+                                 code.co_name, frame.f_lineno)
+        frame = frame.f_back
+    return None
+
+
+class QueryEvent(object):
+    """
+    Die Daten eines ausgeführten Statements:
+
+    sql -- das Statement (mit %(name)s-Platzhaltern; ohne Daten)
+    fingerprint -- siehe fingerprint()
+    table -- siehe statement_table()
+    duration -- die Dauer in Sekunden
+    rows -- die Anzahl der gelieferten Zeilen
+    caller -- siehe caller_info()
+    error -- ggf. die aufgetretene Exception
+    query_data -- die Daten zu <sql> (nicht protokollieren; z. B. zur
+                  Erkennung doppelter Abfragen)
+    db -- die Datenbankverbindung (z. B. für EXPLAIN; siehe das
+          explain-Modul)
+
+    fingerprint, table und caller werden erst bei Bedarf ermittelt; für
+    caller kann statt des Aufrufers der Frame übergeben werden, von dem aus
+    er zu suchen ist (frame; nur während der Übergabe an die Sinks
+    verfügbar, siehe release):
+
+    >>> event = QueryEvent('SELECT * FROM tan;', 0.1, frame=sys._getframe())
+    >>> event.caller                            # doctest: +ELLIPSIS
+    '...:<module>:1'
+    >>> event.table
+    'tan'
+    """
+    __slots__ = ('sql', '_fingerprint', '_table', 'duration', 'rows',
+                 '_caller', '_frame', 'error', 'query_data', 'db')
+
+    def __init__(self, sql, duration, rows=0, caller=None, error=None,
+                 query_data=None, db=None, frame=None):
+        self.sql = sql
+        self._fingerprint = None
+        self._table = False
+        self.duration = duration
+        self.rows = rows
+        self._caller = caller
+        self._frame = frame
+        self.error = error
+        self.query_data = query_data
+        self.db = db
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = fingerprint(self.sql)
+        return self._fingerprint
+
+    @property
+    def table(self):
+        if self._table is False:
+            self._table = statement_table(self.sql)
+        return self._table
+
+    @property
+    def caller(self):
+        if self._frame is not None:
+            self._caller = frame_caller(self._frame)
+            self._frame = None
+        return self._caller
+
+    def release(self):
+        """
+        Nach der Übergabe an die Sinks: keine Referenz auf den Frame
+        behalten (ein noch nicht ermittelter Aufrufer bleibt None)
+        """
+        self._frame = None
+
+    def __repr__(self):
+        return ('<QueryEvent %r: %.3f s, %d rows>'
+                % (self.fingerprint, self.duration, self.rows))
+
+
+def add_sink(sink):
+    """
+    Registriere eine Funktion, die für jedes Statement ein QueryEvent
+    erhält; gib sie zurück.  Fehler in Sinks werden protokolliert,
+    aber nicht weitergereicht.
+    """
+    if sink not in sinks:
+        sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    """
+    Entferne eine mit add_sink registrierte Funktion
+    """
+    if sink in sinks:
+        sinks.remove(sink)
+
+
+def active_sinks():
+    """
+    Gib die Sinks zurück, die das nächste Statement erhalten sollen:
+    ein Sink mit einer Methode active kann es (billig, vor der Erzeugung
+    des QueryEvents) ablehnen, z. B. in nicht profilierten Requests
+
+    >>> class Sampled(object):
+    ...     def __call__(self, event):
+    ...         pass
+    ...     def active(self):
+    ...         return False
+    >>> sampled = add_sink(Sampled())
+    >>> sampled in active_sinks()
+    False
+    >>> remove_sink(sampled)
+    """
+    return [sink
+            for sink in sinks
+            if getattr(sink, 'active', None) is None or sink.active()
+            ]
+
+
+def timed_query(db, query, maxrows=None, query_data=None, sql=None,
+                sql_data=None):
+    """
+    Führe db.query aus und übergib ein QueryEvent an alle aktiven Sinks
+    (siehe active_sinks); ohne solche wird keines erzeugt
+
+    sql -- das für das QueryEvent zu verwendende Statement, wenn nicht
+           <query> (z. B. statt EXECUTE das vorbereitete Statement, oder
+           das Statement mit %(name)s-Platzhaltern vor der Übersetzung für
+           den Treiber)
+    sql_data -- die Daten zu <sql>, wenn nicht <query_data>
+    """
+    targets = active_sinks()
+    if not targets:
+        return db.query(query, maxrows, query_data)
+    error = None
+    rows = 0
+    start = time()
+    try:
+        res = db.query(query, maxrows, query_data)
+        if res:
+            rows = len(res[1])
+        return res
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        if sql_data is None:
+            sql_data = query_data
+        event = QueryEvent(sql or query, time() - start, rows, None, error,
+                           sql_data, db, sys._getframe(1))
+        dispatch(event, targets)
+        event.release()
+
+
+def dispatch(event, targets=None):
+    """
+    Übergib das QueryEvent an alle Sinks bzw. an die übergebenen
+    (Fehler der Sinks werden nur protokolliert)
+    """
+    if targets is None:
+        targets = list(sinks)
+    for sink in targets:
+        try:
+            sink(event)
+        except Exception as e:
+            logging.getLogger('sqlwrapper').exception(
+                    'SQL instrumentation sink %r failed', sink)
+
+
+class SlowQueryLogger(object):
+    """
+    Sink: Protokolliere Statements, deren Dauer die Schwelle (in Sekunden)
+    erreicht, sowie fehlgeschlagene Statements.
+
+    >>> class Logger(object):
+    ...     def warning(self, msg, *args):
+    ...         print(msg % args)
+    >>> slow = SlowQueryLogger(0.5, Logger())
+    >>> slow(QueryEvent('SELECT 1;', 0.1))
+    >>> slow(QueryEvent('SELECT * FROM tan;', 0.75, 3, 'x:view:12'))
+    slow SQL (0.750 s, 3 rows, tan, x:view:12): SELECT * FROM tan;
+    """
+
+    def __init__(self, threshold=SLOW_QUERY_THRESHOLD, logger=None):
+        self.threshold = threshold
+        if logger is None:
+            logger = logging.getLogger('sqlwrapper.slow')
+        self.logger = logger
+
+    def __call__(self, event):
+        if event.error is not None:
+            self.logger.warning('failed SQL (%.3f s, %s, %s): %s (%r)',
+                                event.duration, event.table, event.caller,
+                                event.fingerprint, event.error)
+        elif event.duration >= self.threshold:
+            self.logger.warning('slow SQL (%.3f s, %d rows, %s, %s): %s',
+                                event.duration, event.rows, event.table,
+                                event.caller, event.fingerprint)
+
+
+class QueryStats(object):
+    """
+    Sink: Aggregate pro Fingerabdruck (Anzahl, Gesamt-, Minimal- und
+    Maximaldauer, Zeilen, Fehler), im Speicher des Prozesses.
+
+    >>> stats = QueryStats()
+    >>> stats(QueryEvent('SELECT * FROM tan WHERE tan = 1;', 0.25, 1))
+    >>> stats(QueryEvent('SELECT * FROM tan WHERE tan = 2;', 0.5, 1))
+    >>> fp, agg = stats.top(1)[0]
+    >>> fp
+    'SELECT * FROM tan WHERE tan = ?;'
+    >>> sorted(agg.items())                    # doctest: +NORMALIZE_WHITESPACE
+    [('count', 2), ('errors', 0), ('max', 0.5), ('min', 0.25),
+     ('rows', 2), ('table', 'tan'), ('total', 0.75)]
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            agg = self._data.get(event.fingerprint)
+            if agg is None:
+                self._data[event.fingerprint] = {
+                        'count': 1,
+                        'total': event.duration,
+                        'min': event.duration,
+                        'max': event.duration,
+                        'rows': event.rows,
+                        'errors': int(event.error is not None),
+                        'table': event.table,
+                        }
+                return
+            agg['count'] += 1
+            agg['total'] += event.duration
+            if event.duration < agg['min']:
+                agg['min'] = event.duration
+            if event.duration > agg['max']:
+                agg['max'] = event.duration
+            agg['rows'] += event.rows
+            if event.error is not None:
+                agg['errors'] += 1
+
+    def snapshot(self):
+        """
+        Gib eine Kopie der Aggregate zurück: {Fingerabdruck: {...}}
+        """
+        with self._lock:
+            return dict([(fp, dict(agg))
+                         for fp, agg in self._data.items()
+                         ])
+
+    def top(self, n=10, key='total'):
+        """
+        Gib die <n> Fingerabdrücke mit den größten Werten für <key>
+        (Vorgabe: die Gesamtdauer) zurück, als Liste von 2-Tupeln
+        """
+        items = list(self.snapshot().items())
+        items.sort(key=lambda item: item[1][key], reverse=True)
+        return items[:n]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _flag(value):
+    """
+    Werte einen Schalter aus der Konfiguration aus:
+
+    >>> _flag('On'), _flag(None), _flag('0')
+    (True, False, False)
+    """
+    return (value or '').lower() in ('on', 'true', 'yes', '1')
+
+
+def configured():
+    """
+    Wurde configure bereits aufgerufen?
+    """
+    return bool(_configured)
+
+
+def configure(environment):
+    """
+    Registriere einmalig die in der Zope-Konfiguration angegebenen Sinks
+    (SQL_SLOW_QUERY_THRESHOLD, in Sekunden; SQL_METRICS=on;
+    SQL_PROFILE_SAMPLE_RATE und SQL_PROFILE_HEADER;
+    SQL_EXPLAIN_THRESHOLD, in Sekunden, und SQL_EXPLAIN_ANALYZE)
+
+    environment -- ein Dictionary, z. B. getConfiguration().environment
+    """
+    if _configured:
+        return
+    _configured.append(True)
+    threshold = environment.get('SQL_SLOW_QUERY_THRESHOLD')
+    if threshold:
+        add_sink(SlowQueryLogger(float(threshold)))
+    if _flag(environment.get('SQL_METRICS')):
+        # Local imports:
+        from .metrics import enable
+        enable()
+    sample_rate = environment.get('SQL_PROFILE_SAMPLE_RATE')
+    if sample_rate and float(sample_rate) > 0:
+        # Local imports:
+        from .profiler import RequestProfiler
+        add_sink(RequestProfiler(float(sample_rate),
+                                 _flag(environment.get('SQL_PROFILE_HEADER'))))
+    threshold = environment.get('SQL_EXPLAIN_THRESHOLD')
+    if threshold:
+        # Local imports:
+        from .explain import PlanCollector
+        from .metrics import enable
+
+        # die Pläne werden bei den Aggregaten gespeichert:
+        enable()
+        add_sink(PlanCollector(float(threshold),
+                               _flag(environment.get('SQL_EXPLAIN_ANALYZE'))))
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod()
+
+# vim: ts=8 sts=4 sw=4 si et
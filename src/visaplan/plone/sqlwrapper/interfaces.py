@@ -25,6 +25,35 @@ class ISQLWrapper(Interface):
         transform -- ignoriert; nicht mehr verwenden
         """
 
+    def insert_many(table, seq_of_dicts,
+                    returning=None, commit=None,
+                    defaults=None, chunksize=None):
+        """
+        Speichere die Werte aus einer Sequenz von Dictionarys in die
+        Tabelle, mit mehrzeiligen INSERT-Anweisungen in Blöcken von bis zu
+        <chunksize> Zeilen.
+
+        table -- Name der Tabelle
+        seq_of_dicts -- iterierbares Objekt von Dictionarys {Feldname: Wert}
+        returning -- z. B. 'id'; PostgreSQL 9.1+
+        commit -- soll dem letzten SQL-Befehl ein COMMIT; angehängt werden?
+        defaults -- Vorgabewerte (und Feldnamen)
+        chunksize -- max. Anzahl der Zeilen pro Anweisung
+        """
+
+    def upsert(table, rows, conflict_cols, update_cols=None,
+               returning=None, commit=None, chunksize=None):
+        """
+        Füge Zeilen ein oder aktualisiere sie im Konfliktfall
+        (INSERT ... ON CONFLICT ... DO UPDATE), in Blöcken
+        zu je bis zu <chunksize> Zeilen.
+
+        conflict_cols -- die Felder eines eindeutigen Index
+        update_cols -- die im Konfliktfall zu aktualisierenden Felder
+                       (Vorgabe: alle anderen)
+        returning -- ggf. wird eine Liste von Dictionarys zurückgegeben
+        """
+
     def update(table, dict_of_values, where=None, query_data={},
                returning=None,
                commit=None):
@@ -33,6 +62,18 @@ class ISQLWrapper(Interface):
             Schmeißt fehler zurück.
         """
 
+    def update_many(table, rows, key_cols,
+                    returning=None, commit=None, chunksize=None):
+        """
+        Aktualisiere viele Zeilen, mit einer Anweisung
+        UPDATE ... FROM (VALUES ...) je Block von bis zu <chunksize> Zeilen.
+
+        rows -- Dictionarys (Schlüssel- und neue Werte) oder 2-Tupel
+                (dict_of_values, query_data) wie für update
+        key_cols -- die Schlüsselfelder
+        returning -- ggf. wird eine Liste von Dictionarys zurückgegeben
+        """
+
     def delete(table, where=None, query_data=None,
                returning=None,
                commit=None):
@@ -41,8 +82,26 @@ class ISQLWrapper(Interface):
             Ohne Id oder WHERE-Clause werden alle Inhalte gelöscht.
         """
 
+    def delete_many(table, keys, key_cols=None,
+                    returning=None, commit=None, chunksize=None):
+        """
+        Lösche die Zeilen mit den angegebenen Schlüsseln (Dictionarys,
+        Tupel oder einfache Werte), in Blöcken von bis zu <chunksize>
+        Schlüsseln; die Schlüsselwerte werden als Arrays übergeben.
+        """
+
+    def select_by_keys(table, key_cols, keys, fields=None,
+                       compact=False, chunksize=None):
+        """
+        Hole die Zeilen mit den angegebenen Schlüsseln, in der Reihenfolge
+        der Schlüssel (in Blöcken von bis zu <chunksize> Schlüsseln).
+        """
+
     def select(table, fields=None, where=None,
-               query_data=None, maxrows=None):
+               query_data=None, maxrows=None,
+               compact=False,
+               order_by=None, limit=None, offset=None,
+               cache=False):
         """
         Hole Werte aus einer einzelnen Tabelle oder Sicht der SQL-Datenbank.
 
@@ -53,4 +112,35 @@ class ISQLWrapper(Interface):
                  ggf. aus <query_data> generiert
         query_data -- ein Dictionary mit den Abfragedaten
         maxrows - weitergereicht an self.db.query
+        compact -- wenn True, werden kompakte Row-Objekte zurückgegeben
+        order_by -- Sortierung (ORDER BY; Feldnamen ggf. mit ASC/DESC)
+        limit, offset -- für LIMIT und OFFSET
+        cache -- True oder eine Verfallszeit in Sekunden: Ergebnis-Cache
+                 verwenden (Invalidierung durch Schreibzugriffe über den
+                 Adapter)
+        """
+
+    def iterselect(table, fields=None, where=None,
+                   query_data=None, chunk_size=None,
+                   compact=False):
+        """
+        Wie select, aber als Generator; die Zeilen werden blockweise
+        (je <chunk_size> Zeilen) über einen serverseitigen Cursor geholt.
+        """
+
+    def gather(calls):
+        """
+        Führe unabhängige Lesezugriffe (Tupel (Methode, args[, kwargs]))
+        gleichzeitig aus; gib die Ergebnisse in derselben Reihenfolge zurück
+        """
+
+    def getFields(table):
+        """
+        Gib die Spaltennamen der Tabelle zurück (aus dem Spaltenkatalog)
+        """
+
+    def getColumns(table):
+        """
+        Gib die Spalten der Tabelle mit Beschreibung zurück
+        (Dictionarys; aus dem Spaltenkatalog)
         """
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+metrics-Modul des Adapters sqlwrapper: Aggregate pro Statement-Fingerabdruck
+
+QueryMetrics ist ein Sink für das instrument-Modul; es sammelt pro
+Fingerabdruck Anzahl, Gesamt-, Minimal- und Maximaldauer, Zeilen und Fehler
+sowie ein Histogramm fester Größe, aus dem die Perzentile (p50, p95, p99)
+geschätzt werden.  Die Daten können im Textformat von Prometheus oder als
+JSON ausgegeben werden (to_prometheus, to_json; siehe auch die View
+@@sqlwrapper-metrics).
+
+Mit SQL_METRICS=on in der Zope-Konfiguration (<environment> in zope.conf)
+wird query_metrics beim ersten Zugriff als Sink registriert; ansonsten:
+
+  from visaplan.plone.sqlwrapper.metrics import enable
+  enable()
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+__all__ = [# Funktionen:
+           'enable',
+           'disable',
+           'to_prometheus',
+           'to_json',
+           # Klassen:
+           'Histogram',
+           'QueryMetrics',
+           # Daten:
+           'query_metrics',
+           ]
+
+# Standard library:
+import json
+import os
+import socket
+from bisect import bisect_left
+from threading import Lock
+
+# Local imports:
+from . import instrument
+
+# die Obergrenzen der Histogramm-Klassen (Sekunden): 0.1 ms bis ca. 60 s,
+# jeweils um 25 % wachsend (Fehler der Perzentile also höchstens 25 %):
+BUCKET_BOUNDS = tuple([0.0001 * 1.25 ** i for i in range(61)])
+PERCENTILES = (0.5, 0.95, 0.99)
+# Begrenzung des Speicherbedarfs; weitere Fingerabdrücke werden
+# unter OTHER zusammengefaßt:
+MAX_FINGERPRINTS = 500
+OTHER = '(other)'
+
+
+class Histogram(object):
+    """
+    Histogramm mit festen, logarithmisch verteilten Klassen
+    (fester Speicherbedarf, unabhängig von der Anzahl der Werte)
+
+    >>> hist = Histogram()
+    >>> for i in range(1, 101):
+    ...     hist.add(i / 1000.0)
+    >>> p50, p99 = hist.percentile(0.5), hist.percentile(0.99)
+    >>> 0.04 < p50 <= 0.0625, 0.08 < p99 <= 0.1
+    (True, True)
+    >>> Histogram().percentile(0.5)
+    """
+    __slots__ = ('counts', 'count', 'min', 'max')
+
+    def __init__(self):
+        # eine Klasse mehr für die Werte oberhalb der letzten Grenze:
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect_left(BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """
+        Schätze das Perzentil (0 < q <= 1): die Obergrenze der Klasse, in
+        welche es fällt, begrenzt durch den kleinsten und größten Wert
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                break
+        if i < len(BUCKET_BOUNDS):
+            value = BUCKET_BOUNDS[i]
+        else:
+            value = self.max
+        return max(self.min, min(value, self.max))
+
+
+class QueryMetrics(object):
+    """
+    Sink: Aggregate pro Fingerabdruck, mit Perzentilen
+
+    >>> metrics = QueryMetrics()
+    >>> for i in range(1, 11):
+    ...     metrics(instrument.QueryEvent('SELECT * FROM tan WHERE id = %d;'
+    ...                                   % i, i / 100.0, 1))
+    >>> list(metrics.snapshot().keys())
+    ['SELECT * FROM tan WHERE id = ?;']
+    >>> agg = metrics.snapshot()['SELECT * FROM tan WHERE id = ?;']
+    >>> agg['count'], agg['rows']
+    (10, 10)
+    >>> [(key, round(agg[key], 3))             # doctest: +NORMALIZE_WHITESPACE
+    ...  for key in ('total', 'min', 'max', 'p50', 'p95', 'p99')]
+    [('total', 0.55), ('min', 0.01), ('max', 0.1),
+     ('p50', 0.052), ('p95', 0.1), ('p99', 0.1)]
+    """
+
+    def __init__(self, max_fingerprints=MAX_FINGERPRINTS):
+        self.max_fingerprints = max_fingerprints
+        self._data = {}
+        # Fingerabdruck -> Plan (siehe das explain-Modul):
+        self._plans = {}
+        self._lock = Lock()
+
+    def __call__(self, event):
+        key = event.fingerprint
+        with self._lock:
+            agg = self._data.get(key)
+            if agg is None:
+                if len(self._data) >= self.max_fingerprints:
+                    key = OTHER
+                    agg = self._data.get(key)
+                if agg is None:
+                    agg = self._data[key] = {
+                            'hist': Histogram(),
+                            'total': 0.0,
+                            'rows': 0,
+                            'errors': 0,
+                            'table': key != OTHER and event.table or None,
+                            }
+            agg['hist'].add(event.duration)
+            agg['total'] += event.duration
+            agg['rows'] += event.rows
+            if event.error is not None:
+                agg['errors'] += 1
+
+    def snapshot(self):
+        """
+        Gib die Aggregate zurück: {Fingerabdruck: {'count': ...,
+        'total': ..., 'min': ..., 'max': ..., 'p50': ..., 'p95': ...,
+        'p99': ..., 'rows': ..., 'errors': ..., 'table': ...}};
+        ggf. zusätzlich 'plan' (siehe set_plan)
+        """
+        res = {}
+        with self._lock:
+            for key, agg in self._data.items():
+                hist = agg['hist']
+                dic = {'count': hist.count,
+                       'total': agg['total'],
+                       'min': hist.min,
+                       'max': hist.max,
+                       'rows': agg['rows'],
+                       'errors': agg['errors'],
+                       'table': agg['table'],
+                       }
+                for q in PERCENTILES:
+                    dic['p%d' % (q * 100)] = hist.percentile(q)
+                plan = self._plans.get(key)
+                if plan is not None:
+                    dic['plan'] = plan
+                res[key] = dic
+        return res
+
+    def set_plan(self, fingerprint, info):
+        """
+        Speichere den Ausführungsplan zum Fingerabdruck
+        (ein Dictionary; siehe explain.explain_statement)
+        """
+        with self._lock:
+            if (fingerprint in self._plans
+                or len(self._plans) < self.max_fingerprints
+                ):
+                self._plans[fingerprint] = info
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._plans.clear()
+
+
+# die Aggregate dieses Prozesses:
+query_metrics = QueryMetrics()
+
+
+def enable(metrics=None):
+    """
+    Registriere die Aggregate (Vorgabe: query_metrics) als Sink
+    """
+    if metrics is None:
+        metrics = query_metrics
+    return instrument.add_sink(metrics)
+
+
+def disable(metrics=None):
+    if metrics is None:
+        metrics = query_metrics
+    instrument.remove_sink(metrics)
+
+
+def instance_name():
+    """
+    Der Name dieses Prozesses (für den Vergleich mehrerer ZEO-Clients)
+    """
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def _label(value):
+    r"""
+    Formatiere einen Label-Wert für Prometheus:
+
+    >>> _label('a "b"\\c\nd')
+    '"a \\"b\\"\\\\c\\nd"'
+    """
+    if value is None:
+        value = ''
+    return '"%s"' % (value.replace('\\', '\\\\')
+                          .replace('"', '\\"')
+                          .replace('\n', '\\n'))
+
+
+def to_prometheus(metrics=None, instance=None):
+    """
+    Gib die Aggregate im Textformat von Prometheus zurück
+    (Perzentile als "summary").  Der Prozeß wird mit dem Label
+    sqlwrapper_instance angegeben; das Label instance setzt Prometheus
+    selbst (für das Ziel des Abrufs):
+
+    >>> metrics = QueryMetrics()
+    >>> metrics(instrument.QueryEvent('SELECT 1 FROM tan;', 0.5, 1))
+    >>> print(to_prometheus(metrics, 'zeo1'))  # doctest: +ELLIPSIS
+    # HELP sqlwrapper_query_duration_seconds ...
+    # TYPE sqlwrapper_query_duration_seconds summary
+    sqlwrapper_query_duration_seconds{sqlwrapper_instance="zeo1",fingerprint="SELECT ? FROM tan;",table="tan",quantile="0.5"} 0.5
+    ...
+    sqlwrapper_query_duration_seconds_count{sqlwrapper_instance="zeo1",fingerprint="SELECT ? FROM tan;",table="tan"} 1
+    ...
+    sqlwrapper_query_rows_total{sqlwrapper_instance="zeo1",fingerprint="SELECT ? FROM tan;",table="tan"} 1
+    ...
+    """
+    if metrics is None:
+        metrics = query_metrics
+    if instance is None:
+        instance = instance_name()
+    snapshot = sorted(metrics.snapshot().items())
+    lines = ['# HELP sqlwrapper_query_duration_seconds'
+             ' SQL statement duration per fingerprint',
+             '# TYPE sqlwrapper_query_duration_seconds summary',
+             ]
+    labels = []
+    for key, dic in snapshot:
+        labels.append('sqlwrapper_instance=%s,fingerprint=%s,table=%s'
+                      % (_label(instance), _label(key), _label(dic['table'])))
+    for (key, dic), lab in zip(snapshot, labels):
+        for q in PERCENTILES:
+            lines.append('sqlwrapper_query_duration_seconds{%s,quantile="%s"}'
+                         ' %r' % (lab, q, dic['p%d' % (q * 100)]))
+        lines.append('sqlwrapper_query_duration_seconds_sum{%s} %r'
+                     % (lab, dic['total']))
+        lines.append('sqlwrapper_query_duration_seconds_count{%s} %d'
+                     % (lab, dic['count']))
+    for name, key, help in [
+            ('sqlwrapper_query_duration_max_seconds', 'max',
+             'Maximum SQL statement duration per fingerprint'),
+            ]:
+        lines.extend(('# HELP %s %s' % (name, help),
+                      '# TYPE %s gauge' % name,
+                      ))
+        for (fp, dic), lab in zip(snapshot, labels):
+            lines.append('%s{%s} %r' % (name, lab, dic[key]))
+    lines.extend(('# HELP sqlwrapper_query_seq_scans'
+                  ' Sequential scans in the captured plan per fingerprint',
+                  '# TYPE sqlwrapper_query_seq_scans gauge',
+                  ))
+    for (fp, dic), lab in zip(snapshot, labels):
+        if 'plan' in dic:
+            lines.append('sqlwrapper_query_seq_scans{%s} %d'
+                         % (lab, len(dic['plan']['seq_scans'])))
+    for name, key, help in [
+            ('sqlwrapper_query_rows_total', 'rows',
+             'Rows returned per fingerprint'),
+            ('sqlwrapper_query_errors_total', 'errors',
+             'Failed statements per fingerprint'),
+            ]:
+        lines.extend(('# HELP %s %s' % (name, help),
+                      '# TYPE %s counter' % name,
+                      ))
+        for (fp, dic), lab in zip(snapshot, labels):
+            lines.append('%s{%s} %d' % (name, lab, dic[key]))
+    return '\n'.join(lines) + '\n'
+
+
+def to_json(metrics=None, instance=None):
+    """
+    Gib die Aggregate als JSON-Text zurück:
+
+    >>> metrics = QueryMetrics()
+    >>> metrics(instrument.QueryEvent('SELECT 1 FROM tan;', 0.5, 1))
+    >>> data = json.loads(to_json(metrics, 'zeo1'))
+    >>> print(data['instance'])
+    zeo1
+    >>> print(data['statements'][0]['fingerprint'])
+    SELECT ? FROM tan;
+    """
+    if metrics is None:
+        metrics = query_metrics
+    if instance is None:
+        instance = instance_name()
+    statements = []
+    for key, dic in sorted(metrics.snapshot().items()):
+        dic['fingerprint'] = key
+        statements.append(dic)
+    return json.dumps({'instance': instance,
+                       'statements': statements,
+                       }, sort_keys=True)
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS)
+
+# vim: ts=8 sts=4 sw=4 si et
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+placeholders-Modul des Adapters sqlwrapper: Platzhalter-Stile der Treiber
+
+Die Statements werden (von make_where_mask, qfactory usw.) mit
+%(name)s-Platzhaltern erzeugt ("pyformat", wie von den Zope-
+Datenbankadaptern erwartet); dieser Text ist die Zwischenform.  Für Treiber
+mit einem anderen Platzhalter-Stil wird er einmal zerlegt (Template) und
+in den gewünschten Stil übersetzt; das Ergebnis (CompiledStatement) enthält
+das Statement und die Reihenfolge der Parameter und wird im
+placeholder_cache gespeichert.  Pro Aufruf bleibt also nur, die Werte in
+dieser Reihenfolge aus den query_data zu holen:
+
+  pyformat  %(name)s  die query_data werden unverändert übergeben
+  named     :name     dito (z. B. SQLAlchemy, oracledb, sqlite3)
+  numeric   $1, $2    Liste der Werte; mehrfach verwendete Namen erhalten
+                      dieselbe Nummer (PostgreSQL-Server, z. B. asyncpg)
+  qmark     ?         Liste der Werte, pro Vorkommen (z. B. sqlite3)
+
+Eine Verbindung (bzw. ein asyncsql-Treiber) mit einem Attribut paramstyle
+erhält die Statements in diesem Stil, und zwar einzeln (wie DB-API-Treiber
+es verlangen: kein angehängtes COMMIT, BEGIN und COMMIT als eigene
+Aufrufe); ohne ein solches Attribut bleibt es bei pyformat.
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+__all__ = [# Funktionen:
+           'compile_placeholders',
+           'render',
+           # Klassen:
+           'CompiledStatement',
+           'Template',
+           # Daten:
+           'STYLES',
+           'placeholder_cache',
+           ]
+
+# Local imports:
+from .caching import LRUCache
+from .utils import PLACEHOLDER_RE
+
+STYLES = ('pyformat', 'named', 'numeric', 'qmark')
+
+placeholder_cache = LRUCache()
+
+
+class Template(object):
+    """
+    Die Zwischenform eines Statements: abwechselnd Text und Namen
+    (parts[0], parts[2] ... sind Text, parts[1], parts[3] ... Namen);
+    maskierte Prozentzeichen (%%) sind im Text bereits aufgelöst.
+
+    >>> tpl = Template("SELECT * FROM t WHERE a = %(a)s AND b LIKE '1%%'"
+    ...                " AND c = %(a)s;")
+    >>> tpl.parts
+    ('SELECT * FROM t WHERE a = ', 'a', " AND b LIKE '1%' AND c = ", 'a', ';')
+    >>> tpl.names
+    ['a']
+    >>> tpl.render('pyformat').sql == tpl.sql
+    True
+    """
+
+    __slots__ = ('sql', 'parts')
+
+    def __init__(self, sql):
+        self.sql = sql
+        parts = []
+        text = []
+        pos = 0
+        for mo in PLACEHOLDER_RE.finditer(sql):
+            text.append(sql[pos:mo.start()])
+            pos = mo.end()
+            name = mo.group(1)
+            if name is None:
+                text.append('%')
+            else:
+                parts.extend((''.join(text), name))
+                text = []
+        text.append(sql[pos:])
+        parts.append(''.join(text))
+        self.parts = tuple(parts)
+
+    @property
+    def names(self):
+        """
+        Die Namen der Platzhalter, ohne Wiederholungen
+        """
+        res = []
+        for name in self.parts[1::2]:
+            if name not in res:
+                res.append(name)
+        return res
+
+    def render(self, style, escape_percent=None):
+        """
+        Übersetze in den angegebenen Stil; gib ein CompiledStatement zurück.
+
+        escape_percent -- Prozentzeichen im Text verdoppeln; Vorgabe: nur
+                          für pyformat (für Statements, die weiterhin mit
+                          Daten über einen pyformat-Treiber gehen, z. B.
+                          PREPARE ... AS ..., auch für andere Stile)
+
+        >>> tpl = Template('UPDATE t SET a = %(a)s WHERE b = %(b)s'
+        ...                ' OR c = %(b)s;')
+        >>> tpl.render('named').sql
+        'UPDATE t SET a = :a WHERE b = :b OR c = :b;'
+        >>> compiled = tpl.render('numeric')
+        >>> compiled.sql, compiled.names
+        ('UPDATE t SET a = $1 WHERE b = $2 OR c = $2;', ('a', 'b'))
+        >>> compiled = tpl.render('qmark')
+        >>> compiled.sql, compiled.names
+        ('UPDATE t SET a = ? WHERE b = ? OR c = ?;', ('a', 'b', 'b'))
+        >>> tpl.render('format')
+        Traceback (most recent call last):
+          ...
+        ValueError: Unsupported placeholder style 'format'
+        """
+        if style not in STYLES:
+            raise ValueError('Unsupported placeholder style %(style)r'
+                             % locals())
+        if escape_percent is None:
+            escape_percent = style == 'pyformat'
+        parts = self.parts
+        res = []
+        names = []
+        numbers = {}
+        for i, part in enumerate(parts):
+            if not i % 2:
+                if escape_percent:
+                    part = part.replace('%', '%%')
+                res.append(part)
+            elif style == 'pyformat':
+                res.append(part.join(('%(', ')s')))
+            elif style == 'named':
+                res.append(':' + part)
+            elif style == 'qmark':
+                res.append('?')
+                names.append(part)
+            else:
+                if part not in numbers:
+                    names.append(part)
+                    numbers[part] = len(names)
+                res.append('$%d' % numbers[part])
+        if style in ('pyformat', 'named'):
+            names = None
+        else:
+            names = tuple(names)
+        return CompiledStatement(''.join(res), style, names)
+
+
+class CompiledStatement(object):
+    """
+    Ein Statement in einem bestimmten Platzhalter-Stil, mit der Reihenfolge
+    der Parameter (names; None für die Stile mit Dictionarys)
+
+    >>> compiled = compile_placeholders('SELECT * FROM t WHERE a = %(a)s'
+    ...                                 ' AND b = %(b)s;', 'numeric')
+    >>> compiled.params({'b': 2, 'a': 1, 'c': 3})
+    [1, 2]
+    """
+
+    __slots__ = ('sql', 'style', 'names')
+
+    def __init__(self, sql, style, names):
+        self.sql = sql
+        self.style = style
+        self.names = names
+
+    def params(self, query_data):
+        """
+        Gib die Parameter für den Treiber zurück
+        """
+        names = self.names
+        if names is None:
+            return query_data
+        return [query_data[name] for name in names]
+
+    def __repr__(self):
+        return '<%s %s %r>' % (self.__class__.__name__, self.style, self.sql)
+
+
+def _compile(sql, style, escape_percent):
+    return Template(sql).render(style, escape_percent)
+
+
+def compile_placeholders(sql, style, escape_percent=None):
+    """
+    Gib das (ggf. gecachte) CompiledStatement für ein Statement mit
+    %(name)s-Platzhaltern zurück (siehe Template.render)
+    """
+    return placeholder_cache.get((sql, style, escape_percent),
+                                 _compile, sql, style, escape_percent)
+
+
+def render(sql, query_data, style):
+    """
+    Gib ein 2-Tupel (sql, params) für einen Treiber mit dem angegebenen
+    Platzhalter-Stil zurück.  Ohne Daten (oder mit positionalen Daten für
+    %s-Platzhalter) bleibt das Statement unverändert, ebenso für pyformat:
+
+    >>> render('SELECT * FROM t WHERE a = %(a)s;', {'a': 1}, 'qmark')
+    ('SELECT * FROM t WHERE a = ?;', [1])
+    >>> render('SELECT * FROM t WHERE a = %(a)s;', {'a': 1}, 'named')
+    ('SELECT * FROM t WHERE a = :a;', {'a': 1})
+    >>> render("SELECT '100%%';", None, 'qmark')
+    ("SELECT '100%%';", None)
+    """
+    if style == 'pyformat' or not isinstance(query_data, dict):
+        return sql, query_data
+    compiled = compile_placeholders(sql, style)
+    return compiled.sql, compiled.params(query_data)
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod()
+
+# vim: ts=8 sts=4 sw=4 si et
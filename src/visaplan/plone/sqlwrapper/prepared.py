@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+prepared-Modul des Adapters sqlwrapper: serverseitige Prepared Statements
+
+Häufig wiederholte SELECT-Statements (gleiche Tabelle, gleiche Schlüssel der
+query_data, also derselbe Text aus dem statement_cache) werden ab einer
+Schwelle als Prepared Statement angelegt und danach mit EXECUTE ausgeführt;
+so spart die Datenbank das Parsen und Planen:
+
+  PREPARE sqlwrapper_p1 AS SELECT * FROM tan WHERE status = $1;
+  EXECUTE sqlwrapper_p1(%(status)s);
+
+Prepared Statements gehören zur Datenbanksitzung; die Namen werden daher
+pro physischer Verbindung verwaltet (siehe session), in einem begrenzten
+Cache (die ältesten werden mit DEALLOCATE freigegeben).  ZPsycopgDA hält pro
+Thread eine eigene psycopg2-Verbindung und ersetzt sie beim Neuverbinden
+durch eine neue; für diese wird dann neu vorbereitet.  Meldet die Datenbank
+dennoch ein fehlendes Prepared Statement (Sitzung ohne Wissen des Adapters
+erneuert, z. B. mit DISCARD ALL), wird der Cache der Verbindung geleert und
+der Fehler weitergegeben: die Transaktion ist in PostgreSQL ohnehin
+abgebrochen, und ein Savepoint um jedes EXECUTE kostete mehr, als das
+Prepared Statement spart.
+
+Konfiguration in zope.conf (<environment>):
+
+  SQL_PREPARE_THRESHOLD   ab so vielen Ausführungen (pro Verbindung);
+                          Vorgabe 0: keine Prepared Statements (z. B. bei
+                          pgbouncer im Transaktionsmodus nötig)
+  SQL_PREPARE_CACHE_SIZE  höchstens so viele pro Verbindung (Vorgabe: 100)
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+__all__ = [# Funktionen:
+           'configured_threshold',
+           'registry',
+           'session',
+           'to_positional',
+           # Klassen:
+           'StatementRegistry',
+           ]
+
+# Standard library:
+from collections import OrderedDict
+from itertools import count
+from threading import Lock, local
+from weakref import WeakKeyDictionary
+
+# Local imports:
+from .connection import zope_environment
+from .placeholders import compile_placeholders
+
+PREFIX = 'sqlwrapper_p'
+DEFAULT_THRESHOLD = 0
+DEFAULT_CACHE_SIZE = 100
+PREPARABLE = ('SELECT', 'WITH', 'VALUES')
+
+_numbers = count(1)
+_numbers_lock = Lock()
+_local = local()
+_config = {}
+
+
+def to_positional(sql):
+    """
+    Ersetze die %(name)s-Platzhalter durch $1, $2 ...; gib das Statement
+    und die Namen in der Reihenfolge der Nummern zurück.  Mehrfach
+    verwendete Namen erhalten dieselbe Nummer (siehe das
+    placeholders-Modul); %% bleibt unverändert (der Datenbankadapter
+    ersetzt es, da Daten übergeben werden):
+
+    >>> to_positional('SELECT * FROM tan WHERE a = %(a)s'
+    ...               ' AND (b = %(b)s OR c = %(a)s);')
+    ('SELECT * FROM tan WHERE a = $1 AND (b = $2 OR c = $1);', ['a', 'b'])
+    """
+    compiled = compile_placeholders(sql, 'numeric', escape_percent=True)
+    return compiled.sql, list(compiled.names)
+
+
+def _preparable(query):
+    """
+    Gib das Statement ohne abschließendes Semikolon zurück, wenn es als
+    Prepared Statement angelegt werden kann, ansonsten None
+    """
+    query = query.strip()
+    if query.endswith(';'):
+        query = query[:-1].rstrip()
+    if not query or ';' in query:
+        return None
+    if query.split(None, 1)[0].upper() not in PREPARABLE:
+        return None
+    if '%%' in query and not to_positional(query)[1]:
+        # ohne Daten würde %% nicht ersetzt
+        return None
+    return query
+
+
+def _next_name():
+    with _numbers_lock:
+        return '%s%d' % (PREFIX, next(_numbers))
+
+
+class StatementRegistry(object):
+    """
+    Die Prepared Statements einer Verbindung (einer Datenbanksitzung).
+
+    >>> reg = StatementRegistry(threshold=2, maxsize=1)
+    >>> query = 'SELECT * FROM tan WHERE status = %(status)s;'
+    >>> reg.statement(query)
+    >>> reg.statement(query)                    # doctest: +ELLIPSIS
+    'PREPARE sqlwrapper_p... AS SELECT * FROM tan WHERE status = $1; EXECUTE sqlwrapper_p...(%(status)s);'
+    >>> reg.statement(query)                    # doctest: +ELLIPSIS
+    'EXECUTE sqlwrapper_p...(%(status)s);'
+
+    Ist der Cache voll, wird das älteste freigegeben:
+
+    >>> reg.statement('SELECT 1;')
+    >>> reg.statement('SELECT 1;')              # doctest: +ELLIPSIS
+    'DEALLOCATE sqlwrapper_p...; PREPARE sqlwrapper_p... AS SELECT 1; EXECUTE sqlwrapper_p...;'
+    >>> reg.statement(query)
+    >>> sorted(reg.stats().items())
+    [('executed', 1), ('prepared', 2), ('size', 1)]
+    """
+
+    def __init__(self, threshold, maxsize=DEFAULT_CACHE_SIZE):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        # Statement -> Anzahl der Ausführungen (vor dem PREPARE):
+        self._counts = {}
+        # Statement -> EXECUTE-Statement (älteste zuerst):
+        self._executes = OrderedDict()
+        # Statement -> Name:
+        self._names = {}
+        self.prepared = 0
+        self.executed = 0
+
+    def statement(self, query):
+        """
+        Gib das an Stelle von <query> zu sendende Statement zurück
+        (EXECUTE, ggf. mit PREPARE und DEALLOCATE), oder None
+        """
+        execute = self._executes.get(query)
+        if execute is not None:
+            # als zuletzt verwendet markieren:
+            del self._executes[query]
+            self._executes[query] = execute
+            self.executed += 1
+            return execute
+        n = self._counts.get(query, 0) + 1
+        if n < self.threshold:
+            if len(self._counts) >= self.maxsize * 10:
+                self._counts.clear()
+            self._counts[query] = n
+            return None
+        self._counts.pop(query, None)
+        body = _preparable(query)
+        if body is None:
+            return None
+        body, names = to_positional(body)
+        name = _next_name()
+        if names:
+            execute = 'EXECUTE %s(%s);' % (name, ', '.join(['%%(%s)s' % key
+                                                            for key in names]))
+        else:
+            execute = 'EXECUTE %s;' % name
+        res = []
+        while len(self._executes) >= self.maxsize:
+            old, _ = self._executes.popitem(last=False)
+            res.append('DEALLOCATE %s;' % self._names.pop(old))
+        res.extend(('PREPARE %s AS %s;' % (name, body),
+                    execute))
+        self._executes[query] = execute
+        self._names[query] = name
+        self.prepared += 1
+        return ' '.join(res)
+
+    def forget(self, query):
+        """
+        Nach einem Fehler: das Statement gilt als nicht vorbereitet
+        """
+        self._executes.pop(query, None)
+        self._names.pop(query, None)
+
+    def clear(self):
+        """
+        Die Datenbanksitzung hat keine (bekannten) Prepared Statements mehr
+        """
+        self._counts.clear()
+        self._executes.clear()
+        self._names.clear()
+
+    def failed(self, query, error):
+        """
+        Nach einem Fehler beim Senden des Statements: meldet die Datenbank
+        ein fehlendes Prepared Statement, ist die Sitzung wohl neu; dann
+        wird der Cache geleert und True zurückgegeben.
+
+        >>> reg = StatementRegistry(threshold=1)
+        >>> reg.statement('SELECT 1;')              # doctest: +ELLIPSIS
+        'PREPARE sqlwrapper_p... AS SELECT 1; EXECUTE sqlwrapper_p...;'
+        >>> reg.failed('SELECT 1;',
+        ...            Exception('prepared statement "sqlwrapper_p1"'
+        ...                      ' does not exist'))
+        True
+        >>> reg.stats()['size']
+        0
+        >>> reg.failed('SELECT 1;', Exception('syntax error'))
+        False
+        """
+        if PREFIX in str(error) and 'does not exist' in str(error):
+            self.clear()
+            return True
+        self.forget(query)
+        return False
+
+    def stats(self):
+        return {'size': len(self._executes),
+                'prepared': self.prepared,
+                'executed': self.executed,
+                }
+
+
+def configured_threshold():
+    """
+    Gib die Schwelle aus der Zope-Konfiguration zurück (nur einmal gelesen);
+    0 bedeutet: keine Prepared Statements
+    """
+    if 'threshold' not in _config:
+        environment = zope_environment()
+        _config['threshold'] = int(environment.get('SQL_PREPARE_THRESHOLD')
+                                   or DEFAULT_THRESHOLD)
+        _config['maxsize'] = int(environment.get('SQL_PREPARE_CACHE_SIZE')
+                                 or DEFAULT_CACHE_SIZE)
+    return _config['threshold']
+
+
+def session(db):
+    """
+    Gib die physische Verbindung zurück, über die <db> (die Verbindung des
+    Zope-Datenbankadapters) im aktuellen Thread die Statements sendet.
+
+    ZPsycopgDA verbindet sich innerhalb desselben DB-Objekts neu; die
+    psycopg2-Verbindung (aus dem Pool, pro Thread) ist dann eine andere.
+    Wir ermitteln sie über db.getcursor(); Verbindungen ohne diese Methode
+    (z. B. die des standin-Moduls) stehen selbst für ihre Sitzung:
+
+    >>> class Cursor(object):
+    ...     def __init__(self, connection):
+    ...         self.connection = connection
+    ...     def close(self):
+    ...         pass
+    >>> class DB(object):
+    ...     connection = 'pg-1'
+    ...     def getcursor(self):
+    ...         return Cursor(self.connection)
+    >>> db = DB()
+    >>> session(db)
+    'pg-1'
+    >>> db.connection = 'pg-2'     # neu verbunden
+    >>> session(db)
+    'pg-2'
+    >>> plain = object()
+    >>> session(plain) is plain
+    True
+
+    Scheitert getcursor, wird None zurückgegeben (dann ohne Prepared
+    Statement; der Fehler zeigt sich beim Senden des Statements).
+    """
+    getcursor = getattr(db, 'getcursor', None)
+    if getcursor is None:
+        return db
+    try:
+        cursor = getcursor()
+    except Exception:
+        return None
+    try:
+        return cursor.connection
+    finally:
+        cursor.close()
+
+
+def registry(db, threshold):
+    """
+    Gib die StatementRegistry der aktuellen Sitzung der Verbindung <db>
+    zurück (siehe session); eine neue physische Verbindung (nach einem
+    Neuverbinden) erhält eine neue Registry.  Die Registries werden pro
+    Thread verwaltet, wie die Verbindungen des ZPsycopgDA-Pools.
+    """
+    key = session(db)
+    if key is None:
+        return None
+    try:
+        registries = _local.registries
+    except AttributeError:
+        registries = _local.registries = WeakKeyDictionary()
+    try:
+        reg = registries.get(key)
+    except TypeError:
+        # keine schwachen Referenzen möglich; dann ohne Prepared Statements
+        return None
+    if reg is None:
+        reg = registries[key] = StatementRegistry(
+                threshold, _config.get('maxsize', DEFAULT_CACHE_SIZE))
+    else:
+        reg.threshold = threshold
+    return reg
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS)
+
+# vim: ts=8 sts=4 sw=4 si et
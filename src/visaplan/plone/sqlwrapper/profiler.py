@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+profiler-Modul des Adapters sqlwrapper: SQL-Profil pro Zope-Request
+
+RequestProfiler ist ein Sink für das instrument-Modul; er sammelt die
+Statements eines Requests (bei einem Anteil <sample_rate> der Requests) und
+erkennt dabei doppelte Abfragen (gleiches Statement mit gleichen Daten) und
+"N+1"-Muster (derselbe Fingerabdruck viele Male).  Am Ende des Requests
+(Subscriber report, siehe configure.zcml) wird das Profil protokolliert und
+ggf. als Response-Header X-SQL-Profile ausgegeben.
+
+Konfiguration in zope.conf (<environment>):
+
+  SQL_PROFILE_SAMPLE_RATE  Anteil der profilierten Requests (0 bis 1)
+  SQL_PROFILE_HEADER       on: Header X-SQL-Profile setzen
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+__all__ = [# Funktionen:
+           'report',
+           # Klassen:
+           'RequestProfile',
+           'RequestProfiler',
+           ]
+
+# Standard library:
+import logging
+from random import random
+
+# Zope:
+from zope.annotation.interfaces import IAnnotations
+from zope.globalrequest import getRequest
+
+# Local imports:
+from .caching import freeze_data
+
+ANNOTATION_KEY = 'visaplan.plone.sqlwrapper.profiler'
+HEADER_NAME = 'X-SQL-Profile'
+# ab so vielen Ausführungen desselben Fingerabdrucks: N+1-Verdacht
+N_PLUS_ONE_THRESHOLD = 10
+# Begrenzung des Speicherbedarfs pro Request:
+MAX_KEYS = 1000
+
+
+def _data_key(query_data):
+    try:
+        return freeze_data(query_data)
+    except TypeError:
+        return repr(query_data)
+
+
+class RequestProfile(object):
+    """
+    Die Statements eines Requests, zusammengefaßt pro Fingerabdruck
+
+    >>> from .instrument import QueryEvent
+    >>> profile = RequestProfile(n_plus_one=3)
+    >>> for i in (1, 2, 3, 3):
+    ...     profile.add(QueryEvent('SELECT * FROM tan WHERE id = %(id)s;',
+    ...                            0.01, 1, query_data={'id': i}))
+    >>> profile.add(QueryEvent('SELECT * FROM users;', 0.1, 20))
+    >>> summary = profile.summary()
+    >>> summary['count'], summary['rows'], summary['duplicates']
+    (5, 24, 1)
+    >>> summary['n_plus_one']
+    [('SELECT * FROM tan WHERE id = %(id)s;', 4)]
+    >>> profile.header_value()
+    'statements=5; time=0.140; duplicates=1; n+1=1'
+    """
+
+    def __init__(self, n_plus_one=N_PLUS_ONE_THRESHOLD, profiler=None):
+        self.n_plus_one = n_plus_one
+        self.profiler = profiler
+        self.count = 0
+        self.time = 0.0
+        self.rows = 0
+        self.errors = 0
+        # Fingerabdruck -> [Anzahl, Dauer, Aufrufer]:
+        self.fingerprints = {}
+        # (Statement, Daten) -> Anzahl:
+        self.keys = {}
+
+    def add(self, event):
+        self.count += 1
+        self.time += event.duration
+        self.rows += event.rows
+        if event.error is not None:
+            self.errors += 1
+        agg = self.fingerprints.get(event.fingerprint)
+        if agg is None:
+            if len(self.fingerprints) < MAX_KEYS:
+                self.fingerprints[event.fingerprint] = [1, event.duration,
+                                                        event.caller]
+        else:
+            agg[0] += 1
+            agg[1] += event.duration
+        key = (event.sql, _data_key(event.query_data))
+        if key in self.keys:
+            self.keys[key] += 1
+        elif len(self.keys) < MAX_KEYS:
+            self.keys[key] = 1
+
+    def summary(self):
+        """
+        Gib ein Dictionary zurück:
+        count, time, rows, errors -- Summen
+        duplicates -- Anzahl der überflüssigen Wiederholungen
+        n_plus_one -- Liste von (Fingerabdruck, Anzahl), häufigste zuerst
+        """
+        n_plus_one = [(fp, agg[0])
+                      for fp, agg in self.fingerprints.items()
+                      if agg[0] >= self.n_plus_one
+                      ]
+        n_plus_one.sort(key=lambda tup: tup[1], reverse=True)
+        return {'count': self.count,
+                'time': self.time,
+                'rows': self.rows,
+                'errors': self.errors,
+                'duplicates': sum([n - 1 for n in self.keys.values()]),
+                'n_plus_one': n_plus_one,
+                }
+
+    def header_value(self):
+        summary = self.summary()
+        return ('statements=%d; time=%.3f; duplicates=%d; n+1=%d'
+                % (summary['count'], summary['time'],
+                   summary['duplicates'], len(summary['n_plus_one'])))
+
+    def log_line(self, request=None):
+        """
+        Gib die Zeile für das Log zurück (mit URL und View des Requests)
+        """
+        summary = self.summary()
+        res = ['SQL profile']
+        if request is not None:
+            res.append('%s %s' % (request.get('REQUEST_METHOD', ''),
+                                  request.get('ACTUAL_URL', '')))
+            published = request.get('PUBLISHED')
+            if published is not None:
+                res.append('(%s)' % getattr(published, '__name__',
+                                            published.__class__.__name__))
+        res = [' '.join(res),
+               ': %(count)d statements, %(time).3f s, %(rows)d rows,'
+               ' %(errors)d errors, %(duplicates)d duplicates' % summary,
+               ]
+        for fp, count in summary['n_plus_one']:
+            agg = self.fingerprints[fp]
+            res.append('; N+1? %dx %.3f s %r from %s'
+                       % (count, agg[1], fp, agg[2]))
+        return ''.join(res)
+
+
+class RequestProfiler(object):
+    """
+    Sink: sammle die Statements des aktuellen Requests in einem
+    RequestProfile (in den Annotationen des Requests).
+
+    sample_rate -- Anteil der profilierten Requests (0 bis 1); die
+                   Entscheidung fällt beim ersten Statement eines Requests,
+                   und in den anderen Requests werden keine QueryEvents
+                   erzeugt (siehe active)
+    header -- soll der Header X-SQL-Profile gesetzt werden?
+    n_plus_one -- ab so vielen Ausführungen desselben Fingerabdrucks
+                  wird ein N+1-Muster vermutet
+    """
+
+    def __init__(self, sample_rate=1.0, header=False,
+                 n_plus_one=N_PLUS_ONE_THRESHOLD, logger=None):
+        self.sample_rate = sample_rate
+        self.header = header
+        self.n_plus_one = n_plus_one
+        if logger is None:
+            logger = logging.getLogger('sqlwrapper.profile')
+        self.logger = logger
+
+    def _profile(self):
+        """
+        Gib das Profil des aktuellen Requests zurück, oder None (kein
+        Request, oder nicht für das Profiling ausgewählt)
+        """
+        request = getRequest()
+        if request is None:
+            return None
+        try:
+            annotations = IAnnotations(request)
+        except TypeError:
+            return None
+        profile = annotations.get(ANNOTATION_KEY)
+        if profile is None:
+            if random() < self.sample_rate:
+                profile = RequestProfile(self.n_plus_one, self)
+            else:
+                profile = False
+            annotations[ANNOTATION_KEY] = profile
+        return profile or None
+
+    def active(self):
+        """
+        Für instrument.active_sinks: wird der aktuelle Request profiliert?
+        """
+        return self._profile() is not None
+
+    def __call__(self, event):
+        profile = self._profile()
+        if profile is not None:
+            profile.add(event)
+
+    def report(self, profile, request):
+        """
+        Protokolliere das Profil und setze ggf. den Header
+        """
+        self.logger.info(profile.log_line(request))
+        if self.header:
+            request.response.setHeader(HEADER_NAME, profile.header_value())
+
+
+def report(event):
+    """
+    Subscriber für das Ende des Requests (IPubBeforeCommit,
+    IPubBeforeAbort): gib ggf. das gesammelte Profil aus
+    """
+    request = event.request
+    try:
+        annotations = IAnnotations(request)
+    except TypeError:
+        return
+    profile = annotations.get(ANNOTATION_KEY)
+    if profile:
+        annotations[ANNOTATION_KEY] = False
+        profile.profiler.report(profile, request)
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod()
+
+# vim: ts=8 sts=4 sw=4 si et
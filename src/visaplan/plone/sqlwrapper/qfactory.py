@@ -13,12 +13,24 @@ Autor: Tobias Herp
 from __future__ import absolute_import, print_function
 
 __all__ = [# Funktionen:
-           # 'insert',
+           'select',
+           'insert',
+           'update',
+           'delete',
            ]
 
-DEBUG = 1
-if __name__ == '__main__':
-    DEBUG = 0   # würde bei Doctests stören
+# Local imports:
+from .utils import (
+    check_name,
+    make_keyset_condition,
+    make_limit_clause,
+    make_order_by,
+    make_returning_clause,
+    make_where_mask,
+    replace_names,
+    )
+
+DEBUG = 0   # 1: jedes generierte Statement ausgeben
 
 def beautify_sql(s):
     """
@@ -63,14 +75,55 @@ else:
 
 
 @decorate
-def select(table, fields=None, where=None, query_data=None):
+def select(table, fields=None, where=None, query_data=None,
+           order_by=None, limit=None,
+           keyset=None, descending=False,
+           offset=None):
     """
     Generiere ein SELECT-Statement (ohne Ersetzung der Werte)
 
     >>> query_data={'eins': 1, 'zwei': 2}
     >>> select('tabelle', query_data=query_data)
     'SELECT * FROM tabelle WHERE eins = %(eins)s AND zwei = %(zwei)s;'
+    >>> select('tabelle', ['zwei', 'eins'], query_data=query_data)
+    'SELECT zwei, eins FROM tabelle WHERE zwei = %(zwei)s AND eins = %(eins)s;'
+
+    Sortierung, Begrenzung, und Keyset-Paginierung
+    (siehe utils.make_keyset_condition):
+
+    >>> select('tabelle', query_data={'eins': 1}, order_by=['id'],
+    ...        limit=10, keyset=['id'])
+    'SELECT * FROM tabelle WHERE eins = %(eins)s AND id > %(id_after)s ORDER BY id LIMIT 10;'
+    >>> select('tabelle', order_by='name DESC', limit=10, offset=20)
+    'SELECT * FROM tabelle ORDER BY name DESC LIMIT 10 OFFSET 20;'
     """
+    if where is None:
+        if query_data or keyset:
+            where = make_where_mask(query_data or {}, fields,
+                                    keyset=keyset, descending=descending)
+    elif keyset:
+        condition = make_keyset_condition(keyset, descending)
+        if where:
+            where = ' AND '.join((where, condition))
+        else:
+            where = 'WHERE ' + condition
+    if fields is None or fields == '*':
+        fields = '*'
+    elif fields:
+        fields = ', '.join(map(check_name, fields))
+    else:
+        fields = '*'
+    query_l = ['SELECT',
+               fields,
+               replace_names('FROM %(table)s', table=table),
+               ]
+    if where:
+        query_l.append(where)
+    if order_by:
+        query_l.append(make_order_by(order_by))
+    if limit is not None or offset:
+        query_l.append(make_limit_clause(limit, offset))
+    return ' '.join(query_l) + ';'
 
 
 @decorate
@@ -85,10 +138,22 @@ def insert(table, dict_of_values,
     >>> insert('tabelle', query_data, returning='eins')
     'INSERT INTO tabelle (eins, zwei) VALUES (%(eins)s, %(zwei)s) RETURNING eins;'
     """
+    keys = sorted(dict_of_values.keys())
+    query_l = [replace_names('INSERT INTO %(table)s',
+                             table=table),
+               '(%s)' % ', '.join(keys),
+               'VALUES (%s)' % ', '.join([key.join(('%(', ')s'))
+                                         for key in keys
+                                         ]),
+               ]
+    if returning:
+        query_l.append(make_returning_clause(returning))
+    return ' '.join(query_l) + ';'
 
 
 @decorate
-def update(table, dict_of_values, where=None, query_data={}):
+def update(table, dict_of_values, where=None, query_data={},
+           returning=None):
     """
     Generiere ein UPDATE-Statement (ohne Ersetzung der Werte)
 
@@ -97,17 +162,44 @@ def update(table, dict_of_values, where=None, query_data={}):
     >>> update('tabelle', dict_of_values, query_data=query_data)
     'UPDATE tabelle SET eins=%(eins)s, zwei=%(zwei)s WHERE id = %(id)s;'
     """
+    qset = ', '.join([''.join((key, '=%(', key, ')s'))
+                      for key in sorted(dict_of_values.keys())
+                      ])
+    query_l = [replace_names('UPDATE %(table)s SET',
+                             table=table),
+               qset,
+               ]
+    if query_data and not where:
+        where = make_where_mask(query_data)
+    if where:
+        query_l.append(where)
+    if returning:
+        query_l.append(make_returning_clause(returning))
+    return ' '.join(query_l) + ';'
 
 
 @decorate
-def delete(table, where=None, query_data=None):
+def delete(table, where=None, query_data=None,
+           returning=None):
     """
     Generiere ein DELETE-Statement (ohne Ersetzung der Werte)
 
     >>> query_data={'id': 42}
     >>> delete('tabelle', query_data=query_data)
     'DELETE FROM tabelle WHERE id = %(id)s;'
+    >>> delete('tabelle', query_data=query_data, returning='*')
+    'DELETE FROM tabelle WHERE id = %(id)s RETURNING *;'
     """
+    query_l = [replace_names('DELETE FROM %(table)s',
+                             table=table),
+               ]
+    if query_data and not where:
+        where = make_where_mask(query_data)
+    if where:
+        query_l.append(where)
+    if returning:
+        query_l.append(make_returning_clause(returning))
+    return ' '.join(query_l) + ';'
 
 
 if __name__ == '__main__':
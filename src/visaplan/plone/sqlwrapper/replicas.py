@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+replicas-Modul des Adapters sqlwrapper: Lesezugriffe über Replikate
+
+Sind in der Zope-Konfiguration (<environment> in zope.conf) Replikate
+angegeben, werden lesende Zugriffe dorthin geleitet:
+
+  DATABASE_REPLICAS        Namen der Datenbankadapter (DA) der Replikate,
+                           durch Kommata oder Leerzeichen getrennt
+  DATABASE_REPLICA_POLICY  round-robin (Vorgabe) oder least-loaded
+
+Über die Replikate laufen select (sowie select_by_keys und select_page),
+query mit read_only=True und Transaktionen mit "read only"
+("with sql('read only'):").  Schreibzugriffe - und alle Lesezugriffe, die
+im selben Request auf einen Schreibzugriff folgen - laufen über die primäre
+Datenbank; ebenso alles in anderen Transaktionen.
+
+Scheitert eine Abfrage auf einem Replikat, wird sie auf der primären
+Datenbank wiederholt, und das Replikat wird für DOWN_SECONDS Sekunden nicht
+mehr verwendet.
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+__all__ = [# Funktionen:
+           'pin_primary',
+           'primary_pinned',
+           'replica_router',
+           # Klassen:
+           'ReplicaRouter',
+           ]
+
+# Standard library:
+import re
+from contextlib import contextmanager
+from threading import Lock
+from time import time
+
+# Zope:
+from zope.annotation.interfaces import IAnnotations
+from zope.globalrequest import getRequest
+
+# Local imports:
+from .connection import zope_environment
+
+ANNOTATION_KEY = 'visaplan.plone.sqlwrapper.replicas.written'
+POLICIES = ('round-robin', 'least-loaded')
+DOWN_SECONDS = 30
+
+_router = []
+
+
+class ReplicaRouter(object):
+    """
+    Auswahl eines Replikats (in diesem Prozeß)
+
+    >>> router = ReplicaRouter(['replica1', 'replica2'])
+    >>> [router.choose() for i in range(3)]
+    ['replica1', 'replica2', 'replica1']
+
+    Mit least-loaded wird das Replikat mit den wenigsten laufenden
+    Abfragen gewählt:
+
+    >>> router = ReplicaRouter(['replica1', 'replica2'], 'least-loaded')
+    >>> with router.using('replica1'):
+    ...     router.choose()
+    'replica2'
+
+    Gestörte Replikate werden eine Weile nicht verwendet:
+
+    >>> router.mark_down('replica2')
+    >>> router.choose(), router.choose()
+    ('replica1', 'replica1')
+    >>> router.mark_down('replica1')
+    >>> router.choose()
+    """
+
+    def __init__(self, names, policy='round-robin', down_seconds=DOWN_SECONDS):
+        if policy not in POLICIES:
+            raise ValueError('Unknown replica policy %(policy)r' % locals())
+        self.names = list(names)
+        self.policy = policy
+        self.down_seconds = down_seconds
+        self._next = 0
+        self._inflight = dict([(name, 0) for name in self.names])
+        # Name -> Zeitpunkt, bis zu dem das Replikat gemieden wird:
+        self._down = {}
+        self._lock = Lock()
+
+    def choose(self):
+        """
+        Gib den Namen des zu verwendenden Replikats zurück, oder None
+        """
+        now = time()
+        with self._lock:
+            names = self.names
+            count = len(names)
+            candidates = []
+            for i in range(count):
+                name = names[(self._next + i) % count]
+                if self._down.get(name, 0) <= now:
+                    candidates.append(name)
+            if not candidates:
+                return None
+            if self.policy == 'least-loaded':
+                inflight = self._inflight
+                name = min(candidates, key=lambda name: inflight[name])
+            else:
+                name = candidates[0]
+            self._next = (names.index(name) + 1) % count
+            return name
+
+    @contextmanager
+    def using(self, name):
+        """
+        Zähle die laufenden Abfragen (für least-loaded)
+        """
+        with self._lock:
+            self._inflight[name] += 1
+        try:
+            yield name
+        finally:
+            with self._lock:
+                self._inflight[name] -= 1
+
+    def mark_down(self, name):
+        with self._lock:
+            self._down[name] = time() + self.down_seconds
+
+    def stats(self):
+        """
+        Gib die laufenden Abfragen und die gestörten Replikate zurück
+        """
+        now = time()
+        with self._lock:
+            return {'policy': self.policy,
+                    'inflight': dict(self._inflight),
+                    'down': sorted([name
+                                    for name, until in self._down.items()
+                                    if until > now]),
+                    }
+
+
+def replica_router():
+    """
+    Gib den gemäß der Zope-Konfiguration erzeugten ReplicaRouter zurück
+    (oder None, wenn keine Replikate konfiguriert sind); die Konfiguration
+    wird nur einmal gelesen.
+    """
+    if not _router:
+        environment = zope_environment()
+        names = [name
+                 for name in re.split(r'[\s,]+',
+                                      environment.get('DATABASE_REPLICAS', ''))
+                 if name]
+        router = None
+        if names:
+            router = ReplicaRouter(names,
+                                   environment.get('DATABASE_REPLICA_POLICY',
+                                                   'round-robin'))
+        _router[:] = [router]
+    return _router[0]
+
+
+def _annotations():
+    request = getRequest()
+    if request is None:
+        return None
+    try:
+        return IAnnotations(request)
+    except TypeError:
+        return None
+
+
+def pin_primary():
+    """
+    Vermerke für den aktuellen Request, daß geschrieben wurde
+    (die folgenden Lesezugriffe laufen dann über die primäre Datenbank);
+    gib False zurück, wenn es keinen Request gibt
+    """
+    annotations = _annotations()
+    if annotations is None:
+        return False
+    annotations[ANNOTATION_KEY] = True
+    return True
+
+
+def primary_pinned():
+    """
+    Wurde im aktuellen Request bereits geschrieben?
+    """
+    annotations = _annotations()
+    return annotations is not None and bool(annotations.get(ANNOTATION_KEY))
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod()
+
+# vim: ts=8 sts=4 sw=4 si et
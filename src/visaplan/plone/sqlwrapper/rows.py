@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+rows-Modul des Adapters sqlwrapper: Umwandlung der Ergebnisse von db.query
+
+Der Datenbank-Adapter liefert ein 2-Tupel (Spaltenbeschreibungen, Zeilen);
+die Spaltennamen werden hier einmal pro Ergebnis ermittelt, und die Zeilen
+in einem Durchgang erzeugt - wahlweise als Dictionarys (Standard) oder als
+kompakte Row-Objekte (Tupel mit gemeinsam genutzten Schlüsseln).
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+from six import string_types as six_string_types
+from six.moves import zip
+
+__all__ = [# Funktionen:
+           'column_names',
+           'make_row',
+           'make_rows',
+           'row_class',
+           'row_factory',
+           # Klassen:
+           'Row',
+           ]
+
+# Local imports:
+from .caching import LRUCache
+
+
+def column_names(description):
+    """
+    Gib die Spaltennamen aus den Spaltenbeschreibungen des
+    Datenbank-Adapters zurück:
+
+    >>> column_names([{'name': 'id', 'type': 'n'}, {'name': 'status'}])
+    ('id', 'status')
+    """
+    return tuple([col['name'] for col in description])
+
+
+class Row(tuple):
+    """
+    Kompakte Ergebniszeile: ein Tupel ohne eigenes __dict__; die
+    Spaltennamen (und ihr Index) sind Attribute der Klasse und werden
+    von allen Zeilen eines Ergebnisses gemeinsam genutzt.
+    Zugriff per Index, Name oder Attribut:
+
+    >>> IdStatus = row_class(('id', 'status'))
+    >>> row = IdStatus((42, 'new'))
+    >>> row[0], row['status'], row.id
+    (42, 'new', 42)
+    >>> row
+    Row(id=42, status='new')
+    >>> row.get('owner', 'nobody')
+    'nobody'
+    >>> sorted(row._asdict().items())
+    [('id', 42), ('status', 'new')]
+    >>> row.keys()
+    ('id', 'status')
+    >>> row['owner']
+    Traceback (most recent call last):
+      ...
+    KeyError: 'owner'
+
+    Spaltennamen, die mit Methoden oder Attributen der Klasse kollidieren
+    (z. B. count, index, get, keys, items), sind per Schlüssel wie gewohnt
+    erreichbar, als Attribut aber nur mit angehängtem Unterstrich:
+
+    >>> row = row_class(('status', 'count'))(('new', 3))
+    >>> row['count'], row.count_, row.get('count')
+    (3, 3, 3)
+
+    Die Zeilen können mit pickle gespeichert werden (z. B. in Caches):
+
+    >>> import pickle
+    >>> copy = pickle.loads(pickle.dumps(row, 2))
+    >>> copy, copy.count_, copy.__class__ is row.__class__
+    (Row(status='new', count=3), 3, True)
+    """
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, six_string_types):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def __getattr__(self, name):
+        try:
+            return tuple.__getitem__(self, self._index[name])
+        except KeyError:
+            raise AttributeError(name)
+
+    def get(self, key, default=None):
+        try:
+            return tuple.__getitem__(self, self._index[key])
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return tuple(self)
+
+    def items(self):
+        return list(zip(self._fields, self))
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+    def __repr__(self):
+        return 'Row(%s)' % ', '.join(['%s=%r' % tup
+                                      for tup in zip(self._fields, self)
+                                      ])
+
+    def __reduce__(self):
+        # die Klassen werden dynamisch erzeugt; also über die Namen:
+        return (make_row, (self._fields, tuple(self)))
+
+
+_row_classes = LRUCache(128)
+
+
+def _make_row_class(names):
+    index = {}
+    for i, name in enumerate(names):
+        index[name] = i
+        if hasattr(Row, name):
+            # als Attribut nur so erreichbar:
+            index.setdefault(name + '_', i)
+    return type('Row', (Row,), {'__slots__': (),
+                                '_fields': names,
+                                '_index': index,
+                                })
+
+
+def row_class(names):
+    """
+    Gib die Row-Klasse für die übergebenen Spaltennamen zurück;
+    für gleiche Namen wird dieselbe Klasse verwendet:
+
+    >>> row_class(('id',)) is row_class(('id',))
+    True
+    """
+    names = tuple(names)
+    return _row_classes.get(names, _make_row_class, names)
+
+
+def make_row(names, values):
+    """
+    Erzeuge eine Zeile der Row-Klasse für die Spaltennamen
+    (auch zum Wiederherstellen gepickelter Zeilen):
+
+    >>> make_row(('id',), (42,))
+    Row(id=42)
+    """
+    return row_class(names)(values)
+
+
+def row_factory(names, compact=False):
+    """
+    Gib eine Funktion zurück, die aus einem Werte-Tupel eine Zeile erzeugt
+    (für die zeilenweise Verarbeitung, z. B. in Adapter.iterselect):
+
+    >>> make = row_factory(('id', 'status'))
+    >>> sorted(make((42, 'new')).items())
+    [('id', 42), ('status', 'new')]
+    >>> row_factory(('id', 'status'), compact=True)((42, 'new'))
+    Row(id=42, status='new')
+    """
+    if compact:
+        return row_class(names)
+    return lambda row: dict(zip(names, row))
+
+
+def make_rows(sqlres, compact=False):
+    """
+    Erzeuge aus dem Rückgabewert von db.query eine Liste von Zeilen.
+
+    sqlres -- ein 2-Tupel (Spaltenbeschreibungen, Liste von Tupeln)
+    compact -- wenn True, werden Row-Objekte erzeugt statt Dictionarys
+
+    >>> res = ([{'name': 'id'}, {'name': 'status'}], [(1, 'new'), (2, 'used')])
+    >>> [sorted(row.items()) for row in make_rows(res)]
+    [[('id', 1), ('status', 'new')], [('id', 2), ('status', 'used')]]
+    >>> make_rows(res, compact=True)
+    [Row(id=1, status='new'), Row(id=2, status='used')]
+    >>> make_rows(([], []))
+    []
+    """
+    raw = sqlres[1]
+    if not raw:
+        return []
+    names = column_names(sqlres[0])
+    if compact:
+        return list(map(row_class(names), raw))
+    return [dict(zip(names, row)) for row in raw]
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod()
+
+# vim: ts=8 sts=4 sw=4 si et
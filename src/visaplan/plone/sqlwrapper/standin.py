@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+standin-Modul des Adapters sqlwrapper: SQLite statt PostgreSQL
+
+SQLiteConnection verhält sich wie die Verbindung eines Zope-Datenbankadapters
+(db.query(query_string, max_rows, query_data) -> (Spaltenbeschreibungen,
+Zeilen)), arbeitet aber mit sqlite3 - für Tests und Benchmarks ohne
+PostgreSQL und ohne Plone-Site:
+
+  db = SQLiteConnection()
+  sql = Adapter.from_connection(db)
+
+Die vom Adapter erzeugten Statements werden übersetzt:
+%(name)s-Platzhalter, = ANY(...) und unnest(...) mit Sequenzen,
+Typumwandlungen (::typ), VALUES-Listen mit Spaltennamen, qualifizierte
+RETURNING-Felder, BEGIN TRANSACTION ..., serverseitige Cursor
+(DECLARE/FETCH/CLOSE) und die Spaltenabfrage des catalog-Moduls.
+Nicht unterstützt sind u. a. DEFAULT in VALUES-Listen, COPY und EXPLAIN.
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+__all__ = [# Funktionen:
+           'split_statements',
+           'translate',
+           # Klassen:
+           'SQLiteConnection',
+           ]
+
+# Standard library:
+import json
+import re
+import sqlite3
+from itertools import count
+from threading import RLock
+
+# Local imports:
+from .placeholders import Template
+
+_numbers = count(1)
+
+_CAST_RE = re.compile(r'::[A-Za-z_][\w ]*?(?:\[\])?(?=[\s,;)]|$)')
+_ANY_RE = re.compile(r'=\s*ANY\s*\(\s*(%\([^)]+\)s)\s*\)', re.IGNORECASE)
+_UNNEST_RE = re.compile(r'SELECT \* FROM unnest\(((?:%\([^)]+\)s(?:, )?)+)\)',
+                        re.IGNORECASE)
+_IN_BEFORE_RE = re.compile(r'\bIN\s*$', re.IGNORECASE)
+_VALUES_ALIAS_RE = re.compile(r'\(VALUES ', re.IGNORECASE)
+_ALIAS_COLUMNS_RE = re.compile(r'\s+AS\s+(\w+)\s*\(([\w\s,]+)\)')
+_RETURNING_RE = re.compile(r'\bRETURNING\b(.*)$', re.IGNORECASE | re.DOTALL)
+_QUALIFIED_RE = re.compile(r'\b\w+\.(\w+|\*)')
+_BEGIN_RE = re.compile(r'^BEGIN\b', re.IGNORECASE)
+_DECLARE_RE = re.compile(r'^DECLARE\s+(\w+)\s+.*?\bCURSOR\b.*?\bFOR\s+(.*)$',
+                         re.IGNORECASE | re.DOTALL)
+_FETCH_RE = re.compile(r'^FETCH\s+FORWARD\s+(\d+)\s+FROM\s+(\w+)$',
+                       re.IGNORECASE)
+_CLOSE_RE = re.compile(r'^CLOSE\s+(\w+)$', re.IGNORECASE)
+
+UDT_NAMES = {'integer': 'int4',
+             'int': 'int4',
+             'bigint': 'int8',
+             'smallint': 'int2',
+             'boolean': 'bool',
+             'real': 'float4',
+             'double precision': 'float8',
+             'character varying': 'varchar',
+             }
+
+
+def split_statements(sql):
+    """
+    Teile einen SQL-String in die einzelnen Statements
+    (Semikolons in String-Literalen werden berücksichtigt):
+
+    >>> split_statements("BEGIN; INSERT INTO t VALUES ('a;b');COMMIT;")
+    ['BEGIN', "INSERT INTO t VALUES ('a;b')", 'COMMIT']
+    """
+    res = []
+    start = 0
+    quoted = False
+    for i, char in enumerate(sql):
+        if char == "'":
+            quoted = not quoted
+        elif char == ';' and not quoted:
+            res.append(sql[start:i])
+            start = i + 1
+    res.append(sql[start:])
+    return [stmt.strip() for stmt in res if stmt.strip()]
+
+
+def _matching_paren(sql, pos):
+    """
+    Gib die Position der schließenden Klammer zur öffnenden bei <pos> zurück
+    """
+    depth = 0
+    quoted = False
+    for i in range(pos, len(sql)):
+        char = sql[i]
+        if char == "'":
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if not depth:
+                return i
+    raise ValueError('Unbalanced parentheses in %(sql)r' % locals())
+
+
+def _values_aliases(sql):
+    """
+    (VALUES ...) AS v(a, b) -> (SELECT column1 AS a, ... FROM (VALUES ...)) AS v
+    """
+    pos = 0
+    while True:
+        mo = _VALUES_ALIAS_RE.search(sql, pos)
+        if not mo:
+            return sql
+        end = _matching_paren(sql, mo.start())
+        alias = _ALIAS_COLUMNS_RE.match(sql, end + 1)
+        if not alias:
+            pos = end
+            continue
+        names = [name.strip() for name in alias.group(2).split(',')]
+        columns = ', '.join(['column%d AS %s' % (i, name)
+                             for i, name in enumerate(names, 1)
+                             ])
+        replacement = '(SELECT %s FROM %s) AS %s' % (columns,
+                                                     sql[mo.start():end+1],
+                                                     alias.group(1))
+        sql = sql[:mo.start()] + replacement + sql[alias.end():]
+        pos = mo.start() + len(replacement)
+
+
+def _unnest(mo, query_data):
+    """
+    SELECT * FROM unnest(%(a)s, %(b)s) -> VALUES (...), (...)
+    """
+    names = re.findall(r'%\(([^)]+)\)s', mo.group(1))
+    columns = [query_data[name] for name in names]
+    length = len(columns[0])
+    if not length:
+        return 'SELECT %s WHERE 0' % ', '.join(['NULL'] * len(names))
+    # Die Werte werden zeilenweise neu benannt:
+    res = []
+    for i in range(length):
+        res.append('(%s)' % ', '.join(['%%(%s__%d)s' % (name, i)
+                                       for name in names
+                                       ]))
+        for name, column in zip(names, columns):
+            query_data['%s__%d' % (name, i)] = column[i]
+    return 'VALUES ' + ', '.join(res)
+
+
+def translate(sql, query_data=None):
+    """
+    Übersetze ein einzelnes (PostgreSQL-) Statement für SQLite;
+    gib ein 2-Tupel (sql, params) zurück (mit ?-Platzhaltern):
+
+    >>> translate('SELECT * FROM tan WHERE id = ANY(%(id)s) AND x = %(x)s',
+    ...           {'id': [1, 2], 'x': 'a'})
+    ('SELECT * FROM tan WHERE id IN (?, ?) AND x = ?', [1, 2, 'a'])
+    >>> translate("SELECT * FROM t WHERE (a, b) IN (SELECT * FROM"
+    ...           " unnest(%(a)s::int4[], %(b)s::text[]))",
+    ...           {'a': [1, 2], 'b': ['x', 'y']})[0]
+    'SELECT * FROM t WHERE (a, b) IN (VALUES (?, ?), (?, ?))'
+    >>> translate('UPDATE t AS t SET s = v.s FROM (VALUES (%(id_0)s::int4,'
+    ...           ' %(s_0)s::text)) AS v(id, s) WHERE t.id = v.id'
+    ...           ' RETURNING t.id', {'id_0': 1, 's_0': 'x'})[0]
+    'UPDATE t AS t SET s = v.s FROM (SELECT column1 AS id, column2 AS s FROM (VALUES (?, ?))) AS v WHERE t.id = v.id RETURNING id'
+    >>> translate("SELECT '100%%' FROM t")
+    ("SELECT '100%' FROM t", [])
+    """
+    if query_data is None:
+        query_data = {}
+    else:
+        query_data = dict(query_data)
+    sql = _CAST_RE.sub('', sql)
+    sql = _ANY_RE.sub(r'IN \1', sql)
+    if 'unnest' in sql:
+        sql = _UNNEST_RE.sub(lambda mo: _unnest(mo, query_data), sql)
+    if '(VALUES ' in sql.upper():
+        sql = _values_aliases(sql)
+    mo = _RETURNING_RE.search(sql)
+    if mo:
+        sql = sql[:mo.start(1)] + _QUALIFIED_RE.sub(r'\1', mo.group(1))
+    # Sequenzen werden je nach Wert expandiert; die qmark-Übersetzung des
+    # placeholders-Moduls genügt hier also nicht:
+    params = []
+    res = []
+    parts = Template(sql).parts
+    for i, part in enumerate(parts):
+        if not i % 2:
+            res.append(part)
+            continue
+        value = query_data[part]
+        if isinstance(value, tuple) or (
+                isinstance(value, list)
+                and _IN_BEFORE_RE.search(parts[i-1])):
+            res.append('(%s)' % ', '.join(['?'] * len(value)))
+            params.extend(value)
+        elif isinstance(value, (list, dict)):
+            res.append('?')
+            params.append(json.dumps(value))
+        else:
+            res.append('?')
+            params.append(value)
+    return ''.join(res), params
+
+
+def _description(cursor):
+    return [{'name': col[0],
+             'type': None,
+             'width': None,
+             'null': None,
+             'precision': None,
+             'scale': None,
+             }
+            for col in cursor.description or ()
+            ]
+
+
+class SQLiteConnection(object):
+    """
+    Stand-in für die Verbindung eines Zope-Datenbankadapters, mit sqlite3.
+
+    >>> db = SQLiteConnection()
+    >>> db.query('CREATE TABLE tan (id integer PRIMARY KEY, status text);')
+    ((), [])
+    >>> db.query('INSERT INTO tan (id, status) VALUES (%(id_0)s, %(status_0)s),'
+    ...          ' (%(id_1)s, %(status_1)s) RETURNING id;COMMIT;', None,
+    ...          {'id_0': 1, 'status_0': 'new', 'id_1': 2, 'status_1': 'used'}
+    ...          )[1]
+    [(1,), (2,)]
+    >>> desc, rows = db.query('SELECT id, status FROM tan'
+    ...                       ' WHERE status = ANY(%(status)s);',
+    ...                       None, {'status': ['new']})
+    >>> [col['name'] for col in desc], [row[0] for row in rows]
+    (['id', 'status'], [1])
+
+    Mit paramstyle='qmark' verhält sie sich dagegen wie ein DB-API-Treiber
+    (siehe das placeholders-Modul): die Statements kommen bereits mit
+    ?-Platzhaltern und werden nicht übersetzt, und wie sqlite3 selbst wird
+    nur ein Statement pro Aufruf angenommen:
+
+    >>> db = SQLiteConnection(paramstyle='qmark')
+    >>> db.query('CREATE TABLE tan (id integer PRIMARY KEY, status text);')
+    ((), [])
+    >>> db.query('INSERT INTO tan (id, status) VALUES (?, ?);', None,
+    ...          [1, 'new'])
+    ((), [])
+    >>> try:
+    ...     db.query('INSERT INTO tan (id) VALUES (2);COMMIT;')
+    ... except (sqlite3.Warning, sqlite3.ProgrammingError) as e:
+    ...     print(e)
+    You can only execute one statement at a time.
+    """
+
+    def __init__(self, path=':memory:', paramstyle='pyformat'):
+        self.connection = sqlite3.connect(path, isolation_level=None,
+                                          check_same_thread=False)
+        if paramstyle not in ('pyformat', 'qmark'):
+            raise ValueError('Unsupported placeholder style %(paramstyle)r'
+                             % locals())
+        self.paramstyle = paramstyle
+        # für die prozeßweiten Caches des Adapters:
+        self.db_name = 'sqlite:%s#%d' % (path, next(_numbers))
+        self._cursors = {}
+        self._lock = RLock()
+        self.queries = 0
+
+    def query(self, query_string, max_rows=None, query_data=None):
+        """
+        Führe die Statements aus und gib das Ergebnis des letzten zurück,
+        das Spalten hat (also z. B. das von INSERT ... RETURNING vor einem
+        angehängten COMMIT): (Spaltenbeschreibungen, Zeilen)
+        """
+        with self._lock:
+            self.queries += 1
+            if self.paramstyle != 'pyformat':
+                statement = query_string.strip()
+                if statement.endswith(';'):
+                    statement = statement[:-1]
+                return self._execute(statement, max_rows, query_data)
+            res = ((), [])
+            for statement in split_statements(query_string):
+                tup = self._execute(statement, max_rows, query_data)
+                if tup[0]:
+                    res = tup
+            return res
+
+    def _execute(self, statement, max_rows, query_data):
+        if _BEGIN_RE.match(statement):
+            statement = 'BEGIN'
+        elif statement.upper().startswith('SET TRANSACTION'):
+            return ((), [])
+        elif statement.upper() in ('COMMIT', 'ROLLBACK'):
+            # Zope-Datenbankadapter arbeiten immer in einer Transaktion;
+            # ohne vorheriges BEGIN ist hier nichts zu tun:
+            try:
+                self.connection.execute(statement)
+            except sqlite3.OperationalError:
+                pass
+            return ((), [])
+        elif 'information_schema.columns' in statement:
+            return self._columns(query_data)
+        else:
+            mo = _DECLARE_RE.match(statement)
+            if mo:
+                sql, params = self._translate(mo.group(2), query_data)
+                cursor = self.connection.cursor()
+                cursor.execute(sql, params)
+                self._cursors[mo.group(1)] = cursor
+                return ((), [])
+            mo = _FETCH_RE.match(statement)
+            if mo:
+                cursor = self._cursors[mo.group(2)]
+                return (_description(cursor),
+                        cursor.fetchmany(int(mo.group(1))))
+            mo = _CLOSE_RE.match(statement)
+            if mo:
+                self._cursors.pop(mo.group(1)).close()
+                return ((), [])
+        sql, params = self._translate(statement, query_data)
+        cursor = self.connection.execute(sql, params)
+        if cursor.description is None:
+            return ((), [])
+        if max_rows:
+            rows = cursor.fetchmany(max_rows)
+        else:
+            rows = cursor.fetchall()
+        return (_description(cursor), rows)
+
+    def _translate(self, statement, query_data):
+        if self.paramstyle == 'pyformat':
+            return translate(statement, query_data)
+        return statement, query_data or ()
+
+    def _columns(self, query_data):
+        """
+        Emulation der Spaltenabfrage des catalog-Moduls
+        (alle Tabellen gelten als Tabellen des Schemas 'public')
+        """
+        desc = [{'name': name}
+                for name in ('table_name', 'column_name', 'data_type',
+                             'udt_name', 'is_nullable', 'column_default',
+                             'ordinal_position')
+                ]
+        if (query_data or {}).get('schema', 'public') != 'public':
+            return (desc, [])
+        rows = []
+        tables = self.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type IN"
+                " ('table', 'view') ORDER BY name").fetchall()
+        for (table,) in tables:
+            for (cid, name, type_, notnull, default, pk
+                 ) in self.connection.execute('PRAGMA table_info(%s)'
+                                              % table):
+                type_ = type_.lower()
+                rows.append((table, name, type_,
+                             UDT_NAMES.get(type_, type_),
+                             notnull and 'NO' or 'YES', default, cid + 1))
+        return (desc, rows)
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod()
+
+# vim: ts=8 sts=4 sw=4 si et
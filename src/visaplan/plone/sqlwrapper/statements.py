@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*- äöü vim: ts=8 sts=4 sw=4 si et tw=79
+"""
+statements-Modul des Adapters sqlwrapper: die Statements der Grundmethoden
+
+Die Statements für insert, update, delete und select werden mit den
+Funktionen des qfactory-Moduls erzeugt und im statement_cache gespeichert;
+die Funktionen hier werden vom (Zope-) Adapter und vom AsyncSQLWrapper
+(Modul aio.asyncsql) gemeinsam verwendet.
+"""
+# Python compatibility:
+from __future__ import absolute_import
+
+__all__ = [# Funktionen:
+           'check_update_keys',
+           'compile_statement',
+           'delete_statement',
+           'insert_statement',
+           'select_statement',
+           'update_statement',
+           ]
+
+# Standard library:
+import logging
+
+# Local imports:
+from . import qfactory
+from .caching import data_shape, freeze_names, statement_cache
+from .utils import is_sequence, make_limit_clause
+
+logger = logging.getLogger('sqlwrapper')
+
+
+def compile_statement(factory, commit, *args):
+    """
+    Erzeuge ein SQL-Statement mit der übergebenen Funktion aus dem
+    qfactory-Modul und hänge ggf. ein COMMIT an
+    (für den statement_cache)
+    """
+    query = factory(*args)
+    if commit:
+        query += 'COMMIT;'
+    return query
+
+
+def check_update_keys(dict_of_values, query_data, caller='update'):
+    """
+    Für update und update_many: Prüfe, ob Schlüssel sowohl in den neuen
+    Werten als auch in den Query-Daten vorkommen.  Bei gleichen Werten wird
+    der Schlüssel aus <dict_of_values> entfernt (das Dictionary wird also
+    ggf. modifiziert!), ansonsten gibt es einen ValueError.
+    """
+    query_keys = set(query_data.keys())
+    value_keys = set(dict_of_values.keys())
+    keys_of_both = value_keys.intersection(query_keys)
+    if keys_of_both:
+        # Löschen aus Set während Iteration nicht erlaubt;
+        # also iteration über "Kopie":
+        for key in sorted(keys_of_both):
+            u_val = dict_of_values[key]
+            q_val = query_data[key]
+            if u_val == q_val:
+                del dict_of_values[key]
+                keys_of_both.remove(key)
+            else:
+                logger.error('%(caller)s: key %(key)r is both'
+                             ' in query data (%(q_val)r)'
+                             ' and update data (%(u_val)r)!',
+                             locals())
+    if not dict_of_values:
+        raise ValueError('Empty update data!')
+    if keys_of_both:
+        logger.error('%(caller)s: value_keys = %(value_keys)s,'
+                     ' query_keys = %(query_keys)s,'
+                     ' intersection = %(keys_of_both)s'
+                     , locals())
+        raise ValueError('intersection of value keys and '
+                         'query keys (%(keys_of_both)s: '
+                         'currently unsupported!'
+                         % locals())
+
+
+def insert_statement(table, dict_of_values, returning=None, commit=False):
+    """
+    Das (ggf. gecachte) INSERT-Statement für eine Zeile
+
+    >>> insert_statement('tan', {'tan': 1, 'status': 'new'}, 'tan')
+    'INSERT INTO tan (status, tan) VALUES (%(status)s, %(tan)s) RETURNING tan;'
+    """
+    return statement_cache.get(('insert', table,
+                                tuple(sorted(dict_of_values.keys())),
+                                freeze_names(returning),
+                                commit),
+                               compile_statement, qfactory.insert,
+                               commit,
+                               table, dict_of_values, returning)
+
+
+def update_statement(table, dict_of_values, where=None, query_data=None,
+                     returning=None, commit=False):
+    """
+    Das (ggf. gecachte) UPDATE-Statement; das WHERE-Kriterium wird ggf.
+    aus den Schlüsseln von <query_data> erzeugt.
+    """
+    return statement_cache.get(('update', table,
+                                tuple(sorted(dict_of_values.keys())),
+                                where,
+                                not where and data_shape(query_data)
+                                or None,
+                                freeze_names(returning),
+                                commit),
+                               compile_statement, qfactory.update,
+                               commit,
+                               table, dict_of_values, where,
+                               query_data, returning)
+
+
+def delete_statement(table, where=None, query_data=None, returning=None,
+                     commit=False):
+    """
+    Das (ggf. gecachte) DELETE-Statement
+    """
+    return statement_cache.get(('delete', table,
+                                where,
+                                not where and data_shape(query_data)
+                                or None,
+                                freeze_names(returning),
+                                commit),
+                               compile_statement, qfactory.delete,
+                               commit,
+                               table, where, query_data, returning)
+
+
+def select_statement(table, fields=None, where=None, query_data=None,
+                     order_by=None, limit=None, offset=None):
+    """
+    Das (ggf. gecachte) SELECT-Statement;
+    LIMIT und OFFSET werden erst hier angefügt, damit sie nicht
+    Teil des Cache-Schlüssels werden müssen.
+
+    >>> select_statement('tan', ['tan', 'status'], limit=10)
+    'SELECT tan, status FROM tan LIMIT 10;'
+    """
+    if fields is not None and is_sequence(fields):
+        fields = tuple(fields)
+    query = statement_cache.get(('select', table, fields,
+                                 where,
+                                 where is None and data_shape(query_data)
+                                 or None,
+                                 freeze_names(order_by)),
+                                qfactory.select,
+                                table, fields, where, query_data,
+                                order_by)
+    if limit is not None or offset:
+        return ''.join((query[:-1], ' ',
+                        make_limit_clause(limit, offset), ';'))
+    return query
+
+
+if __name__ == '__main__':
+    # Standard library:
+    import doctest
+    doctest.testmod()
+
+# vim: ts=8 sts=4 sw=4 si et
@@ -8,20 +8,33 @@ Autor: Tobias Herp
 from __future__ import absolute_import
 
 from six import string_types as six_string_types
-from six.moves import map, zip
+from six.moves import intern, map, zip
 
 __all__ = [# Funktionen:
            # SQL names:
            'check_name',
            "check_alias",
            'replace_names',
+           'prefix_placeholders',
+           'merge_statements',
            # SQL generation:
            "make_transaction_cmd",
            "make_where_mask",
+           "make_keyset_condition",
+           "make_unnest_condition",
+           "make_order_by",
+           "order_specs",
+           "make_limit_clause",
+               # specific helpers:
+               "_order_spec",
+               "keyset_placeholder",
            "make_grouping_wrapper",
                # specific helper:
                "_groupable_spectup",
            "make_returning_clause",
+           "make_multirow_values",
+           "make_conflict_clause",
+           "iter_chunks",
            # "make_join",  # not yet implemented
            # Formatting:
            "normalize_sql_snippet",
@@ -34,11 +47,12 @@ __all__ = [# Funktionen:
            ]
 
 # Standard library:
-from string import digits, letters, uppercase, whitespace
+import re
+from string import ascii_letters, ascii_uppercase, digits, whitespace
 
-NAMECHARS = frozenset(letters+'._')
-ALLNAMECHARS = frozenset(letters+digits+'._')
-SNIPPETCHARS = frozenset(uppercase + whitespace)
+NAMECHARS = frozenset(ascii_letters+'._')
+ALLNAMECHARS = frozenset(ascii_letters+digits+'._')
+SNIPPETCHARS = frozenset(ascii_uppercase + whitespace)
 
 
 def check_name(sqlname, for_select=False):
@@ -279,8 +293,103 @@ def replace_names(sql, **kwargs):
     dic = SmartDict(kwargs)
     return sql % dic
 
+# %(name)s-Platzhalter, und maskierte Prozentzeichen:
+PLACEHOLDER_RE = re.compile(r'%(?:%|\(([^)]+)\)s)')
+
+
+def prefix_placeholders(sql, prefix, query_data):
+    """
+    Für das Zusammenfassen mehrerer Statements zu einer Anfrage
+    (mit nur einem Daten-Dictionary): Versieh alle %(name)s-Platzhalter
+    mit einem Präfix, und gib das geänderte Statement und die
+    entsprechend umbenannten Daten zurück.
+
+    >>> sql, data = prefix_placeholders('DELETE FROM t WHERE id = %(id)s;',
+    ...                                 's1_', {'id': 42})
+    >>> sql
+    'DELETE FROM t WHERE id = %(s1_id)s;'
+    >>> data
+    {'s1_id': 42}
+
+    Maskierte Prozentzeichen bleiben erhalten; ohne Daten werden
+    Prozentzeichen maskiert (der Datenbanktreiber interpretiert sie dann
+    ja nicht):
+
+    >>> prefix_placeholders("SELECT '%%' || %(x)s;", 's2_', {'x': 1})[0]
+    "SELECT '%%' || %(s2_x)s;"
+    >>> prefix_placeholders("DELETE FROM t WHERE n LIKE 'a%';", 's3_', None)
+    ("DELETE FROM t WHERE n LIKE 'a%%';", {})
+    """
+    if not query_data:
+        return sql.replace('%', '%%'), {}
+
+    def sub(mo):
+        name = mo.group(1)
+        if name is None:
+            return '%%'
+        return ''.join(('%(', prefix, name, ')s'))
+
+    data = dict([(prefix + key, val)
+                 for key, val in query_data.items()
+                 ])
+    return PLACEHOLDER_RE.sub(sub, sql), data
+
+
+def merge_statements(items):
+    """
+    Fasse mehrere Statements (jeweils mit ihren Daten) zu einer einzigen
+    Anfrage zusammen; gib ein 2-Tupel (sql, query_data) zurück.
+    Die Platzhalter werden dabei ggf. umbenannt (siehe prefix_placeholders).
+
+    items -- eine Sequenz von 2-Tupeln (sql, query_data); die Daten müssen
+             Dictionarys sein (oder None)
+
+    >>> sql, data = merge_statements([
+    ...     ('BEGIN TRANSACTION;', None),
+    ...     ('DELETE FROM t WHERE id = %(id)s;', {'id': 1}),
+    ...     ('DELETE FROM t WHERE id = %(id)s', {'id': 2})])
+    >>> sql
+    'BEGIN TRANSACTION;DELETE FROM t WHERE id = %(s1_id)s;DELETE FROM t WHERE id = %(s2_id)s;'
+    >>> sorted(data.items())
+    [('s1_id', 1), ('s2_id', 2)]
+
+    Ohne Daten wird nichts umbenannt oder maskiert:
+
+    >>> merge_statements([("DELETE FROM t WHERE n LIKE 'a%';", None),
+    ...                   ('COMMIT;', None)])
+    ("DELETE FROM t WHERE n LIKE 'a%';COMMIT;", None)
+    """
+    statements = []
+    if not [True for sql, data in items if data]:
+        for sql, data in items:
+            statements.append(_terminated(sql))
+        return ''.join(statements), None
+    merged = {}
+    for i, (sql, data) in enumerate(items):
+        sql, data = prefix_placeholders(sql, 's%d_' % i, data)
+        statements.append(_terminated(sql))
+        merged.update(data)
+    return ''.join(statements), merged
+
+
+def _terminated(sql):
+    """
+    Stelle sicher, daß das Statement mit einem Semikolon endet:
+
+    >>> _terminated('COMMIT')
+    'COMMIT;'
+    >>> _terminated('COMMIT; ')
+    'COMMIT;'
+    """
+    sql = sql.rstrip()
+    if sql.endswith(';'):
+        return sql
+    return sql + ';'
+
+
 WHERE = intern('WHERE')
-def make_where_mask(dic, fields=None, keyword=WHERE):
+def make_where_mask(dic, fields=None, keyword=WHERE,
+                    keyset=None, descending=False):
     """
     Komfort-Funktion; wenn die Query-Daten schon als dict vorliegen,
     braucht man sich die WHERE-Bedingung nicht aus den Fingern zu saugen.
@@ -320,6 +429,15 @@ def make_where_mask(dic, fields=None, keyword=WHERE):
 
     >>> make_where_mask({'status': ['new', 'reserved']}, keyword='HAVING')
     'HAVING status = ANY(%(status)s)'
+
+    Für Keyset-Paginierung (siehe make_keyset_condition) können die
+    Sortierfelder angegeben werden; die Vergleichswerte werden als
+    <name>_after erwartet:
+
+    >>> make_where_mask({'status': 'new'}, keyset=['created', 'id'])
+    'WHERE status = %(status)s AND (created, id) > (%(created_after)s, %(id_after)s)'
+    >>> make_where_mask({}, keyset=['id'], descending=True)
+    'WHERE id < %(id_after)s'
     """
     assert keyword in (WHERE, 'HAVING')
     keys = sorted(dic.keys())
@@ -342,9 +460,179 @@ def make_where_mask(dic, fields=None, keyword=WHERE):
                 res.append(''.join((key, ' = ANY(%(', key, ')s)')))
             else:
                 res.append(''.join((key, ' = %(', key, ')s')))
+        if keyset:
+            res.append(make_keyset_condition(keyset, descending))
         return ' '.join((keyword, ' AND '.join(res)))
+    if keyset:
+        return ' '.join((keyword, make_keyset_condition(keyset, descending)))
     return ''
 
+def keyset_placeholder(name):
+    """
+    Gib den Namen des Platzhalters für den Vergleichswert des Feldes <name>
+    bei Keyset-Paginierung zurück:
+
+    >>> keyset_placeholder('id')
+    'id_after'
+    """
+    return name + '_after'
+
+
+def make_keyset_condition(names, descending=False):
+    """
+    Erzeuge die Bedingung für Keyset-Paginierung ("seek method"):
+    es werden nur Zeilen *nach* der zuletzt gelieferten Zeile gefunden,
+    bezogen auf die Sortierung nach den angegebenen Feldern.
+    Im Gegensatz zu OFFSET kann die Datenbank hierfür einen Index
+    verwenden; die Kosten pro Seite bleiben also konstant.
+
+    >>> make_keyset_condition(['id'])
+    'id > %(id_after)s'
+    >>> make_keyset_condition(['created', 'id'])
+    '(created, id) > (%(created_after)s, %(id_after)s)'
+    >>> make_keyset_condition(['created', 'id'], descending=True)
+    '(created, id) < (%(created_after)s, %(id_after)s)'
+    """
+    op = descending and ' < ' or ' > '
+    names = list(map(check_name, names))
+    if not names:
+        raise ValueError('make_keyset_condition: no names given!')
+    placeholders = [keyset_placeholder(name).join(('%(', ')s'))
+                    for name in names]
+    if names[1:]:
+        return op.join((', '.join(names).join('()'),
+                        ', '.join(placeholders).join('()')))
+    return op.join((names[0], placeholders[0]))
+
+
+ORDER_DIRECTIONS = frozenset(['ASC', 'DESC'])
+
+
+def _order_spec(item):
+    """
+    Für make_order_by: Zerlege eine Sortierangabe in Feldnamen und
+    Richtung; der Feldname wird mit check_name geprüft.
+
+    >>> _order_spec('id')
+    ('id', 'ASC')
+    >>> _order_spec('created desc')
+    ('created', 'DESC')
+    >>> _order_spec(('created', 'DESC'))
+    ('created', 'DESC')
+    >>> _order_spec('created; DROP TABLE x')
+    Traceback (most recent call last):
+      ...
+    ValueError: Invalid order specification: 'created; DROP TABLE x'
+    >>> _order_spec(' ')
+    Traceback (most recent call last):
+      ...
+    ValueError: Invalid order specification: ' '
+    """
+    if isinstance(item, six_string_types):
+        words = item.split()
+    else:
+        words = list(item)
+    if not words:
+        raise ValueError('Invalid order specification: %(item)r'
+                         % locals())
+    if words[1:]:
+        if words[2:]:
+            raise ValueError('Invalid order specification: %(item)r'
+                             % locals())
+        direction = words[1].upper()
+        if direction not in ORDER_DIRECTIONS:
+            raise ValueError('Invalid order direction: %(item)r'
+                             % locals())
+    else:
+        direction = 'ASC'
+    return check_name(words[0]), direction
+
+
+def order_specs(order_by):
+    """
+    Zerlege eine Sortierangabe (siehe make_order_by) in eine Liste von
+    2-Tupeln (Feldname, Richtung):
+
+    >>> order_specs('created DESC, id')
+    [('created', 'DESC'), ('id', 'ASC')]
+    >>> order_specs([('id', 'asc')])
+    [('id', 'ASC')]
+
+    Eine leere Angabe bedeutet "keine Sortierung"; leere Einträge in einer
+    nicht-leeren Liste sind aber Fehler:
+
+    >>> order_specs('')
+    []
+    >>> order_specs('  ')
+    []
+    >>> order_specs('created DESC,, id')
+    Traceback (most recent call last):
+      ...
+    ValueError: Invalid order specification: ''
+    """
+    if isinstance(order_by, six_string_types):
+        if not order_by.strip():
+            return []
+        order_by = order_by.split(',')
+    return [_order_spec(item) for item in order_by]
+
+
+def make_order_by(order_by):
+    """
+    Erzeuge eine ORDER BY-Klausel; die Feldnamen werden mit check_name
+    geprüft.
+
+    order_by -- ein Feldname oder eine Sequenz von Feldnamen, jeweils
+                optional mit ASC oder DESC; auch als Tupel
+
+    >>> make_order_by('id')
+    'ORDER BY id'
+    >>> make_order_by(['created DESC', 'id'])
+    'ORDER BY created DESC, id'
+    >>> make_order_by('created DESC, id')
+    'ORDER BY created DESC, id'
+    >>> make_order_by([])
+    ''
+    >>> make_order_by('')
+    ''
+    """
+    res = []
+    for name, direction in order_specs(order_by):
+        if direction == 'ASC':
+            res.append(name)
+        else:
+            res.append(name + ' DESC')
+    if res:
+        return 'ORDER BY ' + ', '.join(res)
+    return ''
+
+
+def make_limit_clause(limit=None, offset=None):
+    """
+    Erzeuge die LIMIT- und OFFSET-Angaben; die Werte müssen ganze Zahlen
+    sein:
+
+    >>> make_limit_clause(10)
+    'LIMIT 10'
+    >>> make_limit_clause(10, 20)
+    'LIMIT 10 OFFSET 20'
+    >>> make_limit_clause(offset=20)
+    'OFFSET 20'
+    >>> make_limit_clause()
+    ''
+    >>> make_limit_clause('10; DROP TABLE x')
+    Traceback (most recent call last):
+      ...
+    ValueError: invalid literal for int() with base 10: '10; DROP TABLE x'
+    """
+    res = []
+    if limit is not None:
+        res.append('LIMIT %d' % int(limit))
+    if offset:
+        res.append('OFFSET %d' % int(offset))
+    return ' '.join(res)
+
+
 def _groupable_spectup(item):
     """
     Für make_grouping_wrapper (fields-Argument)
@@ -516,6 +804,184 @@ def make_returning_clause(fields):
         liz = fields
     return 'RETURNING ' + ', '.join(map(check_name, liz))
 
+def make_multirow_values(keys, rows, defaults=None, casts=None):
+    """
+    Für mehrzeilige INSERT-Anweisungen: Erzeuge aus einer Sequenz von
+    Dictionarys die Zeilentupel für die VALUES-Klausel sowie das
+    Dictionary mit den zugehörigen Daten.
+
+    keys -- die Feldnamen (geprüft und in der Reihenfolge der Feldliste)
+    rows -- eine Sequenz von Dictionarys
+    defaults -- optional: Vorgabewerte für in einer Zeile fehlende Schlüssel
+
+    Die Platzhalter erhalten die Zeilennummer als Suffix (<name>_<nr>); da
+    dieses nur aus Ziffern besteht, sind Kollisionen ausgeschlossen:
+
+    >>> rows = [{'eins': 1, 'zwei': 2}, {'eins': 3}]
+    >>> values, data = make_multirow_values(['eins', 'zwei'], rows)
+    >>> values
+    '(%(eins_0)s, %(zwei_0)s), (%(eins_1)s, DEFAULT)'
+    >>> sorted(data.items())
+    [('eins_0', 1), ('eins_1', 3), ('zwei_0', 2)]
+
+    Fehlt ein Wert, wird ohne Vorgabewert das Schlüsselwort DEFAULT
+    verwendet (siehe oben); Vorgabewerte werden nur einmal übergeben:
+
+    >>> values, data = make_multirow_values(['eins', 'zwei'], rows,
+    ...                                     {'zwei': 0})
+    >>> values
+    '(%(eins_0)s, %(zwei_0)s), (%(eins_1)s, %(zwei_d)s)'
+    >>> sorted(data.items())
+    [('eins_0', 1), ('eins_1', 3), ('zwei_0', 2), ('zwei_d', 0)]
+
+    Zusätzliche Schlüssel in den Dictionarys werden hier ignoriert.
+
+    Für VALUES-Listen außerhalb von INSERT-Anweisungen (z. B. in
+    UPDATE ... FROM (VALUES ...)) können Typen angegeben werden; die Werte
+    der ersten Zeile werden dann explizit umgewandelt, was für die
+    Typbestimmung der Spalten ausreicht:
+
+    >>> make_multirow_values(['id', 'status'], [{'id': 1, 'status': 'a'},
+    ...                                         {'id': 2, 'status': 'b'}],
+    ...                      casts={'id': 'int4'})[0]
+    '(%(id_0)s::int4, %(status_0)s), (%(id_1)s, %(status_1)s)'
+    """
+    if defaults is None:
+        defaults = {}
+    if casts is None:
+        casts = {}
+    data = {}
+    tuples = []
+    for i, row in enumerate(rows):
+        values = []
+        for key in keys:
+            if key in row:
+                name = '%s_%d' % (key, i)
+                data[name] = row[key]
+            elif key in defaults:
+                name = key + '_d'
+                data[name] = defaults[key]
+            else:
+                values.append('DEFAULT')
+                continue
+            placeholder = name.join(('%(', ')s'))
+            if not i and key in casts:
+                placeholder += '::' + casts[key]
+            values.append(placeholder)
+        tuples.append(', '.join(values).join('()'))
+    return ', '.join(tuples), data
+
+
+def make_unnest_condition(key_cols, casts):
+    """
+    Für zusammengesetzte Schlüssel: Erzeuge ein Kriterium, das die
+    Schlüsselwerte spaltenweise als Arrays erwartet (ein Parameter je
+    Spalte, unabhängig von der Anzahl der Schlüssel); die Typen der
+    Arrays müssen angegeben werden:
+
+    >>> make_unnest_condition(['tan', 'status'], {'tan': 'int4',
+    ...                                           'status': 'text'})
+    '(tan, status) IN (SELECT * FROM unnest(%(tan)s::int4[], %(status)s::text[]))'
+
+    Array-Typen (wie von catalog.column_casts angegeben) werden nicht
+    nochmals zu Arrays:
+
+    >>> make_unnest_condition(['tags', 'id'], {'tags': 'text[]',
+    ...                                        'id': 'int4'})
+    '(tags, id) IN (SELECT * FROM unnest(%(tags)s::text[], %(id)s::int4[]))'
+
+    Für jede Spalte muß der Typ bekannt sein:
+
+    >>> make_unnest_condition(['tan', 'owner'], {'tan': 'int4'})
+    Traceback (most recent call last):
+      ...
+    ValueError: No type given for key column 'owner'
+    """
+    arrays = []
+    for col in key_cols:
+        check_name(col)
+        try:
+            cast = casts[col]
+        except KeyError:
+            raise ValueError('No type given for key column %(col)r'
+                             % locals())
+        if not cast.endswith('[]'):
+            cast += '[]'
+        arrays.append('%%(%s)s::%s' % (col, cast))
+    return ''.join(('(%s) IN (SELECT * FROM unnest(' % ', '.join(key_cols),
+                    ', '.join(arrays),
+                    '))',
+                    ))
+
+
+def make_conflict_clause(conflict_cols, update_cols=None):
+    """
+    Für INSERT ... ON CONFLICT ("Upsert"; PostgreSQL 9.5+): Erzeuge die
+    ON CONFLICT-Klausel; die zu aktualisierenden Felder erhalten die Werte
+    der abgewiesenen Zeile (EXCLUDED):
+
+    >>> make_conflict_clause(['tan'], ['status', 'owner_id'])
+    'ON CONFLICT (tan) DO UPDATE SET status = EXCLUDED.status, owner_id = EXCLUDED.owner_id'
+
+    Ohne zu aktualisierende Felder wird die Zeile nur ggf. eingefügt:
+
+    >>> make_conflict_clause('tan')
+    'ON CONFLICT (tan) DO NOTHING'
+    """
+    if not is_sequence(conflict_cols):
+        conflict_cols = [conflict_cols]
+    if not conflict_cols:
+        raise ValueError('ON CONFLICT: no conflict columns given!')
+    res = ['ON CONFLICT',
+           '(%s)' % ', '.join(map(check_name, conflict_cols)),
+           ]
+    if update_cols:
+        res.append('DO UPDATE SET')
+        res.append(', '.join(['%s = EXCLUDED.%s' % (check_name(col), col)
+                              for col in update_cols
+                              ]))
+    else:
+        res.append('DO NOTHING')
+    return ' '.join(res)
+
+
+def iter_chunks(rows, chunksize, key_cols=None):
+    """
+    Teile die Zeilen (ein beliebiges iterierbares Objekt) in Listen von
+    jeweils höchstens <chunksize> Elementen:
+
+    >>> list(iter_chunks(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+
+    Werden Schlüsselfelder angegeben, beginnt zudem ein neuer Block, bevor
+    ein Schlüssel (in einem Dictionary) zum zweiten Mal vorkommt; das ist
+    z. B. für INSERT ... ON CONFLICT DO UPDATE nötig, wo eine Zeile nicht
+    zweimal von derselben Anweisung geändert werden darf.
+    Schlüssel mit NULL-Werten kollidieren nicht:
+
+    >>> rows = [{'id': 1}, {'id': 2}, {'id': 1}, {'id': None}, {}]
+    >>> [[row.get('id') for row in chunk]
+    ...  for chunk in iter_chunks(rows, 10, ['id'])]
+    [[1, 2], [1, None, None]]
+    """
+    chunk = []
+    seen = set()
+    for row in rows:
+        key = None
+        if key_cols is not None:
+            key = tuple([row.get(col) for col in key_cols])
+            if None in key:
+                key = None
+        if len(chunk) >= chunksize or key in seen:
+            yield chunk
+            chunk = []
+            seen = set()
+        if key is not None:
+            seen.add(key)
+        chunk.append(row)
+    if chunk:
+        yield chunk
+
 def extract_dict(fields, source, pop=1, noempty=1):
     """
     Extrahiere die angegebenen Felder aus dem Quell-Dictionary,